@@ -1,8 +1,11 @@
-from typing import List, Dict
+from typing import List, Dict, Set, Tuple
+from collections.abc import Mapping
 from dataclasses import dataclass
 from enum import Enum
 from copy import deepcopy
+import copy
 import math
+import numpy as np
 import tqdm
 
 
@@ -12,7 +15,10 @@ class HumanStatus(Enum):
 
 
 from probability import bayesian_p_zoonotic
-from simulator import seconds_to_sim_ticks
+from sim_time import seconds_to_sim_ticks
+from contacts import NO_END, ContactLog
+from streams import RandomStream
+from trajectory import Trajectory
 import user
 
 CONTACT_NETWORK_PROXIMITY_THRESHOLD = 20
@@ -25,13 +31,96 @@ class LocationRecord:
     y: float
 
 
-@dataclass
+# Read-only time -> LocationRecord mapping over sorted keyframe arrays, which may
+# be memory-mapped (see loader.py), for use as a location history /
+# migration pattern without a LocationRecord per keyframe. Records are created
+# when looked up.
+class KeyframeHistory(Mapping):
+    def __init__(self, times: np.ndarray, xs: np.ndarray, ys: np.ndarray):
+        self.trajectory = Trajectory.from_arrays(times, xs, ys)
+
+    # Keyframes (a dict, or another history) as int32 ticks and float32
+    # positions, 12 bytes each instead of a dict entry and LocationRecord.
+    # Positions are rounded to float32, so trials differ slightly from ones run
+    # on the full-precision keyframes.
+    @classmethod
+    def compact(cls, keyframes: Mapping) -> "KeyframeHistory":
+        if isinstance(keyframes, KeyframeHistory):
+            t = keyframes.trajectory
+            times, xs, ys = np.asarray(t.times), t.xs, t.ys
+        else:
+            ticks = sorted(keyframes)
+            times = np.array(ticks, dtype=np.int64)
+            xs = np.array([keyframes[t].x for t in ticks], dtype=float)
+            ys = np.array([keyframes[t].y for t in ticks], dtype=float)
+
+        limits = np.iinfo(np.int32)
+        if len(times) and (times[0] < limits.min or times[-1] > limits.max):
+            raise ValueError(f"Keyframe ticks {times[0]}..{times[-1]} overflow int32")
+        return cls(times.astype(np.int32), xs.astype(np.float32), ys.astype(np.float32))
+
+    def _index(self, t) -> int:
+        times = self.trajectory.times
+        n = int(np.searchsorted(times, t))
+        return n if n < len(times) and times[n] == t else -1
+
+    def __contains__(self, t):
+        return self._index(t) >= 0
+
+    def __getitem__(self, t) -> LocationRecord:
+        n = self._index(t)
+        if n < 0:
+            raise KeyError(t)
+        return LocationRecord(
+            x=float(self.trajectory.xs[n]), y=float(self.trajectory.ys[n])
+        )
+
+    def __iter__(self):
+        return (int(t) for t in self.trajectory.times)
+
+    def __len__(self):
+        return len(self.trajectory)
+
+    # immutable, so shared between copies
+    def __deepcopy__(self, memo):
+        return self
+
+
+def trajectory_of(keyframes: Dict[int, LocationRecord]) -> Trajectory:
+    if isinstance(keyframes, KeyframeHistory):
+        return keyframes.trajectory
+    return Trajectory(keyframes)
+
+
+# View of one row of a simulation's ContactLog (contacts.py)
 class HumanContactRecord:
-    other_id: int
-    other_status: HumanStatus  # other person's status at time of contact
-    start_time: int
-    total_proximity: float
-    end_time: int = None
+    __slots__ = ("log", "row")
+
+    def __init__(self, log: ContactLog, row: int):
+        self.log = log
+        self.row = row
+
+    @property
+    def other_id(self) -> int:
+        return int(self.log.b[self.row])
+
+    # other person's status at time of contact
+    @property
+    def other_status(self) -> HumanStatus:
+        return HumanStatus(int(self.log.other_status[self.row]))
+
+    @property
+    def start_time(self) -> int:
+        return int(self.log.start[self.row])
+
+    @property
+    def end_time(self):
+        end = int(self.log.end[self.row])
+        return None if end == NO_END else end
+
+    @property
+    def total_proximity(self) -> float:
+        return float(self.log.total_proximity[self.row])
 
     def duration(self):
         return self.end_time - self.start_time
@@ -47,10 +136,14 @@ class HumanContactRecord:
 class HumanSicknessRecord:
     start_time: int
     start_infection_model: user.InfectionModel
-    p_zoonotic: float = 0
     end_time: int = None
     secondary_cases: int = 0
 
+    # computed when read or exported rather than on every tick
+    @property
+    def p_zoonotic(self) -> float:
+        return user.zoonotic_probability_model(self)
+
     def __repr__(self):
         return f"(p_zoonotic={self.p_zoonotic}, start={self.start_time}, end={self.end_time}, start_animal_hazard={self.start_infection_model.experienced_animal_hazard}, start_human_hazard={self.start_infection_model.experienced_human_hazard}, secondary_cases={self.secondary_cases})"
 
@@ -63,21 +156,36 @@ class Human:
         location_history: Dict[int, LocationRecord],
         reports: Dict[int, HumanStatus],
     ):
+        # dataset, never modified so it can be shared by every trial
         self.id: int = id
         self.location_history: Dict[int, LocationRecord] = (
             location_history  # time -> location
         )
         self.self_reports: Dict[int, HumanStatus] = reports  # time -> report
-
-        self.location: LocationRecord = self.location_history[
-            min(self.location_history)
-        ]
+        self.trajectory: Trajectory = trajectory_of(location_history)
+
+        # this trial's random streams, given by the simulation the human is
+        # added to (Simulation.add_agent)
+        self.motion_stream: RandomStream = None
+        self.infection_stream: RandomStream = None
+
+        self.reset()
+
+    # (Re)initializes the state a trial changes
+    def reset(self):
+        # the first keyframe is the agent's own copy, moved by the motion model
+        # until (and through) its time, see keyframe()
+        first = self.location_history[self.trajectory.start_time()]
+        self.start_location: LocationRecord = LocationRecord(x=first.x, y=first.y)
+        self.location: LocationRecord = self.start_location
         self.status: HumanStatus = HumanStatus.HEALTHY
         self.prev_status: HumanStatus = HumanStatus.HEALTHY
 
-        self.contact_network: Dict[int, HumanContactRecord] = {}  # time -> contact
         self.sickness_records: List[HumanSicknessRecord] = []
-        self.active_contacts: Dict[int, HumanContactRecord] = {}  # other id -> contact
+
+        # ContactLog rows of our closed contacts counted as secondary cases of
+        # the current sickness record
+        self.secondary_contacts: Set[int] = set()
 
         self.infection_model: user.InfectionModel = user.InfectionModel(
             output_hazard=0.0,
@@ -85,9 +193,22 @@ class Human:
             experienced_human_hazard=0.0,
         )
 
+    # a fresh agent for a new trial, sharing this one's dataset
+    def trial_copy(self) -> "Human":
+        human = copy.copy(self)
+        human.reset()
+        return human
+
+    # location at keyframe time t, as seen by the motion model
+    def keyframe(self, t: int) -> LocationRecord:
+        if t == self.trajectory.start_time():
+            return self.start_location
+        return self.location_history[t]
+
     def move(self, sim):
         if sim.time_step in self.location_history:
-            self.location = self.location_history[sim.time_step]
+            # a copy, so the motion model never moves the dataset's records
+            self.location = copy.copy(self.keyframe(sim.time_step))
         else:
             user.human_motion(self, sim.time_step)
 
@@ -97,7 +218,20 @@ class Human:
     def update(self, sim):
         # check if previous contacts are sick, update filter
 
-        # check if in animal radius, update filter
+        current_animal_contacts = self.animal_contacts(sim)
+        self.update_contacts(sim)
+
+        current_human_contacts = [
+            sim.human_agents[h] for h in self.active_contacts(sim)
+        ]
+
+        got_sick = user.infection_probability_model(
+            self, current_animal_contacts, current_human_contacts
+        )
+        self.update_sickness(sim, got_sick)
+
+    # check if in animal radius, update filter
+    def animal_contacts(self, sim) -> List["AnimalPresence"]:
         current_animal_contacts: List[AnimalPresence] = []
         for animal in sim.animal_agents:
             dx = self.location.x - animal.location.x
@@ -107,8 +241,16 @@ class Human:
             if dist <= animal.radius:
                 # self.hazard_experienced += animal.hazard_rate
                 current_animal_contacts.append(animal)
+        return current_animal_contacts
+
+    # other id -> row of our open contacts in the simulation's ContactLog, in
+    # the order they opened
+    def active_contacts(self, sim) -> Dict[int, int]:
+        return sim.contacts.open_contacts.of(self.id)
 
-        # check if in contact with a person, update network + filter
+    # check if in contact with a person, update network + filter
+    def update_contacts(self, sim):
+        active_contacts = self.active_contacts(sim)
         for human in sim.human_agents.values():
             if human.id == self.id:
                 continue
@@ -118,32 +260,21 @@ class Human:
             dist = math.sqrt(dx**2 + dy**2)
 
             if dist <= CONTACT_NETWORK_PROXIMITY_THRESHOLD:
-                if human.id in self.active_contacts:
+                if human.id in active_contacts:
                     # we were already in contact with this person
-                    self.active_contacts[human.id].total_proximity += dist
+                    sim.contacts.total_proximity[active_contacts[human.id]] += dist
                 else:
                     # otherwise create a new contact record
-                    record = HumanContactRecord(
-                        other_id=human.id,
-                        other_status=human.status,
-                        start_time=sim.time_step,
-                        total_proximity=dist,
+                    sim.contacts.open(
+                        self.id, human.id, sim.time_step, dist, human.status
                     )
-                    self.active_contacts[human.id] = record
             else:
                 # check if we went out of conact
-                if human.id in self.active_contacts:
-                    record = self.active_contacts.pop(human.id)
-                    record.end_time = sim.time_step
-                    self.contact_network[record.start_time] = record
+                if human.id in active_contacts:
+                    self.close_contact(sim, active_contacts[human.id])
 
-        current_human_contacts = [
-            sim.human_agents[h] for h in self.active_contacts.keys()
-        ]
-
-        got_sick = user.infection_probability_model(
-            self, current_animal_contacts, current_human_contacts
-        )
+    # shared by every simulation engine once contacts and hazards are up to date
+    def update_sickness(self, sim, got_sick: bool):
         # add sickness event / update status if simulated sick
         if got_sick and self.status != HumanStatus.SICK:
             # print(f"t={sim.time_step} Human {self.id} simulated sick!")
@@ -158,14 +289,11 @@ class Human:
                     start_infection_model=deepcopy(self.infection_model),
                 )
                 self.sickness_records.append(record)
+                self.on_sickness_onset(sim)
 
             secondary_cases = self.secondary_cases(sim)
             self.sickness_records[-1].secondary_cases = secondary_cases
 
-            self.sickness_records[-1].p_zoonotic = user.zoonotic_probability_model(
-                self.sickness_records[-1]
-            )
-
         elif (
             self.status == HumanStatus.HEALTHY and self.prev_status == HumanStatus.SICK
         ):
@@ -173,32 +301,67 @@ class Human:
 
         self.prev_status = self.status
 
-    # only counts one case per sick contacted individual
-    def secondary_cases(self, sim):
-        if len(self.sickness_records) == 0 or self.status != HumanStatus.SICK:
-            raise ValueError("Tried to calculate secondary cases when not sick!")
+    # closed contacts, in the order they started
+    def contact_network(self, sim) -> List[HumanContactRecord]:
+        return [
+            HumanContactRecord(sim.contacts, row)
+            for row in sim.contacts.closed_rows(self.id).tolist()
+        ]
+
+    # ends an active contact (a ContactLog row); shared by every engine
+    def close_contact(self, sim, row: int):
+        sim.contacts.close(row, sim.time_step)
+
+        if self.is_sickness_open() and self.is_secondary_case(sim, row):
+            self.secondary_contacts.add(row)
+
+    def is_sickness_open(self) -> bool:
+        return (
+            len(self.sickness_records) > 0
+            and self.sickness_records[-1].end_time is None
+        )
 
+    # whether a closed contact counts towards the current sickness record: it
+    # started once we were infectious, the other person was healthy then, and
+    # has fallen sick since
+    def is_secondary_case(self, sim, row: int) -> bool:
+        log = sim.contacts
         infectious_at = self.sickness_records[-1].start_time - INCUBATION_SIM_TIME
-        secondary_cases = 0
+        if (
+            log.start[row] < infectious_at
+            or log.other_status[row] != HumanStatus.HEALTHY.value
+        ):
+            return False
 
-        for c in self.contact_network.values():
-            if c.start_time >= infectious_at:
-                other = sim.human_agents[c.other_id]
-                incremented = False
-                for sickness in other.sickness_records:
-                    if (
-                        sickness.start_time >= infectious_at
-                        and c.other_status == HumanStatus.HEALTHY
-                    ):
-                        secondary_cases += 1
-                        incremented = True
-                        break
+        other = sim.human_agents[int(log.b[row])]
+        return (
+            len(other.sickness_records) > 0
+            and other.sickness_records[-1].start_time >= infectious_at
+        )
 
-                if incremented:
-                    # only count each contacted person once
-                    break
+    # called once a new sickness record has been appended
+    def on_sickness_onset(self, sim):
+        # our own contacts since becoming infectious
+        infectious_at = self.sickness_records[-1].start_time - INCUBATION_SIM_TIME
+        self.secondary_contacts = set()
+        for row in sim.contacts.closed_rows(self.id, since=infectious_at).tolist():
+            if self.is_secondary_case(sim, row):
+                self.secondary_contacts.add(row)
+
+        # everyone who closed a contact with us while we were healthy
+        for row in sim.contacts.closed_rows_with(self.id).tolist():
+            other = sim.human_agents[int(sim.contacts.a[row])]
+            if other.is_sickness_open() and other.is_secondary_case(sim, row):
+                other.secondary_contacts.add(row)
+
+    # Kept up to date by close_contact / on_sickness_onset instead of scanning the
+    # contact log. Reports at most one case, as the scan this replaces stopped
+    # at the first contact it counted.
+    def secondary_cases(self, sim):
+        if len(self.sickness_records) == 0 or self.status != HumanStatus.SICK:
+            raise ValueError("Tried to calculate secondary cases when not sick!")
 
-        return secondary_cases
+        return min(len(self.secondary_contacts), 1)
 
 
 class AnimalPresence:
@@ -210,21 +373,66 @@ class AnimalPresence:
     ):
         self.id: int = id
         self.migration_pattern: Dict[int, LocationRecord] = migration_pattern
-        self.location: LocationRecord = self.migration_pattern[
-            min(self.migration_pattern)
-        ]
-        self.radius: float = radius
+        self.trajectory: Trajectory = trajectory_of(migration_pattern)
+        self.hazard_rate = hazard_rate
+        self.start_radius = radius
+
+        # see Human
+        self.motion_stream: RandomStream = None
+
+        self.reset()
+
+    # (Re)initializes the state a trial changes, see Human.reset
+    def reset(self):
+        first = self.migration_pattern[self.trajectory.start_time()]
+        self.start_location: LocationRecord = LocationRecord(x=first.x, y=first.y)
+        self.location: LocationRecord = self.start_location
+        self.radius: float = self.start_radius
         self.infection_model: user.InfectionModel = user.InfectionModel(
-            output_hazard=hazard_rate,
+            output_hazard=self.hazard_rate,
             experienced_animal_hazard=0.0,
             experienced_human_hazard=0.0,
         )
 
+    def trial_copy(self) -> "AnimalPresence":
+        animal = copy.copy(self)
+        animal.reset()
+        return animal
+
+    def keyframe(self, t: int) -> LocationRecord:
+        if t == self.trajectory.start_time():
+            return self.start_location
+        return self.migration_pattern[t]
+
     def move(self, sim):
         if sim.time_step in self.migration_pattern:
-            self.location = self.migration_pattern[sim.time_step]
+            self.location = copy.copy(self.keyframe(sim.time_step))
         else:
             user.animal_motion(self)
 
     def update(self, sim):
         pass
+
+
+# the agents, sharing everything but their keyframes, which are made compact
+# (KeyframeHistory.compact)
+def compact_agents(animals: List[AnimalPresence], humans: List[Human]):
+    return (
+        [
+            AnimalPresence(
+                id=a.id,
+                migration_pattern=KeyframeHistory.compact(a.migration_pattern),
+                radius=a.start_radius,
+                hazard_rate=a.hazard_rate,
+            )
+            for a in animals
+        ],
+        [
+            Human(
+                id=h.id,
+                location_history=KeyframeHistory.compact(h.location_history),
+                reports=h.self_reports,
+            )
+            for h in humans
+        ],
+    )
@@ -0,0 +1,292 @@
+from dataclasses import dataclass, fields
+from typing import List
+import numpy as np
+
+from agents import *
+from trajectory import Trajectory, TrajectorySchedule
+import user
+
+
+@dataclass
+class BatchResults:
+    # (humans x num_trials), rows indexed by human id as in
+    # results.results_matrices, zeros for ids no human has
+    secondary_cases: np.ndarray
+    animal_hazard: np.ndarray
+    human_hazard: np.ndarray
+    p_zoonotic: np.ndarray
+
+
+NO_ONSET = -(10**9)
+
+
+# numpy Generator stand-in for the batched models whose draws are all
+# transformed uniforms, so different models reading the same stream get
+# comonotone noise (common random numbers). With antithetic set, the second
+# half of the trial axis (the first axis of every draw) mirrors the first,
+# drawing 1 - u wherever the first half draws u.
+class CommonRandomStream:
+    def __init__(self, seed, antithetic: bool = False):
+        self.rng = np.random.default_rng(seed)
+        self.antithetic = antithetic
+
+    def random(self, size) -> np.ndarray:
+        if not self.antithetic:
+            return self.rng.random(size)
+
+        half = self.rng.random((size[0] // 2,) + tuple(size[1:]))
+        return np.concatenate([half, 1 - half])
+
+    def integers(self, low, high, size, endpoint=False) -> np.ndarray:
+        n = high - low + (1 if endpoint else 0)
+        # 1 - u can be 1, which would fall one past the highest value
+        return low + np.minimum((self.random(size) * n).astype(np.int64), n - 1)
+
+
+# Per-tick trajectory schedules of a group of agents, stacked as
+# (agents x ticks) arrays and shared by every trial
+class KeyframeSchedule:
+    def __init__(self, trajectories: List[Trajectory], num_ticks: int):
+        schedules = [t.schedule(num_ticks) for t in trajectories]
+        for field in fields(TrajectorySchedule):
+            rows = [getattr(schedule, field.name) for schedule in schedules]
+            setattr(
+                self,
+                field.name,
+                np.stack(rows) if rows else np.zeros((0, num_ticks), dtype=bool),
+            )
+
+        self.start_x = np.array([t.xs[0] for t in trajectories], dtype=float)
+        self.start_y = np.array([t.ys[0] for t in trajectories], dtype=float)
+
+
+# Runs num_trials independent trials of the same humans and animals in lockstep,
+# holding every piece of mutable state as (trial x agent) arrays. Follows the
+# per-agent engine's update order, and fills the result matrices directly.
+# Human motion, animal motion and infection each draw from their own stream, so
+# runs with the same seed but different models share their random numbers
+# wherever the models draw alike. antithetic pairs trial k with trial
+# k + num_trials / 2, which gets the mirrored draws.
+class BatchedTrials:
+    def __init__(
+        self,
+        humans: List[Human],
+        animals: List[AnimalPresence],
+        num_trials: int,
+        num_ticks: int,
+        seed=None,
+        antithetic: bool = False,
+    ):
+        if antithetic and num_trials % 2:
+            raise ValueError("Antithetic trials come in pairs, num_trials must be even")
+
+        self.num_trials = num_trials
+        self.num_ticks = num_ticks
+        human_motion_seed, animal_motion_seed, infection_seed = np.random.SeedSequence(
+            seed
+        ).spawn(3)
+        self.human_motion_rng = CommonRandomStream(human_motion_seed, antithetic)
+        self.animal_motion_rng = CommonRandomStream(animal_motion_seed, antithetic)
+        self.infection_rng = CommonRandomStream(infection_seed, antithetic)
+        self.time_step = 0
+
+        num_humans = len(humans)
+        num_animals = len(animals)
+        shape = (num_trials, num_humans)
+        self.human_ids = np.array([h.id for h in humans], dtype=np.int64)
+
+        self.human_schedule = KeyframeSchedule(
+            [h.trajectory for h in humans], num_ticks
+        )
+        self.animal_schedule = KeyframeSchedule(
+            [a.trajectory for a in animals], num_ticks
+        )
+
+        # self-reports as (humans x ticks): -1 no report, else the reported status
+        self.reports = np.full((num_humans, num_ticks), -1, dtype=np.int8)
+        for i, h in enumerate(humans):
+            for t, status in h.self_reports.items():
+                if t < num_ticks:
+                    self.reports[i, t] = status.value
+
+        # humans are tracked as each trial's offset from a path shared by all trials
+        self.ex = np.zeros(shape)
+        self.ey = np.zeros(shape)
+        self.hx = np.tile(self.human_schedule.start_x, (num_trials, 1))
+        self.hy = np.tile(self.human_schedule.start_y, (num_trials, 1))
+        self.ax = np.tile(self.animal_schedule.start_x, (num_trials, 1))
+        self.ay = np.tile(self.animal_schedule.start_y, (num_trials, 1))
+        self.radius = np.tile([a.radius for a in animals], (num_trials, 1)).astype(
+            float
+        )
+        self.animal_output_hazard = np.array(
+            [a.infection_model.output_hazard for a in animals], dtype=float
+        )
+
+        self.sick = np.zeros(shape, dtype=bool)
+        self.prev_sick = np.zeros(shape, dtype=bool)
+        self.output_hazard = np.tile(
+            [h.infection_model.output_hazard for h in humans], (num_trials, 1)
+        ).astype(float)
+        self.animal_hazard = np.zeros(shape)
+        self.human_hazard = np.zeros(shape)
+
+        # open contacts (trial, human, other): start tick and whether the other
+        # person was healthy when the contact started
+        self.in_contact = np.zeros((num_trials, num_humans, num_humans), dtype=bool)
+        self.contact_start = np.zeros(
+            (num_trials, num_humans, num_humans), dtype=np.int32
+        )
+        self.contact_other_healthy = np.zeros(
+            (num_trials, num_humans, num_humans), dtype=bool
+        )
+
+        # closed contacts (trial, human, other): start tick of the latest one
+        # the other person was healthy at the start of, the only one that
+        # matters for secondary cases
+        self.latest_healthy_start = np.full(
+            (num_trials, num_humans, num_humans), NO_ONSET, dtype=np.int64
+        )
+
+        # sickness records: only the latest one matters for the results, apart
+        # from secondary cases which are summed over all of them
+        self.last_onset = np.full(shape, NO_ONSET, dtype=np.int64)
+        self.start_animal_hazard = np.zeros(shape)
+        self.start_human_hazard = np.zeros(shape)
+        self.secondary_cases = np.zeros(shape, dtype=np.int64)
+        self.past_secondary_cases = np.zeros(shape, dtype=np.int64)
+
+        self.updated_before = np.tri(num_humans, k=-1, dtype=bool)
+
+    def _move(self):
+        t = self.time_step
+
+        path_x, path_y = user.batch_human_motion(
+            self.ex, self.ey, self.human_schedule, t, self.human_motion_rng
+        )
+        self.hx = path_x + self.ex
+        self.hy = path_y + self.ey
+
+        reported = self.reports[:, t] >= 0
+        self.sick[:, reported] = self.reports[reported, t] == HumanStatus.SICK.value
+
+        schedule = self.animal_schedule
+        snap = schedule.snap[:, t]
+        self.ax[:, snap] = schedule.held_x[snap, t]
+        self.ay[:, snap] = schedule.held_y[snap, t]
+        moving = ~schedule.keyframe[:, t]
+        user.batch_animal_motion(
+            self.ax, self.ay, self.radius, moving, self.animal_motion_rng
+        )
+
+    def update(self):
+        t = self.time_step
+        self._move()
+
+        # proximity masks (trials x humans x animals / humans)
+        dx = self.hx[:, :, None] - self.ax[:, None, :]
+        dy = self.hy[:, :, None] - self.ay[:, None, :]
+        animal_contacts = np.sqrt(dx**2 + dy**2) <= self.radius[:, None, :]
+
+        dx = self.hx[:, :, None] - self.hx[:, None, :]
+        dy = self.hy[:, :, None] - self.hy[:, None, :]
+        human_contacts = (
+            np.sqrt(dx**2 + dy**2) <= CONTACT_NETWORK_PROXIMITY_THRESHOLD
+        ) & ~np.eye(self.hx.shape[1], dtype=bool)
+
+        opened = human_contacts & ~self.in_contact
+        closed = self.in_contact & ~human_contacts
+
+        # hazards; human i sees this tick's output hazard of every j < i
+        new_output_hazard = user.batch_output_hazard(self.sick)
+        animal_exposure = animal_contacts @ self.animal_output_hazard
+        human_exposure = np.einsum(
+            "tij,tj->ti", human_contacts & self.updated_before, new_output_hazard
+        ) + np.einsum(
+            "tij,tj->ti", human_contacts & ~self.updated_before, self.output_hazard
+        )
+        got_sick = user.batch_infection_probability_model(
+            self.animal_hazard,
+            self.human_hazard,
+            animal_exposure,
+            human_exposure,
+            rng=self.infection_rng,
+        )
+        self.output_hazard = new_output_hazard
+        updated_sick = self.sick | got_sick
+
+        # close contacts; a later contact always starts later than an earlier one
+        closed_healthy = closed & self.contact_other_healthy
+        self.latest_healthy_start[closed_healthy] = self.contact_start[closed_healthy]
+
+        # open contacts; the other's status is seen after its update if j < i
+        other_sick = np.where(
+            self.updated_before[None, :, :],
+            updated_sick[:, None, :],
+            self.sick[:, None, :],
+        )
+        self.contact_start[opened] = t
+        self.contact_other_healthy[opened] = ~other_sick[opened]
+        self.in_contact = human_contacts
+
+        self.sick = updated_sick
+        self._update_sickness()
+
+        self.time_step += 1
+
+    def _update_sickness(self):
+        t = self.time_step
+
+        onset = self.sick & ~self.prev_sick
+        previous_onset = self.last_onset.copy()
+        self.past_secondary_cases[onset] += self.secondary_cases[onset]
+        self.secondary_cases[onset] = 0
+        self.start_animal_hazard[onset] = self.animal_hazard[onset]
+        self.start_human_hazard[onset] = self.human_hazard[onset]
+        self.last_onset[onset] = t
+
+        if self.sick.any():
+            # secondary cases as in Human.secondary_cases: whether any closed
+            # contact since becoming infectious was healthy at the time and has
+            # fallen sick since; human i sees this tick's onsets of every j < i
+            infectious_at = self.last_onset - INCUBATION_SIM_TIME
+            other_onset = np.where(
+                self.updated_before[None, :, :],
+                self.last_onset[:, None, :],
+                previous_onset[:, None, :],
+            )
+            counted = (self.latest_healthy_start >= infectious_at[:, :, None]) & (
+                other_onset >= infectious_at[:, :, None]
+            )
+            secondary_cases = counted.any(axis=2).astype(np.int64)
+            self.secondary_cases[self.sick] = secondary_cases[self.sick]
+
+        self.prev_sick = self.sick.copy()
+
+    def run(self):
+        while self.time_step < self.num_ticks:
+            self.update()
+
+    def results(self) -> BatchResults:
+        # the latest record's posterior only depends on its starting hazard and
+        # final secondary cases, so it is evaluated once here for every trial
+        p_zoonotic = np.where(
+            self.last_onset != NO_ONSET,
+            user.batch_zoonotic_probability_model(
+                self.start_animal_hazard, self.secondary_cases
+            ),
+            0.0,
+        )
+
+        # (trials x humans) in the order humans were given -> rows by id
+        def by_id(values: np.ndarray) -> np.ndarray:
+            rows = np.zeros((self.human_ids.max(initial=-1) + 1, self.num_trials))
+            rows[self.human_ids] = values.T
+            return rows
+
+        return BatchResults(
+            secondary_cases=by_id(self.past_secondary_cases + self.secondary_cases),
+            animal_hazard=by_id(self.start_animal_hazard),
+            human_hazard=by_id(self.start_human_hazard),
+            p_zoonotic=by_id(p_zoonotic),
+        )
@@ -0,0 +1,251 @@
+from itertools import chain
+from time import perf_counter
+from typing import Dict, List
+import argparse
+import json
+import os
+import platform
+import sys
+import numpy as np
+
+from results import RESULT_VALUES, ResultsWriter
+from stats import ResultsSummary
+from sim_time import seconds_to_sim_ticks
+import data
+import simulator
+
+# Times the simulation engines on synthetic scenarios (data.build_synthetic) of
+# growing size: single Simulation.update calls, whole trial() runs and the full
+# trial loop of simulator.py. Results are saved as JSON with one number per
+# line, so comparing a run with a saved baseline, or diffing baselines, shows
+# which engine got slower where.
+BENCHMARK_DIR = os.path.join("data", "benchmarks")
+ENGINES = ["loop", "vectorized", "grid", "event", "batch"]
+SIZES = [10, 100]
+# slowdown over the baseline reported as a regression
+REGRESSION_TOLERANCE = 0.25
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+
+def _use(engine: str, num_humans: int, motion_model: str) -> str:
+    name = f"S{num_humans}"
+    if name not in data.DATASETS:
+        data.DATASETS[name] = lambda: data.build_synthetic(
+            data.synthetic_scenario(num_humans)
+        )
+    simulator.apply_settings(
+        {
+            "DATASET_DESC": name,
+            "DATASET_DIR": None,
+            "MOTION_MODEL_DESC": f"h_{motion_model}",
+            "SIM_ENGINE": "loop" if engine == "batch" else engine,
+            "HUMAN_MOTION_MODEL": motion_model,
+        }
+    )
+    simulator.BATCH_TRIALS = engine == "batch"
+    return name
+
+
+def _batch(num_trials: int, seed: int, num_ticks: int = None):
+    from batch import BatchedTrials
+
+    animals, humans = simulator.load_dataset()
+    return BatchedTrials(
+        humans=humans,
+        animals=animals,
+        num_trials=num_trials,
+        num_ticks=num_ticks or seconds_to_sim_ticks(simulator.STOP_SIM_AFTER) + 1,
+        seed=seed,
+    )
+
+
+# seconds per update (per tick of all trials for batch) over num_ticks, after a
+# first update that builds the engine's state
+def bench_update(engine: str, num_ticks: int, num_trials: int) -> float:
+    if engine == "batch":
+        sim = _batch(num_trials, seed=0, num_ticks=num_ticks + 1)
+    else:
+        sim = simulator.make_simulation(seed=0)
+        animals, humans = simulator.load_dataset()
+        for agent in chain(animals, humans):
+            sim.add_agent(agent.trial_copy())
+
+    sim.update()
+    start = perf_counter()
+    for _ in range(num_ticks):
+        sim.update()
+    return (perf_counter() - start) / num_ticks
+
+
+# best seconds per trial() out of repeats (per batch of num_trials for batch)
+def bench_trial(engine: str, num_trials: int, repeats: int) -> float:
+    times = []
+    for seed in range(repeats):
+        start = perf_counter()
+        if engine == "batch":
+            batch = _batch(num_trials, seed)
+            batch.run()
+            batch.results()
+        else:
+            simulator.trial(seed)
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+# trials per second through simulator.py's trial loop, results and summary
+# included, in this process
+def bench_trial_loop(engine: str, num_trials: int) -> float:
+    _, humans = simulator.load_dataset()
+    simulator.NUM_TRIALS = num_trials
+    simulator.NUM_WORKERS = 1
+    writer = ResultsWriter(
+        None, "benchmark", max(h.id for h in humans) + 1, num_trials, settings={}
+    )
+    summary = ResultsSummary(RESULT_VALUES, writer.num_humans)
+
+    start = perf_counter()
+    if engine == "batch":
+        simulator.run_batched_trials(0, writer, summary)
+    else:
+        simulator.run_trials(0, writer, summary)
+    return num_trials / (perf_counter() - start)
+
+
+def run_benchmarks(
+    engines: List[str],
+    sizes: List[int],
+    motion_model: str,
+    num_ticks: int,
+    num_trials: int,
+    repeats: int,
+) -> Dict[str, float]:
+    results = {}
+    for num_humans in sizes:
+        for engine in engines:
+            name = _use(engine, num_humans, motion_model)
+            data.load_dataset(name)  # built before timing
+
+            key = f"{engine}/{name}"
+            results[f"update_seconds/{key}"] = bench_update(
+                engine, num_ticks, num_trials
+            )
+            results[f"trial_seconds/{key}"] = bench_trial(engine, num_trials, repeats)
+            results[f"trials_per_second/{key}"] = bench_trial_loop(engine, num_trials)
+            print(
+                f"{key:<20} update {1e3 * results[f'update_seconds/{key}']:9.3f}ms  "
+                f"trial {results[f'trial_seconds/{key}']:8.3f}s  "
+                f"loop {results[f'trials_per_second/{key}']:9.2f} trials/s",
+                file=sys.stderr,
+            )
+    return results
+
+
+def save_baseline(path: str, results: Dict[str, float], settings: Dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(
+            {"settings": settings, "results": results}, f, indent=1, sort_keys=True
+        )
+        f.write("\n")
+
+
+# how many times slower each benchmark ran than in the baseline
+def slowdowns(results: Dict[str, float], baseline: Dict[str, float]):
+    ratios = {}
+    for key, value in results.items():
+        if key not in baseline:
+            continue
+        # rates are better when higher, times when lower
+        if key.startswith("trials_per_second/"):
+            ratios[key] = baseline[key] / value
+        else:
+            ratios[key] = value / baseline[key]
+    return ratios
+
+
+def print_comparison(ratios: Dict[str, float], tolerance: float) -> bool:
+    regressed = False
+    for key, ratio in ratios.items():
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{key:<45} x{ratio:6.2f}{flag}")
+    return regressed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the simulation engines on synthetic scenarios"
+    )
+    parser.add_argument("--engines", nargs="+", default=ENGINES, choices=ENGINES)
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=SIZES, help="numbers of humans"
+    )
+    parser.add_argument(
+        "--motion-model",
+        default="interp",
+        choices=["none", "random_walk", "noisy_interp", "interp"],
+        help="human motion model; the event engine needs none or interp",
+    )
+    parser.add_argument("--ticks", type=int, default=20, help="updates timed")
+    parser.add_argument(
+        "--trials", type=int, default=5, help="trials per trial loop and batch"
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="trial() runs timed")
+    parser.add_argument(
+        "--save",
+        metavar="PATH",
+        nargs="?",
+        const=BASELINE_PATH,
+        help=f"save the results as a baseline, by default to {BASELINE_PATH}",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="PATH",
+        nargs="?",
+        const=BASELINE_PATH,
+        help="compare the results with a saved baseline",
+    )
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    simulator.USE_DISPLAY = False
+
+    settings = {
+        "engines": args.engines,
+        "sizes": args.sizes,
+        "motion_model": args.motion_model,
+        "ticks": args.ticks,
+        "trials": args.trials,
+        "repeats": args.repeats,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+    }
+    results = run_benchmarks(
+        args.engines,
+        args.sizes,
+        args.motion_model,
+        args.ticks,
+        args.trials,
+        args.repeats,
+    )
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressed = print_comparison(slowdowns(results, baseline), args.tolerance)
+    # saved after comparing, so a run can be checked against and replace a baseline
+    if args.save:
+        save_baseline(args.save, results, settings)
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from statistics import NormalDist
+from typing import Dict
+import ast
+import numpy as np
+
+from batch import BatchedTrials, BatchResults
+from results import RESULT_VALUES
+import probability
+import user
+
+# setting a configuration can override -> the module the models read it from
+COMPARE_SETTINGS = {
+    "HUMAN_MOTION_MODEL": user,
+    "SIMULATE_SPREAD": user,
+    "HAZARD_DECAY": user,
+    "HUMAN_HAZARD_SICK": user,
+    "HUMAN_HAZARD_HEALTHY": user,
+    "PRIOR_PROBABILITY_ZOONOTIC": probability,
+    "EXPECTED_SECONDARY_CASES_ZOONOTIC": probability,
+    "EXPECTED_SECONDARY_CASES_NON_ZOONOTIC": probability,
+}
+
+
+# "NAME=VALUE,NAME=VALUE" -> overrides of user.py / probability.py settings,
+# e.g. "HUMAN_MOTION_MODEL=random_walk" or "HAZARD_DECAY=0.95,SIMULATE_SPREAD=True"
+def parse_config(text: str) -> Dict[str, object]:
+    overrides = {}
+    for setting in text.split(","):
+        name, _, value = setting.partition("=")
+        name = name.strip()
+        if name not in COMPARE_SETTINGS:
+            raise ValueError(
+                f"{name} cannot be compared, only {', '.join(COMPARE_SETTINGS)}"
+            )
+        try:
+            overrides[name] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            overrides[name] = value.strip()
+    return overrides
+
+
+@contextmanager
+def configured(overrides: Dict[str, object]):
+    saved = {name: getattr(COMPARE_SETTINGS[name], name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(COMPARE_SETTINGS[name], name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(COMPARE_SETTINGS[name], name, value)
+
+
+@dataclass
+class PairedDifference:
+    # per human, of a configuration's result minus the baseline's
+    mean: np.ndarray
+    ci_width: np.ndarray
+    # var(a) + var(b) over var(a - b): how many times more trials independent
+    # runs would need for the same interval
+    variance_reduction: np.ndarray
+
+
+# (humans x trials) results -> (humans x units) independent units: trials, or
+# the means of antithetic pairs
+def _units(values: np.ndarray, antithetic: bool) -> np.ndarray:
+    if not antithetic:
+        return values
+    half = values.shape[1] // 2
+    return (values[:, :half] + values[:, half:]) / 2
+
+
+def paired_difference(
+    values: np.ndarray, baseline: np.ndarray, antithetic: bool, level: float
+) -> PairedDifference:
+    a = _units(values, antithetic)
+    b = _units(baseline, antithetic)
+    diff = a - b
+    num_units = diff.shape[1]
+
+    var_diff = diff.var(axis=1, ddof=1)
+    var_independent = a.var(axis=1, ddof=1) + b.var(axis=1, ddof=1)
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance_reduction = var_independent / var_diff
+
+    return PairedDifference(
+        mean=diff.mean(axis=1),
+        ci_width=2 * z * np.sqrt(var_diff / num_units),
+        variance_reduction=variance_reduction,
+    )
+
+
+# Runs every configuration (name -> user.py overrides) as a batch of trials with
+# the same seed, so they share their random numbers: trial k of every
+# configuration sees the same draws wherever the models draw alike
+def run_comparison(
+    animals,
+    humans,
+    configs: Dict[str, Dict[str, object]],
+    num_trials: int,
+    num_ticks: int,
+    seed,
+    antithetic: bool = False,
+) -> Dict[str, BatchResults]:
+    results = {}
+    for name, overrides in configs.items():
+        with configured(overrides):
+            batch = BatchedTrials(
+                humans=humans,
+                animals=animals,
+                num_trials=num_trials,
+                num_ticks=num_ticks,
+                seed=seed,
+                antithetic=antithetic,
+            )
+            batch.run()
+            results[name] = batch.results()
+    return results
+
+
+# Paired differences of every configuration against the first one:
+# configuration -> result name -> PairedDifference
+def compare(
+    results: Dict[str, BatchResults], antithetic: bool = False, level: float = 0.95
+) -> Dict[str, Dict[str, PairedDifference]]:
+    baseline_name, *others = results
+    baseline = asdict(results[baseline_name])
+
+    return {
+        name: {
+            value: paired_difference(
+                asdict(results[name])[value], baseline[value], antithetic, level
+            )
+            for value in RESULT_VALUES
+        }
+        for name in others
+    }
+
+
+def print_comparison(results, differences, level: float = 0.95):
+    baseline_name = next(iter(results))
+    for name, by_value in differences.items():
+        print(f"*** {name} - {baseline_name} ***")
+        if all(not difference.mean.any() for difference in by_value.values()):
+            print("(no result differs: the overrides had no effect on these trials)")
+        for value, difference in by_value.items():
+            print(f"{RESULT_VALUES[value]}:")
+            for id in range(len(difference.mean)):
+                print(
+                    f"  human {id}: {difference.mean[id]:+.4f} "
+                    f"+/- {difference.ci_width[id] / 2:.4f} ({level:.0%} CI), "
+                    f"variance reduction x{difference.variance_reduction[id]:.1f}"
+                )
+
+
+def save_comparison(path, results, differences):
+    arrays = {}
+    for name, batch_results in results.items():
+        for value, matrix in asdict(batch_results).items():
+            arrays[f"{name}/{value}"] = matrix
+    for name, by_value in differences.items():
+        for value, difference in by_value.items():
+            for field, array in asdict(difference).items():
+                arrays[f"{name}/{value}_difference_{field}"] = array
+    np.savez(path, **arrays)
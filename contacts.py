@@ -0,0 +1,423 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Tuple
+import numpy as np
+
+NO_END = -1  # end of a contact that is still active
+OPEN_END = np.iinfo(np.int64).max  # end of an open contact in the end bounds
+
+# column -> dtype
+CONTACT_COLUMNS = {
+    "a": np.int32,  # id of the human who recorded the contact
+    "b": np.int32,  # id of the other human
+    "start": np.int32,
+    "end": np.int32,
+    "total_proximity": np.float64,
+    "other_status": np.int8,  # HumanStatus value of b when the contact started
+}
+
+
+CONTACT_WEIGHTS = ["duration", "average_proximity"]
+
+
+# human id -> rows the human is in, in row order, as growable arrays so a
+# human's rows are handed out as views
+class RowIndex:
+    def __init__(self):
+        self.rows: Dict[int, np.ndarray] = {}
+        self.counts: Dict[int, int] = {}
+
+    def append(self, id: int, row: int):
+        rows = self.rows.get(id)
+        count = self.counts.get(id, 0)
+        if rows is None:
+            rows = self.rows[id] = np.empty(4, dtype=np.int64)
+        elif count == len(rows):
+            grown = np.empty(2 * count, dtype=np.int64)
+            grown[:count] = rows
+            rows = self.rows[id] = grown
+        rows[count] = row
+        self.counts[id] = count + 1
+
+    def __getitem__(self, id: int) -> np.ndarray:
+        rows = self.rows.get(id)
+        if rows is None:
+            return np.zeros(0, dtype=np.int64)
+        return rows[: self.counts[id]]
+
+    @classmethod
+    def of(cls, ids: np.ndarray) -> "RowIndex":
+        index = cls()
+        rows = np.argsort(ids, kind="stable")
+        unique, starts = np.unique(ids[rows], return_index=True)
+        for id, chunk in zip(unique.tolist(), np.split(rows, starts[1:])):
+            index.rows[id] = chunk.astype(np.int64)
+            index.counts[id] = len(chunk)
+        return index
+
+
+# The open contacts of a ContactLog as a table of pairs (a, b), packed into
+# one int64 key ordered as (a, b), and their rows, sorted on the pair. It is
+# kept up to date by ContactLog.open / close, so a pair is looked up by binary
+# search and a human's open contacts are one run of the table. The columns are
+# split into chunks of typed arrays, each sorted and after the one before, so
+# inserting or deleting a pair only moves the rest of its chunk. A pair has one
+# open row at most; a newer row of a pair replaces an older one.
+class OpenContacts:
+    CHUNK_SIZE = 512  # pairs per chunk, which splits once twice as long
+
+    def __init__(self):
+        self.size = 0
+        self._keys: List[array] = []
+        self._rows: List[array] = []
+        self._last_keys: List[int] = []  # of each chunk
+
+    @staticmethod
+    def key(a, b):
+        return (a << 32) | (b & 0xFFFFFFFF)
+
+    def __len__(self):
+        return self.size
+
+    # the chunk a key is in or goes into, and where in it
+    def _find(self, key: int) -> Tuple[int, int]:
+        chunk = bisect_left(self._last_keys, key)
+        if chunk == len(self._last_keys):
+            chunk -= 1
+        return chunk, bisect_left(self._keys[chunk], key)
+
+    def add(self, a: int, b: int, row: int):
+        key = self.key(a, b)
+        if self.size == 0:
+            self._keys, self._rows = [array("q", [key])], [array("q", [row])]
+            self._last_keys = [key]
+            self.size = 1
+            return
+
+        chunk, n = self._find(key)
+        keys, rows = self._keys[chunk], self._rows[chunk]
+        if n < len(keys) and keys[n] == key:
+            rows[n] = row
+            return
+        keys.insert(n, key)
+        rows.insert(n, row)
+        self._last_keys[chunk] = keys[-1]
+        self.size += 1
+
+        if len(keys) >= 2 * self.CHUNK_SIZE:
+            half = len(keys) // 2
+            self._keys[chunk : chunk + 1] = [keys[:half], keys[half:]]
+            self._rows[chunk : chunk + 1] = [rows[:half], rows[half:]]
+            self._last_keys[chunk : chunk + 1] = [keys[half - 1], keys[-1]]
+
+    # removes the pair, if row is its open row
+    def discard(self, a: int, b: int, row: int):
+        key = self.key(a, b)
+        if self.size == 0:
+            return
+        chunk, n = self._find(key)
+        keys, rows = self._keys[chunk], self._rows[chunk]
+        if n == len(keys) or keys[n] != key or rows[n] != row:
+            return
+        del keys[n]
+        del rows[n]
+        self.size -= 1
+        if keys:
+            self._last_keys[chunk] = keys[-1]
+        else:
+            del self._keys[chunk], self._rows[chunk], self._last_keys[chunk]
+
+    # the open row of pair (a, b), or -1
+    def row(self, a: int, b: int) -> int:
+        key = self.key(a, b)
+        if self.size == 0:
+            return -1
+        chunk, n = self._find(key)
+        keys = self._keys[chunk]
+        if n < len(keys) and keys[n] == key:
+            return self._rows[chunk][n]
+        return -1
+
+    # row() of every pair of the id arrays a and b
+    def find(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        keys, rows = self._arrays()
+        wanted = self.key(np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64))
+        n = np.searchsorted(keys, wanted)
+        found = n < len(keys)
+        found[found] = keys[n[found]] == wanted[found]
+        result = np.full(len(wanted), -1, dtype=np.int64)
+        result[found] = rows[n[found]]
+        return result
+
+    # other id -> row of human a's open contacts, in the order they opened
+    def of(self, a: int) -> Dict[int, int]:
+        if self.size == 0:
+            return {}
+        first, last = a << 32, (a + 1) << 32
+        chunk = bisect_left(self._last_keys, first)
+        contacts = []
+        while chunk < len(self._keys):
+            keys = self._keys[chunk]
+            start = bisect_left(keys, first)
+            end = bisect_left(keys, last, start)
+            contacts += zip(self._rows[chunk][start:end], keys[start:end])
+            if end < len(keys):
+                break
+            chunk += 1
+        contacts.sort()
+        return {
+            (key & 0xFFFFFFFF) - ((key & 0x80000000) << 1): row for row, key in contacts
+        }
+
+    # copies, as the chunks cannot grow while their buffers are viewed
+    def _arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return (
+            np.concatenate(
+                [np.frombuffer(keys, dtype=np.int64) for keys in self._keys]
+            ),
+            np.concatenate(
+                [np.frombuffer(rows, dtype=np.int64) for rows in self._rows]
+            ),
+        )
+
+    # the (a, b, row) columns of every open contact, sorted on the pair
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        keys, rows = self._arrays()
+        a = (keys >> 32).astype(np.int32)
+        b = (keys & 0xFFFFFFFF).astype(np.uint32).astype(np.int32)
+        return a, b, rows
+
+    # a table of the given open rows; of rows of the same pair, the last counts
+    @classmethod
+    def of_rows(cls, a: np.ndarray, b: np.ndarray, rows: np.ndarray) -> "OpenContacts":
+        keys = cls.key(a.astype(np.int64), b.astype(np.int64))
+        order = np.lexsort((rows, keys))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = keys[order][1:] != keys[order][:-1]
+        keys, rows = keys[order[last]], rows[order[last]].astype(np.int64)
+
+        table = cls()
+        table.size = len(keys)
+        for start in range(0, len(keys), cls.CHUNK_SIZE):
+            chunk = slice(start, start + cls.CHUNK_SIZE)
+            table._keys.append(array("q", keys[chunk].tobytes()))
+            table._rows.append(array("q", rows[chunk].tobytes()))
+            table._last_keys.append(int(keys[chunk][-1]))
+        return table
+
+
+# Simulation-wide log of human-human contacts as growable typed columns. Each
+# side of a contact records its own row, as each human kept its own record.
+# Rows are only ever appended, so a row number identifies a contact for good.
+# The rows of every human, on either side, are indexed as they are appended,
+# so per-human queries only look at that human's rows. Rows open in tick
+# order, so start never decreases from row to row and bounds the rows that
+# can be under way before a tick; the running maximum of end (open contacts
+# never end) bounds those under way after one. Open contacts are also kept in
+# a table keyed on the pair, open_contacts.
+class ContactLog:
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        for name, dtype in CONTACT_COLUMNS.items():
+            setattr(self, name, np.empty(capacity, dtype=dtype))
+        self.rows_by_a = RowIndex()  # rows each human recorded
+        self.rows_by_b = RowIndex()  # rows each human was recorded in
+        self.open_contacts = OpenContacts()
+        self._max_end = np.empty(capacity, dtype=np.int64)
+        self._max_end_valid = 0  # rows the running maximum is up to date for
+
+    def _grow(self):
+        capacity = 2 * len(self.a)
+        for name in [*CONTACT_COLUMNS, "_max_end"]:
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[: self.size] = column[: self.size]
+            setattr(self, name, grown)
+
+    # returns the new contact's row
+    def open(self, a: int, b: int, start: int, proximity: float, other_status) -> int:
+        if self.size == len(self.a):
+            self._grow()
+
+        row = self.size
+        self.a[row] = a
+        self.b[row] = b
+        self.start[row] = start
+        self.end[row] = NO_END
+        self.total_proximity[row] = proximity
+        self.other_status[row] = other_status.value
+        self.size += 1
+
+        self.rows_by_a.append(a, row)
+        self.rows_by_b.append(b, row)
+        self.open_contacts.add(a, b, row)
+        return row
+
+    # only the filled rows are pickled, e.g. into snapshots (snapshot.py)
+    def __getstate__(self):
+        return {"size": self.size, **self.columns()}
+
+    def __setstate__(self, state):
+        self.size = state["size"]
+        capacity = max(self.size, 1024)
+        for name, dtype in CONTACT_COLUMNS.items():
+            column = np.empty(capacity, dtype=dtype)
+            column[: self.size] = state[name]
+            setattr(self, name, column)
+        self.rows_by_a = RowIndex.of(self.a[: self.size])
+        self.rows_by_b = RowIndex.of(self.b[: self.size])
+        rows = np.flatnonzero(self.end[: self.size] == NO_END)
+        self.open_contacts = OpenContacts.of_rows(self.a[rows], self.b[rows], rows)
+        self._max_end = np.empty(capacity, dtype=np.int64)
+        self._max_end_valid = 0
+
+    # a log of the given rows, e.g. rows gathered from several logs
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray]) -> "ContactLog":
+        log = cls.__new__(cls)
+        log.__setstate__({"size": len(columns["a"]), **columns})
+        return log
+
+    def close(self, row: int, end: int):
+        if self.end[row] == NO_END:
+            self.open_contacts.discard(int(self.a[row]), int(self.b[row]), row)
+        self.end[row] = end
+        if row < self._max_end_valid:
+            self._max_end_valid = row
+
+    # The latest end of the rows up to each row. Closing a row only lowers the
+    # maximum from that row on, so it is brought up to date from the first
+    # row closed or opened since it last was.
+    def _max_ends(self) -> np.ndarray:
+        valid = self._max_end_valid
+        if valid < self.size:
+            ends = self.end[valid : self.size].astype(np.int64)
+            ends[ends == NO_END] = OPEN_END
+            if valid:
+                ends[0] = max(ends[0], self._max_end[valid - 1])
+            np.maximum.accumulate(ends, out=self._max_end[valid : self.size])
+            self._max_end_valid = self.size
+        return self._max_end[: self.size]
+
+    # the filled part of every column; views, so a dump copies nothing
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name)[: self.size] for name in CONTACT_COLUMNS}
+
+    # rows of closed contacts recorded by human a, in the order they opened
+    def closed_rows(self, a: int, since: int = None) -> np.ndarray:
+        rows = self.rows_by_a[a]
+        if since is not None:
+            rows = rows[bisect_left(rows, since, key=self.start.__getitem__) :]
+        return rows[self.end[rows] != NO_END]
+
+    # rows of closed contacts other humans recorded with human b
+    def closed_rows_with(self, b: int) -> np.ndarray:
+        rows = self.rows_by_b[b]
+        return rows[self.end[rows] != NO_END]
+
+    # The part of rows, in row order, of contacts under way during any of
+    # ticks [start, end): a contact lasts from its start tick up to the tick
+    # it ended on, and open ones are still under way. Either bound may be left
+    # out. Both bounds are binary searches, so only the rows between them are
+    # looked at one by one.
+    def _overlapping(self, rows: np.ndarray, start: int = None, end: int = None):
+        if end is not None:
+            rows = rows[: bisect_left(rows, end, key=self.start.__getitem__)]
+        if start is None:
+            return rows
+        max_ends = self._max_ends()
+        rows = rows[bisect_right(rows, start, key=max_ends.__getitem__) :]
+        ends = self.end[rows]
+        return rows[(ends == NO_END) | (ends > start)]
+
+    # rows recorded by human a of contacts under way during [start, end), in
+    # the order they opened
+    def rows_of(self, a: int, start: int = None, end: int = None) -> np.ndarray:
+        return self._overlapping(self.rows_by_a[a], start, end)
+
+    # rows of every contact under way during [start, end)
+    def rows_during(self, start: int = None, end: int = None) -> np.ndarray:
+        size = self.size
+        lo = 0 if start is None else np.searchsorted(self._max_ends(), start, "right")
+        hi = size if end is None else np.searchsorted(self.start[:size], end, "left")
+        if start is None:
+            return np.arange(hi)
+        ends = self.end[lo:hi]
+        return lo + np.flatnonzero((ends == NO_END) | (ends > start))
+
+    # ids of the humans human a was in contact with during [start, end)
+    def contacts_of(self, a: int, start: int = None, end: int = None) -> np.ndarray:
+        return np.unique(self.b[self.rows_of(a, start, end)])
+
+    # The contact graph during [start, end) (all of it if left out) as a
+    # (humans x humans) SciPy CSR matrix indexed by id: entry (a, b) is the
+    # ticks a spent in contact with b within the window, or the average
+    # proximity over those ticks. Contacts still open count up to tick now,
+    # and are left out without it.
+    def adjacency(
+        self,
+        weight: str = "duration",
+        start: int = None,
+        end: int = None,
+        now: int = None,
+        num_humans: int = None,
+    ):
+        from scipy.sparse import csr_matrix
+
+        if weight not in CONTACT_WEIGHTS:
+            raise ValueError(
+                f"Unknown contact weight {weight}, expected one of "
+                f"{', '.join(CONTACT_WEIGHTS)}"
+            )
+
+        rows = self.rows_during(start, end)
+        ends = self.end[rows].astype(np.int64)
+        if now is None:
+            rows, ends = rows[ends != NO_END], ends[ends != NO_END]
+        else:
+            ends[ends == NO_END] = now
+        starts = self.start[rows].astype(np.int64)
+
+        # ticks within the window
+        window_starts = starts if start is None else np.maximum(starts, start)
+        window_ends = ends if end is None else np.minimum(ends, end)
+        ticks = window_ends - window_starts
+        kept = ticks > 0
+        rows, ticks = rows[kept], ticks[kept]
+        a, b = self.a[rows], self.b[rows]
+        if num_humans is None:
+            num_humans = int(max(a.max(initial=-1), b.max(initial=-1))) + 1
+        shape = (num_humans, num_humans)
+
+        durations = csr_matrix((ticks.astype(float), (a, b)), shape=shape)
+        if weight == "duration":
+            return durations
+
+        # each contact's average proximity, weighted by its ticks in the window
+        average = self.total_proximity[rows] / (ends[kept] - starts[kept])
+        proximity = csr_matrix((average * ticks, (a, b)), shape=shape)
+        proximity.data /= durations.data
+        return proximity
+
+    # ticks each contact lasted; open ones last up to tick now, and are given
+    # no ticks without it
+    def duration(self, now: int = None) -> np.ndarray:
+        ends = self.end[: self.size].astype(np.int64)
+        starts = self.start[: self.size].astype(np.int64)
+        open = ends == NO_END
+        ends[open] = starts[open] if now is None else now
+        return ends - starts
+
+    # NaN for contacts with no ticks, e.g. open ones without now
+    def average_proximity(self, now: int = None) -> np.ndarray:
+        duration = self.duration(now)
+        average = np.full(self.size, np.nan)
+        np.divide(
+            self.total_proximity[: self.size], duration, out=average, where=duration > 0
+        )
+        return average
+
+    def save(self, path: str):
+        np.savez(path, **self.columns())
@@ -1,5 +1,10 @@
+from dataclasses import dataclass
+from functools import partial
+import math
+import numpy as np
+
 from agents import *
-from simulator import seconds_to_sim_ticks
+from sim_time import seconds_to_sim_ticks
 
 
 def convert_locations(input):
@@ -47,7 +52,6 @@ RD_H0_LOCATIONS = [
     (500, 300, 275),
 ]
 RD_H0_REPORTS = [(310, HumanStatus.SICK)]
-RD_H0 = build_human(0, RD_H0_LOCATIONS, RD_H0_REPORTS)
 
 RD_H1_LOCATIONS = [
     (0, 50, 350),
@@ -57,22 +61,28 @@ RD_H1_LOCATIONS = [
     (500, 300, 200),
 ]
 RD_H1_REPORTS = [(450, HumanStatus.SICK)]
-RD_H1 = build_human(1, RD_H1_LOCATIONS, RD_H1_REPORTS)
-
 
-RD_HUMANS = [RD_H0, RD_H1]
 
 RD_A0_LOCATIONS = [(0, 200, 150)]
 RD_A0_RADIUS = 40
 RD_A0_HAZARD_RATE = 0.2
-RD_A0 = build_animal(0, RD_A0_LOCATIONS, RD_A0_RADIUS, RD_A0_HAZARD_RATE)
 
 RD_A1_LOCATIONS = [(0, 200, 350)]
 RD_A1_RADIUS = 40
 RD_A1_HAZARD_RATE = 0.05
-RD_A1 = build_animal(1, RD_A1_LOCATIONS, RD_A1_RADIUS, RD_A1_HAZARD_RATE)
 
-RD_ANIMALS = [RD_A0, RD_A1]
+
+def build_rd():
+    humans = [
+        build_human(0, RD_H0_LOCATIONS, RD_H0_REPORTS),
+        build_human(1, RD_H1_LOCATIONS, RD_H1_REPORTS),
+    ]
+    animals = [
+        build_animal(0, RD_A0_LOCATIONS, RD_A0_RADIUS, RD_A0_HAZARD_RATE),
+        build_animal(1, RD_A1_LOCATIONS, RD_A1_RADIUS, RD_A1_HAZARD_RATE),
+    ]
+    return animals, humans
+
 
 ### EXPERIMENTAL / AD-HOC DATASETS ###
 
@@ -88,7 +98,6 @@ D0_H0_LOCATIONS = [
     (600, 100, 500),
 ]  # contacts animal
 D0_H0_REPORTS = [(380, HumanStatus.SICK)]
-D0_H0 = build_human(0, D0_H0_LOCATIONS, D0_H0_REPORTS)
 
 D0_H1_LOCATIONS = [
     (0, 200, 100),
@@ -97,16 +106,22 @@ D0_H1_LOCATIONS = [
     (600, 300, 500),
 ]  # contacts other human, does not contact animal
 D0_H1_REPORTS = [(500, HumanStatus.SICK)]
-D0_H1 = build_human(1, D0_H1_LOCATIONS, D0_H1_REPORTS)
 
-D0_HUMANS = [D0_H0, D0_H1]
 
 D0_A0_LOCATIONS = [(0, 450, 150)]
 D0_A0_RADIUS = 100
 D0_A0_HAZARD_RATE = 0.05
-D0_A0 = build_animal(0, D0_A0_LOCATIONS, D0_A0_RADIUS, D0_A0_HAZARD_RATE)
 
-D0_ANIMALS = [D0_A0]
+
+def build_d0():
+    humans = [
+        build_human(0, D0_H0_LOCATIONS, D0_H0_REPORTS),
+        build_human(1, D0_H1_LOCATIONS, D0_H1_REPORTS),
+    ]
+    animals = [
+        build_animal(0, D0_A0_LOCATIONS, D0_A0_RADIUS, D0_A0_HAZARD_RATE),
+    ]
+    return animals, humans
 
 
 #### DATASET 3 ####
@@ -121,7 +136,6 @@ D3_H0_LOCATIONS = [
     (300, 500, 500),
 ]
 D3_H0_REPORTS = []
-D3_H0 = build_human(0, D3_H0_LOCATIONS, D3_H0_REPORTS)
 
 D3_H1_LOCATIONS = [
     (0, 500, 100),
@@ -133,7 +147,6 @@ D3_H1_LOCATIONS = [
     (300, 100, 500),
 ]
 D3_H1_REPORTS = []
-D3_H1 = build_human(1, D3_H1_LOCATIONS, D3_H1_REPORTS)
 
 D3_H2_LOCATIONS = [
     (0, 100, 500),
@@ -145,11 +158,9 @@ D3_H2_LOCATIONS = [
     (300, 500, 100),
 ]
 D3_H2_REPORTS = []
-D3_H2 = build_human(2, D3_H2_LOCATIONS, D3_H2_REPORTS)
 
 D3_H3_LOCATIONS = [(t, 300, 300) for t in range(0, 1001, 50)]
 D3_H3_REPORTS = []
-D3_H3 = build_human(3, D3_H3_LOCATIONS, D3_H3_REPORTS)
 
 D3_H4_LOCATIONS = [
     (200, 0, 0),
@@ -161,7 +172,6 @@ D3_H4_LOCATIONS = [
     (800, 600, 600),
 ]
 D3_H4_REPORTS = []
-D3_H4 = build_human(4, D3_H4_LOCATIONS, D3_H4_REPORTS)
 
 D3_H5_LOCATIONS = [
     (0, 600, 0),
@@ -172,14 +182,11 @@ D3_H5_LOCATIONS = [
     (1000, 0, 600),
 ]
 D3_H5_REPORTS = []
-D3_H5 = build_human(5, D3_H5_LOCATIONS, D3_H5_REPORTS)
 
-D3_HUMANS = [D3_H0, D3_H1, D3_H2, D3_H3, D3_H4, D3_H5]
 
 D3_A0_LOCATIONS = [(t, 450, 150) for t in range(0, 1001, 50)]
 D3_A0_RADIUS = 100
 D3_A0_HAZARD_RATE = 0.05
-D3_A0 = build_animal(0, D3_A0_LOCATIONS, D3_A0_RADIUS, D3_A0_HAZARD_RATE)
 
 D3_A1_LOCATIONS = [
     (t, int(200 + (200 * (t - 100) / 800)), int(200 + (200 * (t - 100) / 800)))
@@ -187,7 +194,6 @@ D3_A1_LOCATIONS = [
 ]
 D3_A1_RADIUS = 80
 D3_A1_HAZARD_RATE = 0.3
-D3_A1 = build_animal(1, D3_A1_LOCATIONS, D3_A1_RADIUS, D3_A1_HAZARD_RATE)
 
 D3_A2_LOCATIONS = [
     (t, int(100 + 20 * (t / 1000)), int(100 + 20 * (t / 1000)))
@@ -195,7 +201,6 @@ D3_A2_LOCATIONS = [
 ]
 D3_A2_RADIUS = 50
 D3_A2_HAZARD_RATE = 0.05
-D3_A2 = build_animal(2, D3_A2_LOCATIONS, D3_A2_RADIUS, D3_A2_HAZARD_RATE)
 
 D3_A3_LOCATIONS = [
     (t, int(500 - 400 * (t / 1000)), int(500 - 400 * (t / 1000)))
@@ -203,9 +208,24 @@ D3_A3_LOCATIONS = [
 ]
 D3_A3_RADIUS = 60
 D3_A3_HAZARD_RATE = 0.0
-D3_A3 = build_animal(3, D3_A3_LOCATIONS, D3_A3_RADIUS, D3_A3_HAZARD_RATE)
 
-D3_ANIMALS = [D3_A0, D3_A1, D3_A2, D3_A3]
+
+def build_d3():
+    humans = [
+        build_human(0, D3_H0_LOCATIONS, D3_H0_REPORTS),
+        build_human(1, D3_H1_LOCATIONS, D3_H1_REPORTS),
+        build_human(2, D3_H2_LOCATIONS, D3_H2_REPORTS),
+        build_human(3, D3_H3_LOCATIONS, D3_H3_REPORTS),
+        build_human(4, D3_H4_LOCATIONS, D3_H4_REPORTS),
+        build_human(5, D3_H5_LOCATIONS, D3_H5_REPORTS),
+    ]
+    animals = [
+        build_animal(0, D3_A0_LOCATIONS, D3_A0_RADIUS, D3_A0_HAZARD_RATE),
+        build_animal(1, D3_A1_LOCATIONS, D3_A1_RADIUS, D3_A1_HAZARD_RATE),
+        build_animal(2, D3_A2_LOCATIONS, D3_A2_RADIUS, D3_A2_HAZARD_RATE),
+        build_animal(3, D3_A3_LOCATIONS, D3_A3_RADIUS, D3_A3_HAZARD_RATE),
+    ]
+    return animals, humans
 
 
 #### DATASET 4 ####
@@ -218,7 +238,6 @@ D4_H0_LOCATIONS = [
     (600, 500, 100),
 ]
 D4_H0_REPORTS = [(550, HumanStatus.SICK)]
-D4_H0 = build_human(0, D4_H0_LOCATIONS, D4_H0_REPORTS)
 
 D4_H1_LOCATIONS = [
     (0, 20, 200),
@@ -228,30 +247,149 @@ D4_H1_LOCATIONS = [
     (600, 500, 300),
 ]
 D4_H1_REPORTS = [(500, HumanStatus.SICK)]
-D4_H1 = build_human(1, D4_H1_LOCATIONS, D4_H1_REPORTS)
 
 D4_H2_LOCATIONS = [
     (0, 200, 300),
 ]
 D4_H2_REPORTS = [(0, HumanStatus.SICK)]
-D4_H2 = build_human(2, D4_H2_LOCATIONS, D4_H2_REPORTS)
 
 D4_H3_LOCATIONS = [
     (0, 300, 300),
 ]
 D4_H3_REPORTS = [(0, HumanStatus.SICK)]
-D4_H3 = build_human(3, D4_H3_LOCATIONS, D4_H3_REPORTS)
 
-D4_HUMANS = [D4_H0, D4_H1, D4_H2, D4_H3]
 
 D4_A0_LOCATIONS = [(0, 300, 100)]
 D4_A0_RADIUS = 45
 D4_A0_HAZARD_RATE = 0.1
-D4_A0 = build_animal(0, D4_A0_LOCATIONS, D4_A0_RADIUS, D4_A0_HAZARD_RATE)
 
 D4_A1_LOCATIONS = [(0, 200, 100)]
 D4_A1_RADIUS = 5
 D4_A1_HAZARD_RATE = 0.005
-D4_A1 = build_animal(1, D4_A1_LOCATIONS, D4_A1_RADIUS, D4_A1_HAZARD_RATE)
 
-D4_ANIMALS = [D4_A0, D4_A1]
+
+def build_d4():
+    humans = [
+        build_human(0, D4_H0_LOCATIONS, D4_H0_REPORTS),
+        build_human(1, D4_H1_LOCATIONS, D4_H1_REPORTS),
+        build_human(2, D4_H2_LOCATIONS, D4_H2_REPORTS),
+        build_human(3, D4_H3_LOCATIONS, D4_H3_REPORTS),
+    ]
+    animals = [
+        build_animal(0, D4_A0_LOCATIONS, D4_A0_RADIUS, D4_A0_HAZARD_RATE),
+        build_animal(1, D4_A1_LOCATIONS, D4_A1_RADIUS, D4_A1_HAZARD_RATE),
+    ]
+    return animals, humans
+
+
+### SYNTHETIC SCENARIOS ###
+# Randomly generated populations of any size, e.g. for benchmarks (benchmark.py).
+# Humans random walk between location fixes taken at random times, animals
+# stay put, and a share of humans report being sick and later healthy again.
+@dataclass
+class SyntheticScenario:
+    num_humans: int = 10
+    num_animals: int = 1
+    width: float = 600
+    height: float = 600
+    duration: int = 600  # seconds of location data
+    fix_interval: float = 60  # mean seconds between a human's location fixes
+    speed: float = 1.0  # typical distance walked per second
+    report_rate: float = 0.2  # share of humans who report being sick
+    recovery_time: int = 300  # seconds from a sick report to the healthy one
+    animal_radius: Tuple[float, float] = (10, 50)
+    animal_hazard_rate: Tuple[float, float] = (0.01, 0.2)
+    seed: int = 0
+
+
+def build_synthetic(scenario: SyntheticScenario):
+    rng = np.random.default_rng(scenario.seed)
+    size = np.array([scenario.width, scenario.height])
+
+    humans = []
+    for id in range(scenario.num_humans):
+        num_fixes = max(2, rng.poisson(scenario.duration / scenario.fix_interval))
+        times = np.sort(rng.uniform(0, scenario.duration, num_fixes))
+        times[0] = 0
+        steps = rng.normal(size=(num_fixes, 2)) * (
+            scenario.speed * np.sqrt(np.diff(times, prepend=0))[:, None]
+        )
+        path = rng.uniform(0, size) + np.cumsum(steps, axis=0)
+        # reflected back into the grid
+        path = size - np.abs(size - path % (2 * size))
+
+        reports = []
+        if rng.random() < scenario.report_rate:
+            sick_at = rng.uniform(0, scenario.duration)
+            reports.append((sick_at, HumanStatus.SICK))
+            if sick_at + scenario.recovery_time < scenario.duration:
+                reports.append((sick_at + scenario.recovery_time, HumanStatus.HEALTHY))
+
+        locations = [(t, x, y) for t, (x, y) in zip(times.tolist(), path.tolist())]
+        humans.append(build_human(id, locations, reports))
+
+    animals = [
+        build_animal(
+            id,
+            [(0, *rng.uniform(0, size).tolist())],
+            rng.uniform(*scenario.animal_radius),
+            rng.uniform(*scenario.animal_hazard_rate),
+        )
+        for id in range(scenario.num_animals)
+    ]
+    return animals, humans
+
+
+# a scenario of num_humans on a grid grown to keep RD's 600 x 600 per 10 humans,
+# with an animal per 10 humans
+def synthetic_scenario(num_humans: int, **settings) -> SyntheticScenario:
+    side = 600 * math.sqrt(max(num_humans, 10) / 10)
+    return SyntheticScenario(
+        num_humans=num_humans,
+        num_animals=max(1, num_humans // 10),
+        width=side,
+        height=side,
+        **settings,
+    )
+
+
+# Datasets are only built when selected
+DATASETS = {
+    "RD": build_rd,
+    "D0": build_d0,
+    "D3": build_d3,
+    "D4": build_d4,
+}
+# "S10", "S100", ... synthetic scenarios
+SYNTHETIC_SIZES = [10, 100, 1000]
+for num_humans in SYNTHETIC_SIZES:
+    DATASETS[f"S{num_humans}"] = partial(
+        build_synthetic, synthetic_scenario(num_humans)
+    )
+
+_built_datasets = {}
+
+
+# Returns the (animals, humans) of a dataset, building it on first use; compact
+# datasets keep their keyframes as compact arrays (agents.compact_agents)
+def load_dataset(name, compact=False):
+    if name not in DATASETS:
+        raise ValueError(
+            f"Unknown dataset {name}, expected one of {', '.join(DATASETS)}"
+        )
+
+    if (name, compact) not in _built_datasets:
+        dataset = DATASETS[name]()
+        if compact:
+            dataset = compact_agents(*dataset)
+        _built_datasets[(name, compact)] = dataset
+    return _built_datasets[(name, compact)]
+
+
+# keeps e.g. data.RD_HUMANS / data.RD_ANIMALS working, built on first access
+def __getattr__(attr):
+    name, _, kind = attr.rpartition("_")
+    if name in DATASETS and kind in ("ANIMALS", "HUMANS"):
+        animals, humans = load_dataset(name)
+        return animals if kind == "ANIMALS" else humans
+    raise AttributeError(f"module {__name__!r} has no attribute {attr!r}")
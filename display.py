@@ -1,8 +1,45 @@
+from typing import Dict, List, Tuple
+import argparse
 import pygame
 
 from agents import HumanStatus
+from recording import Recording
+from sim_time import FRAMES_PER_SECOND
 
-FRAMES_PER_SECOND = 10
+BG_COLOR = (255, 255, 255)
+TEXT_COLOR = (0, 0, 0)
+ANIMAL_COLOR = (0, 200, 0)
+SICK_COLOR = (255, 0, 0)
+HEALTHY_COLOR = (0, 0, 255)
+HUMAN_RADIUS = 5
+VIEWER_FPS = 60  # how often the replay viewer polls input, not the replay speed
+
+
+# Renders every distinct text once with one font, instead of loading the font
+# and rendering labels again on every frame
+class TextCache:
+    def __init__(self, size: int = 15):
+        self.font = pygame.font.SysFont(None, size)
+        self.surfaces: Dict[Tuple[str, Tuple], pygame.Surface] = {}
+
+    def render(self, text: str, color=TEXT_COLOR) -> pygame.Surface:
+        surface = self.surfaces.get((text, color))
+        if surface is None:
+            surface = self.surfaces[(text, color)] = self.font.render(text, True, color)
+        return surface
+
+
+def draw_agent(screen, text: TextCache, x: int, y: int, radius, color, label: str):
+    pygame.draw.circle(screen, color, (x, y), radius)
+    screen.blit(text.render(label, color), (x, int(y - (radius + 10))))
+
+
+# screen area draw_agent covers
+def agent_rect(text: TextCache, x: int, y: int, radius, color, label: str):
+    reach = int(radius) + 2
+    circle = pygame.Rect(x - reach, y - reach, 2 * reach + 1, 2 * reach + 1)
+    label_rect = text.render(label, color).get_rect(topleft=(x, int(y - (radius + 10))))
+    return circle.union(label_rect)
 
 
 class Display:
@@ -15,13 +52,12 @@ class Display:
         self.screen = pygame.display.set_mode((width, height))
         pygame.display.set_caption("Agent Movement Simulation")
         self.clock = pygame.time.Clock()
+        self.text = TextCache()
 
-        self.bg_color = (255, 255, 255)
+        self.bg_color = BG_COLOR
 
-    def draw_text(self, text, pos, color=(0, 0, 0)):
-        font = pygame.font.SysFont(None, 15)
-        text_surf = font.render(text, True, color)
-        self.screen.blit(text_surf, pos)
+    def draw_text(self, text, pos, color=TEXT_COLOR):
+        self.screen.blit(self.text.render(text, color), pos)
 
     # Returns whether the simulation should continue running
     def render(self) -> bool:
@@ -32,31 +68,25 @@ class Display:
         self.screen.fill(self.bg_color)
 
         for agent in self.simulation.animal_agents:
-            screen_x = int(agent.location.x)
-            screen_y = int(agent.location.y)
-
-            color = (0, 200, 0)  # green for animals
-            radius = agent.radius
-
-            pygame.draw.circle(self.screen, color, (screen_x, screen_y), radius)
-            self.draw_text(
-                f"A{agent.id}", (screen_x, screen_y - (radius + 10)), color=color
+            draw_agent(
+                self.screen,
+                self.text,
+                int(agent.location.x),
+                int(agent.location.y),
+                agent.radius,
+                ANIMAL_COLOR,
+                f"A{agent.id}",
             )
 
         for agent in self.simulation.human_agents.values():
-            screen_x = int(agent.location.x)
-            screen_y = int(agent.location.y)
-
-            if agent.status == HumanStatus.SICK:
-                color = (255, 0, 0)  # sick human = red
-            else:
-                color = (0, 0, 255)  # healthy human = blue
-
-            radius = 5
-
-            pygame.draw.circle(self.screen, color, (screen_x, screen_y), radius)
-            self.draw_text(
-                f"H{agent.id}", (screen_x, screen_y - (radius + 10)), color=color
+            draw_agent(
+                self.screen,
+                self.text,
+                int(agent.location.x),
+                int(agent.location.y),
+                HUMAN_RADIUS,
+                SICK_COLOR if agent.status == HumanStatus.SICK else HEALTHY_COLOR,
+                f"H{agent.id}",
             )
 
         self.draw_text(f"Sim time: t={self.simulation.time_step}", (10, 10))
@@ -71,3 +101,212 @@ class Display:
 
     def cleanup(self):
         pygame.quit()
+
+
+# Plays a recording (see recording.py) back at any speed, without the
+# simulation. Only agents that moved or changed status, and whatever they
+# overlap, are redrawn, and nothing is drawn while the picture stays the same.
+# space: pause / play, left / right: step a tick, up / down: double / halve the
+# speed, home / end: first / last tick, click or drag the timeline: scrub
+class ReplayViewer:
+    def __init__(self, recording: Recording, width, height, speed=FRAMES_PER_SECOND):
+        pygame.init()
+        self.recording = recording
+        self.width = width
+        self.height = height
+
+        self.screen = pygame.display.set_mode((width, height))
+        pygame.display.set_caption("Agent Movement Replay")
+        self.clock = pygame.time.Clock()
+        self.text = TextCache()
+
+        self.speed = speed  # ticks per second
+        self.playing = True
+        self.playhead = 0.0  # fractional frame, so slow speeds advance too
+        self.frame = None  # frame on screen
+        self.drawn: Dict[str, Tuple] = {}  # label -> (state, rect) on screen
+        self.hud = pygame.Rect(0, 0, width, 44)
+        self.timeline = pygame.Rect(10, height - 16, width - 20, 8)
+        self.scale = self._fit()
+
+    # shrinks recordings that do not fit on screen; the simulation's own grid is
+    # drawn 1:1, as the live display does
+    def _fit(self) -> float:
+        r = self.recording
+        extent_x = max(r.human_x.max(initial=0), r.animal_x.max(initial=0), 1)
+        extent_y = max(r.human_y.max(initial=0), r.animal_y.max(initial=0), 1)
+        return min(1.0, self.width / extent_x, self.height / extent_y)
+
+    # (label, (x, y, radius, color)) of every agent at a frame, in drawing order
+    def _agents(self, frame: int) -> List[Tuple[str, Tuple]]:
+        r = self.recording
+        agents = []
+        for i, agent_id in enumerate(r.animal_ids):
+            agents.append(
+                (
+                    f"A{agent_id}",
+                    (
+                        int(self.scale * r.animal_x[frame, i]),
+                        int(self.scale * r.animal_y[frame, i]),
+                        float(self.scale * r.animal_radius[frame, i]),
+                        ANIMAL_COLOR,
+                    ),
+                )
+            )
+        for i, agent_id in enumerate(r.human_ids):
+            sick = r.human_status[frame, i] == HumanStatus.SICK.value
+            agents.append(
+                (
+                    f"H{agent_id}",
+                    (
+                        int(self.scale * r.human_x[frame, i]),
+                        int(self.scale * r.human_y[frame, i]),
+                        HUMAN_RADIUS,
+                        SICK_COLOR if sick else HEALTHY_COLOR,
+                    ),
+                )
+            )
+        return agents
+
+    def _draw_hud(self, frame: int):
+        r = self.recording
+        tick = int(r.ticks[frame])
+        state = "playing" if self.playing else "paused"
+        lines = [
+            f"Sim time: t={tick}",
+            f"Real time: t={tick * int(r.tick_seconds)}s",
+            f"{state}, {self.speed:g} ticks/s, frame {frame + 1}/{len(r)}",
+        ]
+        for n, line in enumerate(lines):
+            self.screen.blit(
+                self.text.font.render(line, True, TEXT_COLOR), (10, 10 + 10 * n)
+            )
+
+        pygame.draw.rect(self.screen, (200, 200, 200), self.timeline)
+        done = self.timeline.copy()
+        done.width = round(self.timeline.width * (frame + 1) / len(r))
+        pygame.draw.rect(self.screen, TEXT_COLOR, done)
+
+    def draw(self, frame: int, force: bool = False):
+        agents = self._agents(frame)
+        rects = [
+            agent_rect(self.text, x, y, radius, color, label)
+            for label, (x, y, radius, color) in agents
+        ]
+
+        if force or self.frame is None:
+            dirty = [self.screen.get_rect()]
+        else:
+            dirty = [self.hud, self.timeline]
+            for (label, state), rect in zip(agents, rects):
+                drawn = self.drawn.get(label)
+                if drawn is None or drawn[0] != state:
+                    dirty.append(rect)
+                    if drawn is not None:
+                        dirty.append(drawn[1])
+
+        for area in dirty:
+            self.screen.set_clip(area)
+            self.screen.fill(BG_COLOR)
+            for n in area.collidelistall(rects):
+                label, (x, y, radius, color) = agents[n]
+                draw_agent(self.screen, self.text, x, y, radius, color, label)
+        self.screen.set_clip(None)
+        # the HUD and timeline are always among the dirty areas, already cleared
+        self._draw_hud(frame)
+        pygame.display.update(dirty)
+
+        self.frame = frame
+        self.drawn = {
+            label: (state, rect) for (label, state), rect in zip(agents, rects)
+        }
+
+    def seek(self, frame: float):
+        self.playhead = min(max(frame, 0), len(self.recording) - 1)
+
+    def _scrub(self, x: int):
+        self.playing = False
+        self.seek((x - self.timeline.left) / self.timeline.width * len(self.recording))
+
+    def _key(self, key):
+        match key:
+            case pygame.K_SPACE:
+                if self.playhead >= len(self.recording) - 1:
+                    self.seek(0)
+                self.playing = not self.playing
+            case pygame.K_LEFT:
+                self.playing = False
+                self.seek(int(self.playhead) - 1)
+            case pygame.K_RIGHT:
+                self.playing = False
+                self.seek(int(self.playhead) + 1)
+            case pygame.K_UP:
+                self.speed *= 2
+            case pygame.K_DOWN:
+                self.speed /= 2
+            case pygame.K_HOME:
+                self.seek(0)
+            case pygame.K_END:
+                self.seek(len(self.recording) - 1)
+
+    def run(self):
+        while True:
+            seconds = self.clock.tick(VIEWER_FPS) / 1000
+            # the HUD shows the play state and speed, so input redraws it
+            changed = False
+            for event in pygame.event.get():
+                match event.type:
+                    case pygame.QUIT:
+                        return
+                    case pygame.KEYDOWN:
+                        self._key(event.key)
+                        changed = True
+                    case pygame.MOUSEBUTTONDOWN if self.timeline.collidepoint(
+                        event.pos
+                    ):
+                        self._scrub(event.pos[0])
+                        changed = True
+                    case pygame.MOUSEMOTION if event.buttons[0] and (
+                        self.timeline.inflate(0, 20).collidepoint(event.pos)
+                    ):
+                        self._scrub(event.pos[0])
+                        changed = True
+
+            if self.playing:
+                self.seek(self.playhead + seconds * self.speed)
+                if self.playhead >= len(self.recording) - 1:
+                    self.playing = False
+                    changed = True
+
+            frame = int(self.playhead)
+            if changed or frame != self.frame:
+                self.draw(frame)
+
+    def cleanup(self):
+        pygame.quit()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a trial recorded with simulator.py --record"
+    )
+    parser.add_argument("recording", help="a recording's .npz file")
+    parser.add_argument(
+        "--speed", type=float, default=FRAMES_PER_SECOND, help="ticks per second"
+    )
+    parser.add_argument("--width", type=int, default=600)
+    parser.add_argument("--height", type=int, default=600)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    viewer = ReplayViewer(
+        Recording.load(args.recording), args.width, args.height, args.speed
+    )
+    viewer.run()
+    viewer.cleanup()
+
+
+if __name__ == "__main__":
+    main()
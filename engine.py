@@ -0,0 +1,351 @@
+from collections import defaultdict
+from itertools import chain
+from typing import Set, Tuple
+import math
+import numpy as np
+
+from agents import *
+from simulator import Simulation
+from spatial import SpatialHashGrid, RadiusIndex
+import user
+
+
+# numpy Generator stand-in for the batched infection model: one draw per human
+# from its own infection stream, as the per-agent models draw
+class _InfectionDraws:
+    def __init__(self, humans: List[Human]):
+        self.humans = humans
+
+    def random(self, size) -> np.ndarray:
+        draws = [h.infection_stream.random() for h in self.humans]
+        return np.array(draws).reshape(size)
+
+
+# Drop-in replacement for Simulation that keeps positions, statuses, radii and
+# hazards in struct-of-arrays buffers and evaluates every human-animal and
+# human-human proximity check of a tick as batched array operations.
+# Human-human distances are computed BLOCK_SIZE at a time, and only the pairs
+# within reach and the open contacts are kept, so memory stays linear in
+# population plus contacts; the checks are still quadratic, see GridSimulation
+# for large populations. Agents still move themselves (keyframes +
+# user.human_motion), and contact / sickness records are kept as the loop
+# engine does; they match it up to floating point rounding of distances and
+# hazard sums.
+class VectorizedSimulation(Simulation):
+    BLOCK_SIZE = 1 << 20  # human-human distances computed at a time
+
+    def __init__(self, seed=None):
+        super().__init__(seed)
+        self._built = False
+
+    def add_agent(self, agent):
+        super().add_agent(agent)
+        self._built = False
+
+    def _build(self):
+        self._humans: List[Human] = list(self.human_agents.values())
+        self._index: Dict[int, int] = {h.id: i for i, h in enumerate(self._humans)}
+        num_humans = len(self._humans)
+        num_animals = len(self.animal_agents)
+
+        self.hx = np.empty(num_humans)
+        self.hy = np.empty(num_humans)
+        self.sick = np.zeros(num_humans, dtype=bool)
+        self.prev_sick = np.array(
+            [h.prev_status == HumanStatus.SICK for h in self._humans], dtype=bool
+        )
+
+        self.output_hazard = np.array(
+            [h.infection_model.output_hazard for h in self._humans]
+        )
+        self.animal_hazard = np.array(
+            [h.infection_model.experienced_animal_hazard for h in self._humans]
+        )
+        self.human_hazard = np.array(
+            [h.infection_model.experienced_human_hazard for h in self._humans]
+        )
+
+        self.ax = np.empty(num_animals)
+        self.ay = np.empty(num_animals)
+        self.radius = np.empty(num_animals)
+        self.animal_output_hazard = np.empty(num_animals)
+
+        # the contact log's open contacts as sorted pair keys i * num_humans + j,
+        # for human i's record of human j, and the rows they are
+        a, b, rows = self.contacts.open_contacts.columns()
+        i = np.array([self._index[id] for id in a.tolist()], dtype=np.int64)
+        j = np.array([self._index[id] for id in b.tolist()], dtype=np.int64)
+        keys = i * num_humans + j
+        order = np.argsort(keys)
+        self.contact_keys = keys[order]
+        self.contact_rows = rows[order]
+
+        self._built = True
+
+    def _gather(self):
+        self.hx[:] = [h.location.x for h in self._humans]
+        self.hy[:] = [h.location.y for h in self._humans]
+        self.sick[:] = [h.status == HumanStatus.SICK for h in self._humans]
+
+        self.ax[:] = [a.location.x for a in self.animal_agents]
+        self.ay[:] = [a.location.y for a in self.animal_agents]
+        self.radius[:] = [a.radius for a in self.animal_agents]
+        self.animal_output_hazard[:] = [
+            a.infection_model.output_hazard for a in self.animal_agents
+        ]
+
+    def update(self):
+        if not self._built:
+            self._build()
+
+        for agent in chain(self.human_agents.values(), self.animal_agents):
+            agent.move(self)
+
+        self._gather()
+        animal_contacts = self._animal_contacts()
+        near, dist = self._human_contacts()
+        num_humans = len(self._humans)
+        i, j = np.divmod(near, num_humans)
+
+        # hazards; the loop engine updates humans in order, so human i sees this
+        # tick's output hazard / status of every j < i and last tick's of every
+        # j > i
+        new_output_hazard = user.batch_output_hazard(self.sick)
+        animal_exposure = animal_contacts @ self.animal_output_hazard
+        before = j < i
+        human_exposure = np.bincount(
+            i[before], new_output_hazard[j[before]], minlength=num_humans
+        ) + np.bincount(
+            i[~before], self.output_hazard[j[~before]], minlength=num_humans
+        )
+        got_sick = user.batch_infection_probability_model(
+            self.animal_hazard,
+            self.human_hazard,
+            animal_exposure,
+            human_exposure,
+            _InfectionDraws(self._humans),
+        )
+        self.output_hazard = new_output_hazard
+        updated_sick = self.sick | got_sick
+
+        self._record_contacts(near, dist, updated_sick)
+
+        # write hazards back to the agents' infection models
+        for h, output, animal, human in zip(
+            self._humans,
+            self.output_hazard.tolist(),
+            self.animal_hazard.tolist(),
+            self.human_hazard.tolist(),
+        ):
+            h.infection_model.output_hazard = output
+            h.infection_model.experienced_animal_hazard = animal
+            h.infection_model.experienced_human_hazard = human
+
+        # sickness bookkeeping only matters for humans that are or were sick
+        for i in np.nonzero(updated_sick | self.prev_sick)[0]:
+            self._humans[i].update_sickness(self, got_sick[i])
+        self.prev_sick = updated_sick
+
+        for animal in self.animal_agents:
+            animal.update(self)
+
+        self.time_step += 1
+
+    # human-animal proximity mask (H x A)
+    def _animal_contacts(self) -> np.ndarray:
+        dx = self.hx[:, None] - self.ax[None, :]
+        dy = self.hy[:, None] - self.ay[None, :]
+        return np.sqrt(dx**2 + dy**2) <= self.radius[None, :]
+
+    # Sorted pair keys (as contact_keys) of the humans within reach of each
+    # other, and their distances, from blocks of rows of the (H x H) distances
+    def _human_contacts(self):
+        num_humans = len(self._humans)
+        block = max(1, self.BLOCK_SIZE // max(num_humans, 1))
+        keys, dists = [], []
+        for start in range(0, num_humans, block):
+            end = min(start + block, num_humans)
+            dx = self.hx[start:end, None] - self.hx[None, :]
+            dy = self.hy[start:end, None] - self.hy[None, :]
+            dist = np.sqrt(dx**2 + dy**2)
+            near = dist <= CONTACT_NETWORK_PROXIMITY_THRESHOLD
+            near[np.arange(end - start), np.arange(start, end)] = False
+            i, j = np.nonzero(near)
+            keys.append((i + start) * num_humans + j)
+            dists.append(dist[i, j])
+        if not keys:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(keys), np.concatenate(dists)
+
+    # closes the open contacts no longer within reach, adds up the distances of
+    # the others and opens the new ones, in the loop engine's order
+    def _record_contacts(self, near, dist, updated_sick):
+        num_humans = len(self._humans)
+        position = np.searchsorted(self.contact_keys, near)
+        continuing = position < len(self.contact_keys)
+        continuing[continuing] = (
+            self.contact_keys[position[continuing]] == near[continuing]
+        )
+        rows = np.empty(len(near), dtype=np.int64)
+        rows[continuing] = self.contact_rows[position[continuing]]
+        self.contacts.total_proximity[rows[continuing]] += dist[continuing]
+
+        closed = ~np.isin(self.contact_keys, near, assume_unique=True)
+        for key, row in zip(
+            self.contact_keys[closed].tolist(), self.contact_rows[closed].tolist()
+        ):
+            self._humans[key // num_humans].close_contact(self, row)
+
+        for n in np.flatnonzero(~continuing).tolist():
+            i, j = divmod(int(near[n]), num_humans)
+            other_sick = updated_sick[j] if j < i else self.sick[j]
+            rows[n] = self.contacts.open(
+                self._humans[i].id,
+                self._humans[j].id,
+                self.time_step,
+                float(dist[n]),
+                HumanStatus.SICK if other_sick else HumanStatus.HEALTHY,
+            )
+
+        self.contact_keys = near
+        self.contact_rows = rows
+
+
+# Per-agent engine that only checks agents in neighbouring cells of a uniform
+# grid sized to the contact threshold, so contact detection stays close to
+# linear in population. The indices are updated incrementally as agents move,
+# and each unordered pair of humans is checked once, updating both sides'
+# contact records. Humans then run the infection model in the same order as the
+# loop engine, so every record and hazard matches Simulation.
+class GridSimulation(Simulation):
+    def __init__(
+        self, cell_size: float = CONTACT_NETWORK_PROXIMITY_THRESHOLD, seed=None
+    ):
+        super().__init__(seed)
+        self.cell_size = cell_size
+        self._built = False
+
+    def add_agent(self, agent):
+        super().add_agent(agent)
+        self._built = False
+
+    def _build(self):
+        self._humans: List[Human] = list(self.human_agents.values())
+        self._ids = np.array([h.id for h in self._humans], dtype=np.int64)
+        index = {h.id: i for i, h in enumerate(self._humans)}
+
+        self.human_grid = SpatialHashGrid(self.cell_size)
+        self.animal_index = RadiusIndex(self.cell_size)
+
+        # (i, j) with i < j -> open contact between humans i and j
+        self.active_pairs: Set[Tuple[int, int]] = set()
+        a, b, _ = self.contacts.open_contacts.columns()
+        for i, j in zip(a.tolist(), b.tolist()):
+            i, j = index[i], index[j]
+            self.active_pairs.add((min(i, j), max(i, j)))
+
+        self._built = True
+
+    def update(self):
+        if not self._built:
+            self._build()
+
+        for agent in chain(self.human_agents.values(), self.animal_agents):
+            agent.move(self)
+
+        self._index_agents()
+        near = self._human_contacts(list(self.human_grid.candidate_pairs()))
+
+        # sorted so contacts close in the loop engine's order
+        for i, j in sorted(self.active_pairs - near.keys()):
+            self._close_contact(i, j)
+            self._close_contact(j, i)
+
+        opened: Dict[int, List[int]] = defaultdict(list)
+        continuing: List[Tuple[int, int, float]] = []
+        for (i, j), dist in near.items():
+            if (i, j) in self.active_pairs:
+                continuing.append((i, j, dist))
+            else:
+                opened[i].append(j)
+        if continuing:
+            i, j, dist = (np.array(column) for column in zip(*continuing))
+            a, b = self._ids[i], self._ids[j]
+            open_contacts = self.contacts.open_contacts
+            self.contacts.total_proximity[open_contacts.find(a, b)] += dist
+            self.contacts.total_proximity[open_contacts.find(b, a)] += dist
+        self.active_pairs = set(near)
+        # humans with open contacts once this tick's have opened
+        in_contact = set(chain.from_iterable(near))
+
+        for i, h in enumerate(self._humans):
+            # i's record of a new contact sees the other's status before its update
+            new_contacts = sorted(opened.get(i, []))
+            for j in new_contacts:
+                self._open_contact(i, j, near[(i, j)])
+
+            current_animal_contacts = self._animal_contacts(
+                h, sorted(self.animal_index.candidates(h.location.x, h.location.y))
+            )
+            current_human_contacts = (
+                [self.human_agents[other_id] for other_id in h.active_contacts(self)]
+                if i in in_contact
+                else []
+            )
+
+            got_sick = user.infection_probability_model(
+                h, current_animal_contacts, current_human_contacts
+            )
+            h.update_sickness(self, got_sick)
+
+            # ...while later humans' records see this human's updated status
+            for j in new_contacts:
+                self._open_contact(j, i, near[(i, j)])
+
+        for animal in self.animal_agents:
+            animal.update(self)
+
+        self.time_step += 1
+
+    def _index_agents(self):
+        for i, h in enumerate(self._humans):
+            self.human_grid.update(i, h.location.x, h.location.y)
+        for a, animal in enumerate(self.animal_agents):
+            self.animal_index.update(
+                a, animal.location.x, animal.location.y, animal.radius
+            )
+
+    # (i, j) -> distance of the candidate pairs within the contact threshold
+    def _human_contacts(
+        self, candidates: List[Tuple[int, int]]
+    ) -> Dict[Tuple[int, int], float]:
+        near = {}
+        for i, j in candidates:
+            hi, hj = self._humans[i], self._humans[j]
+            dist = math.sqrt(
+                (hi.location.x - hj.location.x) ** 2
+                + (hi.location.y - hj.location.y) ** 2
+            )
+            if dist <= CONTACT_NETWORK_PROXIMITY_THRESHOLD:
+                near[(i, j)] = dist
+        return near
+
+    # the candidate animals whose radius human h is in
+    def _animal_contacts(self, h: Human, candidates: List[int]):
+        return [
+            self.animal_agents[a]
+            for a in candidates
+            if math.sqrt(
+                (h.location.x - self.animal_agents[a].location.x) ** 2
+                + (h.location.y - self.animal_agents[a].location.y) ** 2
+            )
+            <= self.animal_agents[a].radius
+        ]
+
+    def _open_contact(self, i, j, dist):
+        h, other = self._humans[i], self._humans[j]
+        self.contacts.open(h.id, other.id, self.time_step, dist, other.status)
+
+    def _close_contact(self, i, j):
+        h = self._humans[i]
+        h.close_contact(self, self.contacts.open_contacts.row(h.id, self._humans[j].id))
@@ -0,0 +1,480 @@
+from heapq import heapify, heappop, heappush
+from itertools import chain
+from typing import List, Set
+import math
+import numpy as np
+
+from agents import *
+from simulator import Simulation
+import user
+
+# event kinds, in the order they are handled within a tick
+BOUNDARY = 0  # an agent starts a new piece of its motion
+HUMAN_PAIR = 1  # two humans come into / go out of contact
+ANIMAL_PAIR = 2  # a human enters / leaves an animal's radius
+WAKE = 3  # a human has to run its update: a report, a sickness onset, ...
+
+# slack on reach when solving for windows, which are then checked tick by tick
+# at their ends, so rounding never drops a tick the loop engine would count
+REACH_SLACK = 1e-9
+
+# longest wait for a sickness onset searched for
+MAX_ONSET_TICKS = 2**40
+
+
+# Drop-in replacement for Simulation when motion is deterministic (the "none"
+# and "interp" human motion models, see user.human_motion_pieces). Agents move
+# along linear pieces, so whenever one starts a new piece, the ticks during
+# which it stays within reach of each other agent are solved for in closed
+# form. A priority queue of these contact enter / exit events, piece
+# boundaries, self-reports and sickness onsets lets the simulation jump
+# straight from one to the next: a human only runs its update on ticks with an
+# event of its own (in the loop engine's order), and its experienced hazards
+# are carried over the ticks in between in closed form (user.decayed_hazard).
+# Records match the loop engine up to floating point rounding. With
+# SIMULATE_SPREAD a human falls sick once its hazard summed since it was last
+# healthy passes an exponentially distributed threshold, which has the
+# distribution of the loop engine's per-tick draws but not its random numbers.
+class EventSimulation(Simulation):
+    def __init__(self, seed=None):
+        super().__init__(seed)
+        self._built = False
+
+    def add_agent(self, agent):
+        super().add_agent(agent)
+        self._built = False
+
+    def _build(self):
+        self._humans: List[Human] = list(self.human_agents.values())
+        self._index: Dict[int, int] = {h.id: i for i, h in enumerate(self._humans)}
+        num_humans = len(self._humans)
+        t = self.time_step
+
+        # agents k < num_humans are humans, the rest animals
+        self._pieces = [user.human_motion_pieces(h.trajectory) for h in self._humans]
+        self._pieces += [
+            user.animal_motion_pieces(a.trajectory) for a in self.animal_agents
+        ]
+        num_agents = len(self._pieces)
+
+        # every agent's current piece, and when it ends
+        self._start = np.zeros(num_agents, dtype=np.int64)
+        self._x = np.zeros(num_agents)
+        self._y = np.zeros(num_agents)
+        self._vx = np.zeros(num_agents)
+        self._vy = np.zeros(num_agents)
+        self._end = np.full(num_agents, np.inf)
+
+        self._radius = np.array([a.radius for a in self.animal_agents])
+        self._animal_output = [
+            a.infection_model.output_hazard for a in self.animal_agents
+        ]
+
+        # pairs currently within reach: humans in contact with each human, and
+        # animals whose radius each human is in
+        self._near: List[Set[int]] = [set() for _ in self._humans]
+        a, b, _ = self.contacts.open_contacts.columns()
+        for i, j in zip(a.tolist(), b.tolist()):
+            self._near[self._index[i]].add(self._index[j])
+        self._in_radius: List[Set[int]] = [set() for _ in self._humans]
+        # open contact's row -> tick its total proximity is summed until
+        self._proximity_end: Dict[int, int] = {}
+
+        # experienced hazards are up to date as of the update on tick
+        # _anchor[i], and take in the same exposure every tick after it
+        self._anchor = [t - 1] * num_humans
+        self._animal_exposure = [0.0] * num_humans
+        self._human_exposure = [0.0] * num_humans
+        # hazard summed since the human was last healthy, and the sum at which
+        # it falls sick
+        self._summed = [0.0] * num_humans
+        self._threshold = [h.infection_stream.exponential() for h in self._humans]
+
+        self._events = []
+        for k in range(num_agents):
+            self._push(t, BOUNDARY, k)
+        for i, h in enumerate(self._humans):
+            self._push(t, WAKE, i)
+            for report_time in h.self_reports:
+                if report_time > t:
+                    self._push(report_time, WAKE, i)
+
+        self._built = True
+
+    def _push(self, tick, kind, a, b=0, state=False):
+        heappush(self._events, (int(tick), kind, int(a), int(b), state))
+
+    def update(self):
+        self.run_until(self.time_step + 1)
+
+    def run_until(self, end_tick: int):
+        if not self._built:
+            self._build()
+
+        while self._events and self._events[0][0] < end_tick:
+            self._run_tick(self._events[0][0])
+
+        self.time_step = max(self.time_step, end_tick)
+        self._sync(self.time_step - 1)
+
+    def _run_tick(self, t: int):
+        self.time_step = t
+        boundaries: List[int] = []
+        due: Set[int] = set()
+
+        while self._events and self._events[0][0] == t:
+            _, kind, a, b, state = heappop(self._events)
+            if kind == BOUNDARY:
+                boundaries.append(a)
+            elif kind == HUMAN_PAIR:
+                self._set_near(a, b, state, due)
+            elif kind == ANIMAL_PAIR:
+                self._set_in_radius(a, b, state, due)
+            else:
+                due.add(a)
+
+        # all agents move onto their new pieces before any pair is solved for
+        for k in boundaries:
+            self._next_piece(k, t)
+        for k in boundaries:
+            self._solve_pairs(k, t, due)
+
+        for i in due:
+            h = self._humans[i]
+            if t in h.self_reports:
+                h.status = h.self_reports[t]
+
+        # humans update in the loop engine's order; updates can wake later
+        # humans on this same tick
+        pending = list(due)
+        heapify(pending)
+        updated: Set[int] = set()
+        while pending:
+            i = heappop(pending)
+            if i not in updated:
+                updated.add(i)
+                self._update_human(i, t, pending)
+
+    # wakes human j because of human i's update on tick t, for j's first update
+    # that sees it: this tick if j updates after i, the next one otherwise
+    def _wake(self, j: int, i: int, t: int, pending):
+        if j > i:
+            heappush(pending, j)
+        else:
+            self._push(t + 1, WAKE, j)
+
+    # motion
+
+    def _next_piece(self, k: int, t: int):
+        pieces = self._pieces[k]
+        n = int(np.searchsorted(pieces.start, t, side="right")) - 1
+        self._start[k] = pieces.start[n]
+        self._x[k] = pieces.x[n]
+        self._y[k] = pieces.y[n]
+        self._vx[k] = pieces.vx[n]
+        self._vy[k] = pieces.vy[n]
+        if n + 1 < len(pieces.start):
+            self._end[k] = pieces.start[n + 1]
+            self._push(pieces.start[n + 1], BOUNDARY, k)
+        else:
+            self._end[k] = np.inf
+
+    def _position(self, k, t):
+        elapsed = t - self._start[k]
+        return self._x[k] + self._vx[k] * elapsed, self._y[k] + self._vy[k] * elapsed
+
+    # whether agents k and other are within reach on tick t, as the loop engine
+    # checks it
+    def _within(self, k: int, other: int, reach: float, t: int) -> bool:
+        return self._distance(k, other, t) <= reach
+
+    def _distance(self, k: int, other: int, t: int) -> float:
+        kx, ky = self._position(k, t)
+        ox, oy = self._position(other, t)
+        return math.sqrt(float(kx - ox) ** 2 + float(ky - oy) ** 2)
+
+    # For each of others, the first and last tick (as offsets from t) on which
+    # it is within reach of agent k while both stay on their current pieces:
+    # the squared distance between them is a quadratic in time
+    def _windows(self, k: int, others: np.ndarray, reach, t: int):
+        kx, ky = self._position(k, t)
+        ox, oy = self._position(others, t)
+        rx, ry = kx - ox, ky - oy
+        wx, wy = self._vx[k] - self._vx[others], self._vy[k] - self._vy[others]
+        length = np.minimum(self._end[k], self._end[others]) - t
+
+        a = wx**2 + wy**2
+        b = rx * wx + ry * wy
+        c = rx**2 + ry**2 - (reach * (1 + REACH_SLACK)) ** 2
+        moving = a > 0
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            root = np.sqrt(b**2 - a * c)
+            first = np.where(moving, np.ceil((-b - root) / a), 0.0)
+            last = np.where(moving, np.floor((-b + root) / a), np.inf)
+        first = np.where(moving | (c <= 0), np.maximum(first, 0), np.inf)
+        last = np.minimum(last, length - 1)
+        # NaN roots (never within reach) compare False
+        return first, last, first <= last, length
+
+    def _solve_pairs(self, k: int, t: int, due: Set[int]):
+        num_humans = len(self._humans)
+        humans = np.arange(num_humans)
+        if k < num_humans:
+            others = humans[humans != k]
+            reach = np.full(len(others), CONTACT_NETWORK_PROXIMITY_THRESHOLD)
+            self._solve(k, others, reach, due)
+            animals = np.arange(num_humans, len(self._pieces))
+            self._solve(k, animals, self._radius, due)
+        else:
+            reach = np.full(num_humans, self._radius[k - num_humans])
+            self._solve(k, humans, reach, due)
+
+    def _solve(self, k: int, others: np.ndarray, reach: np.ndarray, due: Set[int]):
+        t = self.time_step
+        num_humans = len(self._humans)
+        if len(others) == 0:
+            return
+
+        first, last, found, length = self._windows(k, others, reach, t)
+        if k < num_humans:
+            now = np.array([self._is_within(k, other) for other in others.tolist()])
+        else:
+            now = np.array([(k - num_humans) in self._in_radius[i] for i in others])
+        for n in np.flatnonzero(found | now).tolist():
+            other = int(others[n])
+            self._schedule_pair(
+                k, other, float(reach[n]), first[n], last[n], length[n], found[n], due
+            )
+
+    def _is_within(self, i: int, other: int) -> bool:
+        num_humans = len(self._humans)
+        if other < num_humans:
+            return other in self._near[i]
+        return (other - num_humans) in self._in_radius[i]
+
+    # Fixes up a solved window tick by tick at its ends, sets the pair's state
+    # on this tick, and schedules when it enters / leaves reach until one of
+    # them starts a new piece
+    def _schedule_pair(self, k, other, reach, first, last, length, found, due):
+        t = self.time_step
+        within_now = self._within(k, other, reach, t)
+        self._set_pair(k, other, within_now, t, due)
+
+        if within_now:
+            first = 0
+            last = max(last, 0) if found else 0
+        elif not found or not math.isfinite(last):
+            # a pair that does not move apart stays out of reach
+            return
+
+        first = int(first)
+        while first <= last and not self._within(k, other, reach, t + first):
+            first += 1
+        while first > 0 and self._within(k, other, reach, t + first - 1):
+            first -= 1
+        if math.isfinite(last):
+            last = int(last)
+            while last >= first and not self._within(k, other, reach, t + last):
+                last -= 1
+            while last + 1 < length and self._within(k, other, reach, t + last + 1):
+                last += 1
+
+        if first > last:
+            return
+        if first > 0:
+            self._set_pair(k, other, True, t + first, due)
+        if last + 1 < length:
+            self._set_pair(k, other, False, t + last + 1, due)
+
+    # sets the state of a pair on this tick, or schedules it for a later one
+    def _set_pair(self, k: int, other: int, state: bool, tick: int, due: Set[int]):
+        num_humans = len(self._humans)
+        if k >= num_humans:
+            k, other = other, k
+        if tick == self.time_step:
+            if other < num_humans:
+                self._set_near(k, other, state, due)
+            else:
+                self._set_in_radius(k, other - num_humans, state, due)
+        elif other < num_humans:
+            self._push(tick, HUMAN_PAIR, min(k, other), max(k, other), state)
+        else:
+            self._push(tick, ANIMAL_PAIR, k, other - num_humans, state)
+
+    def _set_near(self, i: int, j: int, state: bool, due: Set[int]):
+        if state != (j in self._near[i]):
+            if state:
+                self._near[i].add(j)
+                self._near[j].add(i)
+            else:
+                self._near[i].discard(j)
+                self._near[j].discard(i)
+            due.update((i, j))
+
+    def _set_in_radius(self, i: int, a: int, state: bool, due: Set[int]):
+        if state != (a in self._in_radius[i]):
+            if state:
+                self._in_radius[i].add(a)
+            else:
+                self._in_radius[i].discard(a)
+            due.add(i)
+
+    # brings a contact's total proximity up to its distances summed from its
+    # start until (not including) tick end, adding the ticks since it was last
+    # brought up to date, so syncing every tick stays linear in its length
+    def _sum_proximity(self, row: int, i: int, j: int, end: int):
+        summed = self._proximity_end.get(row)
+        if summed is None:
+            # only the distance on opening so far, which is summed again
+            summed = int(self.contacts.start[row])
+            self.contacts.total_proximity[row] = 0.0
+        ticks = np.arange(summed, end)
+        ix, iy = self._pieces[i].positions(ticks)
+        jx, jy = self._pieces[j].positions(ticks)
+        self.contacts.total_proximity[row] += np.sqrt(
+            (ix - jx) ** 2 + (iy - jy) ** 2
+        ).sum()
+        self._proximity_end[row] = max(summed, end)
+
+    # hazards
+
+    # onset thresholds not passed yet are drawn again from what is left of them,
+    # which is distributed as the whole, so forks go their own ways
+    def reseed(self, seed):
+        super().reseed(seed)
+        if not self._built or not user.SIMULATE_SPREAD:
+            return
+        for i, h in enumerate(self._humans):
+            if h.status == HumanStatus.HEALTHY and h.prev_status == HumanStatus.HEALTHY:
+                self._threshold[i] = self._summed[i] + h.infection_stream.exponential()
+                self._schedule_onset(i, self.time_step - 1)
+
+    # carries human i's experienced hazards over to its update on tick t
+    def _carry_hazard(self, i: int, t: int):
+        num_ticks = t - self._anchor[i]
+        if num_ticks <= 0:
+            return
+
+        h = self._humans[i]
+        model = h.infection_model
+        if user.SIMULATE_SPREAD and h.prev_status == HumanStatus.HEALTHY:
+            self._summed[i] += user.summed_hazard(
+                model.total_experienced_hazard(),
+                self._animal_exposure[i] + self._human_exposure[i],
+                num_ticks,
+            )
+        model.experienced_animal_hazard = user.decayed_hazard(
+            model.experienced_animal_hazard, self._animal_exposure[i], num_ticks
+        )
+        model.experienced_human_hazard = user.decayed_hazard(
+            model.experienced_human_hazard, self._human_exposure[i], num_ticks
+        )
+        self._anchor[i] = t
+
+    # first tick after t on which human i's summed hazard passes its threshold,
+    # if nothing else changes its exposure before then
+    def _schedule_onset(self, i: int, t: int):
+        hazard = self._humans[i].infection_model.total_experienced_hazard()
+        exposure = self._animal_exposure[i] + self._human_exposure[i]
+        remaining = self._threshold[i] - self._summed[i]
+
+        def passes(num_ticks):
+            return user.summed_hazard(hazard, exposure, num_ticks) > remaining
+
+        high = 1
+        while not passes(high):
+            high *= 2
+            if high > MAX_ONSET_TICKS:
+                return
+        low = high // 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if passes(middle):
+                high = middle
+            else:
+                low = middle
+        self._push(t + high, WAKE, i)
+
+    # Human.update on tick t, from the pairs within reach
+    def _update_human(self, i: int, t: int, pending):
+        h = self._humans[i]
+        model = h.infection_model
+
+        active_contacts = h.active_contacts(self)
+        for other_id in sorted(active_contacts, key=self._index.get):
+            j = self._index[other_id]
+            if j not in self._near[i]:
+                row = active_contacts[other_id]
+                self._sum_proximity(row, i, j, t)
+                del self._proximity_end[row]
+                h.close_contact(self, row)
+        for j in sorted(self._near[i]):
+            other = self._humans[j]
+            if other.id not in active_contacts:
+                self.contacts.open(
+                    h.id, other.id, t, self._distance(i, j, t), other.status
+                )
+
+        # user.infection_probability_model, with the draw replaced by the threshold
+        self._carry_hazard(i, t - 1)
+        previous_output = model.output_hazard
+        model.output_hazard = float(
+            user.batch_output_hazard(h.status == HumanStatus.SICK)
+        )
+
+        animal_exposure = 0.0
+        for a in sorted(self._in_radius[i]):
+            animal_exposure += self._animal_output[a]
+        human_exposure = 0.0
+        for j in sorted(self._near[i]):
+            human_exposure += self._humans[j].infection_model.output_hazard
+        model.experienced_animal_hazard *= user.HAZARD_DECAY
+        model.experienced_animal_hazard += animal_exposure
+        model.experienced_human_hazard *= user.HAZARD_DECAY
+        model.experienced_human_hazard += human_exposure
+        self._animal_exposure[i] = animal_exposure
+        self._human_exposure[i] = human_exposure
+        self._anchor[i] = t
+
+        got_sick = False
+        if user.SIMULATE_SPREAD and h.status == HumanStatus.HEALTHY:
+            if h.prev_status == HumanStatus.SICK:
+                self._summed[i] = 0.0
+                self._threshold[i] = h.infection_stream.exponential()
+            self._summed[i] += model.total_experienced_hazard()
+            got_sick = self._summed[i] > self._threshold[i]
+
+        num_records = len(h.sickness_records)
+        h.update_sickness(self, got_sick)
+
+        if got_sick:
+            # our output hazard follows our status from the next tick
+            self._push(t + 1, WAKE, i)
+        elif user.SIMULATE_SPREAD and h.status == HumanStatus.HEALTHY:
+            self._schedule_onset(i, t)
+
+        if len(h.sickness_records) > num_records:
+            # on_sickness_onset may have added to others' secondary contacts
+            rows = self.contacts.closed_rows_with(h.id)
+            for other_id in np.unique(self.contacts.a[rows]).tolist():
+                self._wake(self._index[other_id], i, t, pending)
+
+        if model.output_hazard != previous_output:
+            for j in self._near[i]:
+                self._wake(j, i, t, pending)
+
+    # brings every agent's location, hazards and open contacts up to tick t
+    def _sync(self, t: int):
+        if t < 0:
+            return
+
+        for k, agent in enumerate(chain(self._humans, self.animal_agents)):
+            x, y = self._position(k, t)
+            agent.location = LocationRecord(x=float(x), y=float(y))
+
+        for i in range(len(self._humans)):
+            self._carry_hazard(i, t)
+        a, b, rows = self.contacts.open_contacts.columns()
+        for i, j, row in zip(a.tolist(), b.tolist(), rows.tolist()):
+            self._sum_proximity(row, self._index[i], self._index[j], t + 1)
@@ -0,0 +1,318 @@
+from dataclasses import dataclass, fields
+from typing import Dict, List, Tuple
+import json
+import os
+import warnings
+import numpy as np
+
+from agents import *
+from sim_time import SIM_TICK_TIME_SECONDS
+
+# A CSV dataset is a directory holding (times in seconds, as in data.py):
+#   humans.csv            id,time,x,y           location fixes of every human
+#   reports.csv           id,time,status        self-reports, HEALTHY/SICK or 0/1
+#   animals.csv           id,radius,hazard_rate
+#   animal_locations.csv  id,time,x,y           locations of every animal presence
+# reports.csv is optional. Columns may come in any order after the header.
+# The first load compiles the CSVs into one .npy file per column under
+# COMPILED_DIR, which later loads memory-map instead of parsing the CSVs again.
+COMPILED_DIR = ".compiled"
+
+LOCATION_COLUMNS = ["id", "time", "x", "y"]
+REPORT_COLUMNS = ["id", "time", "status"]
+ANIMAL_COLUMNS = ["id", "radius", "hazard_rate"]
+
+
+# Keyframes of a group of agents sorted by (agent, tick), with agent n's rows at
+# offset[n]:offset[n + 1]
+@dataclass
+class KeyframeTable:
+    agent_id: np.ndarray
+    offset: np.ndarray
+    tick: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+
+    def rows(self, n: int) -> slice:
+        return slice(int(self.offset[n]), int(self.offset[n + 1]))
+
+
+@dataclass
+class ReportTable:
+    agent_id: np.ndarray
+    tick: np.ndarray
+    status: np.ndarray
+
+
+@dataclass
+class AnimalTable:
+    agent_id: np.ndarray
+    radius: np.ndarray
+    hazard_rate: np.ndarray
+
+
+@dataclass
+class CompiledDataset:
+    humans: KeyframeTable
+    reports: ReportTable
+    animals: AnimalTable
+    animal_locations: KeyframeTable
+
+
+TABLES = {
+    "humans": KeyframeTable,
+    "reports": ReportTable,
+    "animals": AnimalTable,
+    "animal_locations": KeyframeTable,
+}
+
+
+def _read_csv(path: str, columns: List[str], dtype=float) -> Dict[str, np.ndarray]:
+    with open(path) as f:
+        header = [name.strip() for name in f.readline().split(",")]
+
+    missing = [c for c in columns if c not in header]
+    if missing:
+        raise ValueError(f"{path} is missing columns {', '.join(missing)}")
+
+    with warnings.catch_warnings():
+        # a header-only file is a valid, empty table
+        warnings.simplefilter("ignore", UserWarning)
+        table = np.loadtxt(
+            path,
+            delimiter=",",
+            skiprows=1,
+            usecols=[header.index(c) for c in columns],
+            dtype=dtype,
+            ndmin=2,
+        )
+    return {c: table[:, n] for n, c in enumerate(columns)}
+
+
+def _to_ticks(seconds: np.ndarray) -> np.ndarray:
+    # same truncation as seconds_to_sim_ticks
+    return np.trunc(seconds / SIM_TICK_TIME_SECONDS).astype(np.int64)
+
+
+def _compile_keyframes(path: str) -> KeyframeTable:
+    columns = _read_csv(path, LOCATION_COLUMNS)
+    agent_id = columns["id"].astype(np.int64)
+    tick = _to_ticks(columns["time"])
+
+    # stable, so of several fixes in one tick the last one in the file wins,
+    # as when a dict is filled by convert_locations
+    order = np.lexsort((tick, agent_id))
+    agent_id, tick = agent_id[order], tick[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (agent_id[1:] != agent_id[:-1]) | (tick[1:] != tick[:-1])
+    order, agent_id, tick = order[last], agent_id[last], tick[last]
+
+    ids, starts = np.unique(agent_id, return_index=True)
+    return KeyframeTable(
+        agent_id=ids,
+        offset=np.append(starts, len(agent_id)).astype(np.int64),
+        tick=tick,
+        x=columns["x"][order],
+        y=columns["y"][order],
+    )
+
+
+def _compile_reports(path: str) -> ReportTable:
+    if not os.path.exists(path):
+        empty = np.zeros(0, dtype=np.int64)
+        return ReportTable(agent_id=empty, tick=empty, status=empty.astype(np.int8))
+
+    columns = _read_csv(path, REPORT_COLUMNS, dtype=str)
+    status = np.array(
+        [
+            int(s) if s.strip().isdigit() else HumanStatus[s.strip()].value
+            for s in columns["status"]
+        ],
+        dtype=np.int8,
+    )
+    return ReportTable(
+        agent_id=columns["id"].astype(np.int64),
+        tick=_to_ticks(columns["time"].astype(float)),
+        status=status,
+    )
+
+
+def _compile_animals(path: str) -> AnimalTable:
+    columns = _read_csv(path, ANIMAL_COLUMNS)
+    return AnimalTable(
+        agent_id=columns["id"].astype(np.int64),
+        radius=columns["radius"],
+        hazard_rate=columns["hazard_rate"],
+    )
+
+
+def _sources(directory: str) -> Dict[str, List[int]]:
+    sources = {}
+    for table in TABLES:
+        path = os.path.join(directory, f"{table}.csv")
+        if os.path.exists(path):
+            stat = os.stat(path)
+            sources[table] = [stat.st_size, stat.st_mtime_ns]
+    return sources
+
+
+# Parses the CSVs of a dataset directory and writes their columns to
+# COMPILED_DIR, unless they were already compiled from the CSVs as they are now
+def compile_dataset(directory: str, force: bool = False) -> str:
+    compiled_dir = os.path.join(directory, COMPILED_DIR)
+    meta_path = os.path.join(compiled_dir, "meta.json")
+    meta = {
+        "sources": _sources(directory),
+        "sim_tick_time_seconds": SIM_TICK_TIME_SECONDS,
+    }
+
+    if not force and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return compiled_dir
+
+    compiled = CompiledDataset(
+        humans=_compile_keyframes(os.path.join(directory, "humans.csv")),
+        reports=_compile_reports(os.path.join(directory, "reports.csv")),
+        animals=_compile_animals(os.path.join(directory, "animals.csv")),
+        animal_locations=_compile_keyframes(
+            os.path.join(directory, "animal_locations.csv")
+        ),
+    )
+
+    os.makedirs(compiled_dir, exist_ok=True)
+    for table in TABLES:
+        columns = getattr(compiled, table)
+        for field in fields(columns):
+            np.save(
+                os.path.join(compiled_dir, f"{table}.{field.name}.npy"),
+                getattr(columns, field.name),
+            )
+    # written last, so an interrupted compile is redone
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+    return compiled_dir
+
+
+# Memory-maps the compiled columns of a dataset directory, compiling it first if needed
+def open_dataset(directory: str) -> CompiledDataset:
+    compiled_dir = compile_dataset(directory)
+
+    tables = {}
+    for table, table_type in TABLES.items():
+        tables[table] = table_type(
+            **{
+                field.name: np.load(
+                    os.path.join(compiled_dir, f"{table}.{field.name}.npy"),
+                    mmap_mode="r",
+                )
+                for field in fields(table_type)
+            }
+        )
+    return CompiledDataset(**tables)
+
+
+def _histories(table: KeyframeTable, compact: bool) -> Dict[int, KeyframeHistory]:
+    histories = {}
+    for n, agent_id in enumerate(table.agent_id):
+        rows = table.rows(n)
+        history = KeyframeHistory(table.tick[rows], table.x[rows], table.y[rows])
+        histories[int(agent_id)] = (
+            KeyframeHistory.compact(history) if compact else history
+        )
+    return histories
+
+
+# Builds the (animals, humans) agents of a compiled dataset. Their location
+# histories are views of the memory-mapped columns, or compact copies of them
+# (KeyframeHistory.compact); only self-reports, which are few, are turned into
+# dicts.
+def build_agents(
+    dataset: CompiledDataset, compact: bool = False
+) -> Tuple[List[AnimalPresence], List[Human]]:
+    reports: Dict[int, Dict[int, HumanStatus]] = {}
+    for agent_id, tick, status in zip(
+        dataset.reports.agent_id.tolist(),
+        dataset.reports.tick.tolist(),
+        dataset.reports.status.tolist(),
+    ):
+        reports.setdefault(agent_id, {})[tick] = HumanStatus(status)
+
+    humans = [
+        Human(id=agent_id, location_history=history, reports=reports.get(agent_id, {}))
+        for agent_id, history in _histories(dataset.humans, compact).items()
+    ]
+
+    migration_patterns = _histories(dataset.animal_locations, compact)
+    animals = [
+        AnimalPresence(
+            id=agent_id,
+            migration_pattern=migration_patterns[agent_id],
+            radius=radius,
+            hazard_rate=hazard_rate,
+        )
+        for agent_id, radius, hazard_rate in zip(
+            dataset.animals.agent_id.tolist(),
+            dataset.animals.radius.tolist(),
+            dataset.animals.hazard_rate.tolist(),
+        )
+    ]
+    return animals, humans
+
+
+_loaded_datasets = {}
+
+
+# Returns the (animals, humans) of a CSV dataset directory, loaded once per process
+def load_csv_dataset(directory: str, compact: bool = False):
+    key = (os.path.abspath(directory), compact)
+    if key not in _loaded_datasets:
+        _loaded_datasets[key] = build_agents(open_dataset(directory), compact)
+    return _loaded_datasets[key]
+
+
+# Writes the agents of a dataset built in Python (e.g. data.DATASETS) out as a
+# CSV dataset directory
+def export_csv_dataset(directory: str, animals, humans):
+    os.makedirs(directory, exist_ok=True)
+
+    def write(name, header, rows):
+        with open(os.path.join(directory, f"{name}.csv"), "w") as f:
+            f.write(",".join(header) + "\n")
+            for row in rows:
+                f.write(",".join(str(v) for v in row) + "\n")
+
+    # keyframes are stored at the start of their tick
+    write(
+        "humans",
+        LOCATION_COLUMNS,
+        [
+            (h.id, t * SIM_TICK_TIME_SECONDS, r.x, r.y)
+            for h in humans
+            for t, r in sorted(h.location_history.items())
+        ],
+    )
+    write(
+        "reports",
+        REPORT_COLUMNS,
+        [
+            (h.id, t * SIM_TICK_TIME_SECONDS, status.name)
+            for h in humans
+            for t, status in sorted(h.self_reports.items())
+        ],
+    )
+    write(
+        "animals",
+        ANIMAL_COLUMNS,
+        [(a.id, a.radius, a.infection_model.output_hazard) for a in animals],
+    )
+    write(
+        "animal_locations",
+        LOCATION_COLUMNS,
+        [
+            (a.id, t * SIM_TICK_TIME_SECONDS, r.x, r.y)
+            for a in animals
+            for t, r in sorted(a.migration_pattern.items())
+        ],
+    )
@@ -0,0 +1,306 @@
+from typing import Callable, Dict, Optional, Tuple
+import argparse
+import asyncio
+import json
+import math
+import sys
+
+from agents import *
+from sim_time import SIM_TICK_TIME_SECONDS
+import simulator
+import user
+
+# Online mode: instead of a dataset loaded up front, location fixes,
+# self-reports and animal sightings arrive as JSON lines (times in seconds, as
+# in loader.py), e.g.
+#   {"type": "fix", "id": 3, "time": 1200, "x": 310.5, "y": 88.0}
+#   {"type": "report", "id": 3, "time": 1500, "status": "SICK"}
+#   {"type": "sighting", "id": 0, "time": 0, "x": 300, "y": 300, "radius": 50, "hazard_rate": 0.1}
+#   {"type": "time", "time": 1800}
+# from a file being written to or a socket. Agents appear with their first fix
+# or sighting, and the simulation is advanced up to the latest time seen minus
+# BUFFER_SECONDS, so fixes arriving up to that late, in any order, are simulated
+# as if they had been in the dataset; later ones are dropped. After every
+# advance the P(zoonotic) of sickness records that changed is published.
+BUFFER_SECONDS = 60
+POLL_SECONDS = 0.2  # how often a tailed file is checked for new lines
+
+
+def _tick(seconds: float) -> int:
+    # same truncation as seconds_to_sim_ticks
+    return int(seconds / SIM_TICK_TIME_SECONDS)
+
+
+class OnlineSimulation:
+    def __init__(
+        self, sim, publish: Callable[[Dict], None], buffer_seconds=BUFFER_SECONDS
+    ):
+        self.sim = sim
+        self.publish = publish
+        self.buffer_seconds = buffer_seconds
+        self.latest_time = -math.inf
+
+        # the agents' datasets, which grow as events arrive
+        self.location_histories: Dict[int, Dict[int, LocationRecord]] = {}
+        self.reports: Dict[int, Dict[int, HumanStatus]] = {}
+        self.migration_patterns: Dict[int, Dict[int, LocationRecord]] = {}
+        self.animals: Dict[int, AnimalPresence] = {}
+
+        self.published: Dict[Tuple[int, int], float] = {}  # (id, record) -> value
+        self.applied = 0
+        self.late = 0  # too late to be simulated
+        self.rejected = 0  # not understood
+
+    # the last tick simulated once the buffer is taken into account
+    def watermark(self) -> int:
+        if self.latest_time == -math.inf:
+            return -1
+        return _tick(self.latest_time - self.buffer_seconds)
+
+    def ingest_line(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            self.ingest(json.loads(line))
+        except (ValueError, KeyError, TypeError) as e:
+            self.rejected += 1
+            print(f"Rejected {line!r}: {e!r}", file=sys.stderr)
+
+    def ingest(self, event: Dict):
+        time = float(event["time"])
+        t = _tick(time)
+        match event["type"]:
+            case "fix":
+                if self._is_late(t):
+                    return
+                self._add_keyframe(
+                    self.sim.human_agents.get(event["id"]),
+                    self.location_histories.setdefault(event["id"], {}),
+                    t,
+                    LocationRecord(x=float(event["x"]), y=float(event["y"])),
+                )
+                if event["id"] not in self.sim.human_agents:
+                    self.sim.add_agent(
+                        Human(
+                            id=event["id"],
+                            location_history=self.location_histories[event["id"]],
+                            reports=self.reports.setdefault(event["id"], {}),
+                        )
+                    )
+
+            case "report":
+                if self._is_late(t):
+                    return
+                status = event["status"]
+                self.reports.setdefault(event["id"], {})[t] = (
+                    HumanStatus(status)
+                    if isinstance(status, int)
+                    else HumanStatus[status]
+                )
+
+            case "sighting":
+                if self._is_late(t):
+                    return
+                self._add_keyframe(
+                    self.animals.get(event["id"]),
+                    self.migration_patterns.setdefault(event["id"], {}),
+                    t,
+                    LocationRecord(x=float(event["x"]), y=float(event["y"])),
+                )
+                if event["id"] not in self.animals:
+                    animal = AnimalPresence(
+                        id=event["id"],
+                        migration_pattern=self.migration_patterns[event["id"]],
+                        radius=float(event["radius"]),
+                        hazard_rate=float(event["hazard_rate"]),
+                    )
+                    self.animals[event["id"]] = animal
+                    self.sim.add_agent(animal)
+
+            case "time":
+                pass
+
+            case kind:
+                raise ValueError(f"Unknown event type {kind}")
+
+        self.applied += 1
+        self.latest_time = max(self.latest_time, time)
+
+    def _is_late(self, t: int) -> bool:
+        if t < self.sim.time_step:
+            self.late += 1
+            return True
+        return False
+
+    # adds a keyframe to an agent's dataset, and its trajectory once it exists
+    def _add_keyframe(self, agent, keyframes, t: int, location: LocationRecord):
+        keyframes[t] = location
+        if agent is None:
+            return
+
+        agent.trajectory.add_keyframe(t, location.x, location.y)
+        if t == agent.trajectory.start_time():
+            # the first keyframe is the agent's own copy, see Human.reset
+            unmoved = agent.location is agent.start_location
+            agent.start_location = LocationRecord(x=location.x, y=location.y)
+            if unmoved:
+                agent.location = agent.start_location
+
+    # simulates up to the watermark and publishes what changed
+    def advance(self, end_tick: Optional[int] = None):
+        end_tick = self.watermark() + 1 if end_tick is None else end_tick
+        if self.sim.time_step >= end_tick or not self.sim.human_agents:
+            return
+
+        self.sim.run_until(end_tick)
+        for h in self.sim.human_agents.values():
+            for n, record in enumerate(h.sickness_records):
+                p_zoonotic = float(record.p_zoonotic)
+                if self.published.get((h.id, n)) != p_zoonotic:
+                    self.published[(h.id, n)] = p_zoonotic
+                    self.publish(
+                        {
+                            "tick": self.sim.time_step - 1,
+                            "id": h.id,
+                            "record": n,
+                            "start_time": record.start_time,
+                            "end_time": record.end_time,
+                            "secondary_cases": record.secondary_cases,
+                            "p_zoonotic": p_zoonotic,
+                        }
+                    )
+
+    # simulates everything received, once no more events will arrive
+    def finish(self):
+        if self.latest_time != -math.inf:
+            self.advance(_tick(self.latest_time) + 1)
+
+
+# puts the lines of a file on the queue as they are written, from its start;
+# None marks the end of a file that is not followed
+async def tail_file(path: str, queue: asyncio.Queue, follow: bool = True):
+    with open(path) as f:
+        partial = ""
+        while True:
+            line = f.readline()
+            if line.endswith("\n"):
+                await queue.put(partial + line)
+                partial = ""
+            elif line:
+                partial += line
+            elif follow:
+                await asyncio.sleep(POLL_SECONDS)
+            else:
+                if partial:
+                    await queue.put(partial)
+                await queue.put(None)
+                return
+
+
+# puts the lines of every connection on the queue; path is a Unix socket, or
+# host:port a TCP one
+async def serve_socket(address: str, queue: asyncio.Queue):
+    async def connection(reader, writer):
+        async for line in reader:
+            await queue.put(line.decode())
+        writer.close()
+
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        server = await asyncio.start_server(connection, host, int(port))
+    else:
+        server = await asyncio.start_unix_server(connection, address)
+    async with server:
+        await server.serve_forever()
+
+
+# Applies lines from the queue as they come, advancing once per batch of lines
+# already waiting, so a burst is simulated in one go
+async def consume(online: OnlineSimulation, queue: asyncio.Queue):
+    while True:
+        line = await queue.get()
+        while line is not None:
+            online.ingest_line(line)
+            if queue.empty():
+                break
+            line = queue.get_nowait()
+        online.advance()
+        if line is None:
+            online.finish()
+            return
+
+
+async def run_online(online: OnlineSimulation, source):
+    queue = asyncio.Queue()
+    producer = asyncio.create_task(source(queue))
+    try:
+        await consume(online, queue)
+    finally:
+        producer.cancel()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Track P(zoonotic) from live location fixes, self-reports and "
+        "animal sightings (JSON lines), printing updates as JSON lines"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="read events from a file, see --follow")
+    source.add_argument(
+        "--socket", metavar="ADDRESS", help="listen on a Unix socket or host:port"
+    )
+    parser.add_argument(
+        "--follow",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="keep reading the file as it grows",
+    )
+    parser.add_argument(
+        "--buffer",
+        type=float,
+        default=BUFFER_SECONDS,
+        help="seconds of event time late or out-of-order events are waited for",
+    )
+    parser.add_argument(
+        "--engine", default=simulator.SIM_ENGINE, choices=["loop", "vectorized", "grid"]
+    )
+    parser.add_argument(
+        "--motion-model",
+        default=user.HUMAN_MOTION_MODEL,
+        choices=["none", "random_walk", "noisy_interp", "interp"],
+        help="human motion between fixes, towards the next fix received",
+    )
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    simulator.SIM_ENGINE = args.engine
+    user.HUMAN_MOTION_MODEL = args.motion_model
+
+    def publish(update: Dict):
+        print(json.dumps(update), flush=True)
+
+    online = OnlineSimulation(
+        simulator.make_simulation(args.seed), publish, args.buffer
+    )
+    if args.file is not None:
+        source = lambda queue: tail_file(args.file, queue, args.follow)
+    else:
+        source = lambda queue: serve_socket(args.socket, queue)
+
+    try:
+        asyncio.run(run_online(online, source))
+    except KeyboardInterrupt:
+        pass
+    print(
+        f"{online.applied} events applied, {online.late} too late, "
+        f"{online.rejected} rejected; simulated up to tick {online.sim.time_step}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,569 @@
+from collections import defaultdict
+from copy import deepcopy
+from dataclasses import dataclass
+from typing import Dict, List, Set, Tuple
+import gc
+import math
+import multiprocessing
+import numpy as np
+import pickle
+import traceback
+
+from agents import *
+from contacts import CONTACT_COLUMNS, NO_END, ContactLog
+from simulator import Simulation
+from spatial import RadiusIndex
+import profiling
+import user
+
+MOVED = -2  # end of a contact row its human took along to another tile
+
+# (index, id, x, y, HumanStatus value, output hazard before / after its update)
+# of a human near a tile it does not stand in, as of the tick being simulated
+HaloEntry = Tuple[int, int, float, float, int, float, float]
+
+
+# The field split into columns x rows equal tiles, numbered row by row. Tiles
+# on the edge extend outwards, so every position has a tile.
+@dataclass
+class TileGrid:
+    left: float
+    top: float
+    right: float
+    bottom: float
+    columns: int
+    rows: int
+
+    # tiles over the bounding box of every keyframe of the agents
+    @classmethod
+    def around(cls, agents, columns: int, rows: int) -> "TileGrid":
+        trajectories = [a.trajectory for a in agents]
+        xs = np.concatenate([t.xs for t in trajectories])
+        ys = np.concatenate([t.ys for t in trajectories])
+        return cls(
+            float(xs.min()),
+            float(ys.min()),
+            float(xs.max()),
+            float(ys.max()),
+            columns,
+            rows,
+        )
+
+    def __len__(self):
+        return self.columns * self.rows
+
+    def _column(self, x: float) -> int:
+        width = (self.right - self.left) / self.columns or 1.0
+        return min(max(int((x - self.left) // width), 0), self.columns - 1)
+
+    def _row(self, y: float) -> int:
+        height = (self.bottom - self.top) / self.rows or 1.0
+        return min(max(int((y - self.top) // height), 0), self.rows - 1)
+
+    def tile_of(self, x: float, y: float) -> int:
+        return self._row(y) * self.columns + self._column(x)
+
+    # tiles with a position less than reach away along both axes
+    def tiles_near(self, x: float, y: float, reach: float) -> Set[int]:
+        columns = range(self._column(x - reach), self._column(x + reach) + 1)
+        rows = range(self._row(y - reach), self._row(y + reach) + 1)
+        return {row * self.columns + column for row in rows for column in columns}
+
+
+# A human of another tile, as the infection model sees it among contacts
+class _HaloHuman:
+    def __init__(self, id: int, output_hazard: float):
+        self.id = id
+        self.infection_model = user.InfectionModel(
+            output_hazard=output_hazard,
+            experienced_animal_hazard=0.0,
+            experienced_human_hazard=0.0,
+        )
+
+
+# One tile of a PartitionedSimulation, in its own process: the humans standing
+# in the tile, with their contact log and hazards, and a copy of every animal,
+# indexed by the cells its radius covers as in GridSimulation. A worker only
+# knows the humans it has held or seen in its halo; its log stays with it, and
+# the coordinator is sent what changed in it since it last asked.
+class _TileWorker:
+    def __init__(
+        self,
+        tile: int,
+        grid: TileGrid,
+        humans: List[Tuple[int, Human]],
+        animals: List[AnimalPresence],
+    ):
+        self.tile = tile
+        self.grid = grid
+        self.time_step = 0
+        # id -> place in the simulation's order, of every human met so far
+        self.index = {h.id: n for n, h in humans}
+        self.humans: Dict[int, Human] = {h.id: h for _, h in humans}
+        self.animal_agents: List[AnimalPresence] = animals
+        self.animal_index = RadiusIndex(CONTACT_NETWORK_PROXIMITY_THRESHOLD)
+        self.contacts = ContactLog()
+        self._sent = 0  # rows of the log the coordinator has been sent
+        self._unsettled = np.empty(0, dtype=np.int64)  # of those, the open ones
+        # (id, tick) -> infection model on the tick of a sickness onset, since
+        # the coordinator last asked
+        self.onsets: Dict[Tuple[int, int], user.InfectionModel] = {}
+
+    # Moves every agent to this tick's position. Returns the humans that left
+    # the tile and the halo entries of every human within reach of another
+    # tile, both by tile.
+    def move(self):
+        for h in self.humans.values():
+            h.move(self)
+        for n, a in enumerate(self.animal_agents):
+            a.move(self)
+            self.animal_index.update(n, a.location.x, a.location.y, a.radius)
+
+        emigrants: Dict[int, List[bytes]] = defaultdict(list)
+        halo: Dict[int, List[HaloEntry]] = defaultdict(list)
+        for h in list(self.humans.values()):
+            x, y = h.location.x, h.location.y
+            owner = self.grid.tile_of(x, y)
+            near = self.grid.tiles_near(x, y, CONTACT_NETWORK_PROXIMITY_THRESHOLD)
+            near.discard(owner)
+            if near:
+                # without spread the status reports set is final for the tick
+                sick = h.status == HumanStatus.SICK
+                entry = (
+                    self.index[h.id],
+                    h.id,
+                    x,
+                    y,
+                    h.status.value,
+                    h.infection_model.output_hazard,
+                    user.HUMAN_HAZARD_SICK if sick else user.HUMAN_HAZARD_HEALTHY,
+                )
+                for tile in near:
+                    halo[tile].append(entry)
+            if owner != self.tile:
+                emigrants[owner].append(self._emigrate(h))
+        return dict(emigrants), dict(halo)
+
+    # the human, whole, and its open contacts, which go on in the new tile's log
+    def _emigrate(self, h: Human) -> bytes:
+        log = self.contacts
+        rows = []
+        for row in h.active_contacts(self).values():
+            rows.append(
+                (
+                    int(log.b[row]),
+                    self.index[int(log.b[row])],
+                    int(log.start[row]),
+                    float(log.total_proximity[row]),
+                    int(log.other_status[row]),
+                )
+            )
+            log.close(row, MOVED)
+        del self.humans[h.id]
+        return pickle.dumps((self.index[h.id], h, rows), pickle.HIGHEST_PROTOCOL)
+
+    def _immigrate(self, state: bytes):
+        index, h, rows = pickle.loads(state)
+        for b, b_index, start, proximity, status in rows:
+            self.contacts.open(h.id, b, start, proximity, HumanStatus(status))
+            self.index[b] = b_index
+        self.index[h.id] = index
+        self.humans[h.id] = h
+
+    # The humans' updates of this tick, in the simulation's order, as the loop
+    # engine's: contacts, then hazards. Sickness records are left to
+    # PartitionedSimulation, as they depend on the whole contact log.
+    def update(self, immigrants: List[bytes], halo: List[HaloEntry]):
+        for state in immigrants:
+            self._immigrate(state)
+
+        cell_size = CONTACT_NETWORK_PROXIMITY_THRESHOLD
+        cells = defaultdict(list)  # cell -> (id, x, y) of the humans in it
+        for h in self.humans.values():
+            x, y = h.location.x, h.location.y
+            cells[(math.floor(x / cell_size), math.floor(y / cell_size))].append(
+                (h.id, x, y)
+            )
+        entries = {}
+        for entry in halo:
+            index, id, x, y, *_ = entry
+            cells[(math.floor(x / cell_size), math.floor(y / cell_size))].append(
+                (id, x, y)
+            )
+            entries[id] = entry
+            self.index[id] = index
+
+        for h in sorted(self.humans.values(), key=lambda h: self.index[h.id]):
+            self._update_human(h, cells, entries, cell_size)
+        self.time_step += 1
+
+    def _update_human(self, h: Human, cells, halo: Dict[int, HaloEntry], cell_size):
+        log = self.contacts
+        x, y = h.location.x, h.location.y
+        cx, cy = math.floor(x / cell_size), math.floor(y / cell_size)
+        near = self._human_contacts(
+            x,
+            y,
+            [
+                entry
+                for cell in [(cx + i, cy + j) for i in (-1, 0, 1) for j in (-1, 0, 1)]
+                for entry in cells.get(cell, ())
+                if entry[0] != h.id
+            ],
+        )
+
+        # opened and closed in the simulation's order, as Human.update_contacts
+        active_contacts = h.active_contacts(self)
+        for id in sorted(near.keys() | active_contacts.keys(), key=self.index.get):
+            if id not in near:
+                log.close(active_contacts[id], self.time_step)
+            elif id in active_contacts:
+                log.total_proximity[active_contacts[id]] += near[id]
+            else:
+                other = self.humans.get(id)
+                status = other.status if other is not None else HumanStatus(halo[id][4])
+                log.open(h.id, id, self.time_step, near[id], status)
+
+        # humans of other tiles updated before this one this tick, as in the loop
+        # engine, have their output hazard of this tick
+        human_contacts = []
+        for id in h.active_contacts(self):
+            other = self.humans.get(id)
+            if other is None:
+                index, _, _, _, _, before, after = halo[id]
+                other = _HaloHuman(id, after if index < self.index[h.id] else before)
+            human_contacts.append(other)
+
+        animal_contacts = self._animal_contacts(
+            x, y, sorted(self.animal_index.candidates(x, y))
+        )
+        user.infection_probability_model(h, animal_contacts, human_contacts)
+        if h.status == HumanStatus.SICK and h.prev_status == HumanStatus.HEALTHY:
+            self.onsets[(h.id, self.time_step)] = deepcopy(h.infection_model)
+        h.prev_status = h.status
+
+    # id -> distance of the candidate (id, x, y) within the contact threshold
+    # of (x, y)
+    def _human_contacts(self, x: float, y: float, candidates) -> Dict[int, float]:
+        near = {}
+        for id, other_x, other_y in candidates:
+            dist = math.sqrt((x - other_x) ** 2 + (y - other_y) ** 2)
+            if dist <= CONTACT_NETWORK_PROXIMITY_THRESHOLD:
+                near[id] = dist
+        return near
+
+    # the candidate animals whose radius (x, y) is in
+    def _animal_contacts(self, x: float, y: float, candidates: List[int]):
+        return [
+            self.animal_agents[n]
+            for n in candidates
+            if math.sqrt(
+                (x - self.animal_agents[n].location.x) ** 2
+                + (y - self.animal_agents[n].location.y) ** 2
+            )
+            <= self.animal_agents[n].radius
+        ]
+
+    # What changed since the coordinator last asked: the worker rows it was
+    # sent open then, followed by the rows opened since (but those that moved
+    # to another tile on opening), with their columns as they are now; the
+    # sickness onsets since; and each human's location and infection model
+    def state(self):
+        log = self.contacts
+        new = np.arange(self._sent, log.size)
+        rows = np.concatenate([self._unsettled, new[log.end[new] != MOVED]])
+        columns = {name: column[rows] for name, column in log.columns().items()}
+        changes = (rows, len(self._unsettled), columns)
+        self._sent = log.size
+        self._unsettled = rows[columns["end"] == NO_END]
+
+        onsets, self.onsets = self.onsets, {}
+        return (
+            changes,
+            onsets,
+            {h.id: (h.location, h.infection_model) for h in self.humans.values()},
+        )
+
+
+# An exception raised by a tile worker, with its traceback in the worker
+@dataclass
+class _WorkerError:
+    error: Exception
+    traceback: str
+
+
+# A worker's commands loop. When profiling, the worker profiles its own work
+# from its fork on and sends it back with its state. Should a command fail,
+# the exception is sent back instead of the next reply and the worker waits to
+# be closed.
+def _serve(tile: int, grid: TileGrid, humans, animals, conn):
+    profiling.take()
+    try:
+        worker = _TileWorker(tile, grid, humans, animals)
+        while True:
+            match conn.recv():
+                case ("move",):
+                    conn.send(worker.move())
+                case ("update", immigrants, halo):
+                    worker.update(immigrants, halo)
+                case ("state",):
+                    conn.send((worker.state(), profiling.take()))
+                case ("close",):
+                    return
+    except Exception as e:
+        conn.send(_WorkerError(e, traceback.format_exc()))
+        while conn.recv() != ("close",):
+            pass
+    finally:
+        conn.close()
+
+
+# Drop-in replacement for Simulation for populations too large for one process,
+# when motion is deterministic and there is no spread (so nothing depends on
+# the order random numbers are drawn in). The field the humans' keyframes span
+# is split into tiles (columns, rows), each simulated by a worker process
+# forked from this one with only the humans standing in it (and the animals):
+# every tick, workers move their agents, hand the humans that crossed into
+# another tile over with their open contacts, and exchange a halo of the humans
+# within CONTACT_NETWORK_PROXIMITY_THRESHOLD of their tile, then update their
+# own humans' contacts and hazards. Every worker moves every animal. Sickness
+# records (secondary cases in particular) depend on the whole contact log, so
+# once run_until is done the rows the workers' logs gained since the last
+# run_until are merged into this one, in the loop engine's row order, and the
+# records are brought up to date from it by the humans' own methods, tick by
+# tick from where they were, in the loop engine's order. Records match the
+# loop engine exactly. Workers last until close(), or until the simulation is
+# garbage collected.
+class PartitionedSimulation(Simulation):
+    def __init__(self, tiles: Tuple[int, int] = (2, 2), seed=None):
+        super().__init__(seed)
+        self.tiles = tiles
+        self._workers = None  # (process, connection) per tile, once started
+        self._simulated = 0  # ticks the workers have simulated
+        # per tile, worker row -> row here of the contacts still open in it
+        self._rows: List[Dict[int, int]] = []
+        self._index: Dict[int, int] = {}  # id -> place in the simulation's order
+        self._reporting: Dict[int, List[int]] = {}  # tick -> humans reporting
+        self._sick: Set[int] = set()  # humans sick, or sick as of their last update
+
+    def _start(self):
+        if user.SIMULATE_SPREAD:
+            raise ValueError("The partitioned engine needs SIMULATE_SPREAD = False")
+        if user.HUMAN_MOTION_MODEL not in ("none", "interp"):
+            raise ValueError(
+                f"Human motion model {user.HUMAN_MOTION_MODEL} is not deterministic"
+            )
+        if self.time_step != 0 or self._simulated != 0:
+            raise ValueError("The partitioned engine starts from tick 0")
+
+        humans = list(self.human_agents.values())
+        self._index = {h.id: n for n, h in enumerate(humans)}
+        self._reporting = defaultdict(list)
+        for n, h in enumerate(humans):
+            for t in h.self_reports:
+                self._reporting[t].append(n)
+
+        grid = TileGrid.around(humans, *self.tiles)
+        tiles = defaultdict(list)
+        for n, h in enumerate(humans):
+            tiles[grid.tile_of(h.location.x, h.location.y)].append((n, h))
+
+        context = multiprocessing.get_context("fork")
+        self._workers = []
+        self._rows = [{} for _ in range(len(grid))]
+        # workers never touch the rest of this process's objects, and with them
+        # frozen their own garbage collections do not either, so those stay
+        # shared with this process instead of being copied into every worker
+        gc.freeze()
+        try:
+            for tile in range(len(grid)):
+                conn, worker_conn = context.Pipe()
+                process = context.Process(
+                    target=_serve,
+                    args=(tile, grid, tiles[tile], self.animal_agents, worker_conn),
+                    daemon=True,
+                )
+                process.start()
+                worker_conn.close()
+                self._workers.append((process, conn))
+        finally:
+            gc.unfreeze()
+
+    # a worker's reply; raises the exception a worker failed with, once every
+    # worker is stopped
+    def _receive(self, tile: int):
+        reply = self._workers[tile][1].recv()
+        if isinstance(reply, _WorkerError):
+            self._terminate()
+            raise reply.error from RuntimeError(
+                f"in the worker of tile {tile}:\n{reply.traceback}"
+            )
+        return reply
+
+    def _step(self):
+        for _, conn in self._workers:
+            conn.send(("move",))
+        moved = [self._receive(tile) for tile in range(len(self._workers))]
+        for tile, (_, conn) in enumerate(self._workers):
+            immigrants = [s for emigrants, _ in moved for s in emigrants.get(tile, [])]
+            halo = [e for _, entries in moved for e in entries.get(tile, [])]
+            conn.send(("update", immigrants, halo))
+        self._simulated += 1
+
+    def update(self):
+        self.run_until(self.time_step + 1)
+
+    def run_until(self, end_tick: int):
+        if end_tick <= self.time_step:
+            return
+        if self._workers is None:
+            self._start()
+        while self._simulated < end_tick:
+            self._step()
+        self._collect()
+
+    # Merges what the workers' logs gained since the last collect and brings the
+    # sickness records up to date. Contacts that opened since then are added in
+    # the loop engine's order (every earlier row started before them); rows
+    # here of contacts open then take their proximity from whichever worker row
+    # carries them on now, found by pair when it has moved to another tile, and
+    # are closed on the tick it closed.
+    def _collect(self):
+        for _, conn in self._workers:
+            conn.send(("state",))
+        states = []
+        for tile in range(len(self._workers)):
+            state, profile = self._receive(tile)
+            states.append(state)
+            if profile is not None:
+                profiling.PROFILER.merge(profiling.Profiler.from_dict(profile))
+
+        log = self.contacts
+        index = self._index
+        collected = self.time_step
+        # (tick, human) -> rows it closes then
+        closes: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+        def settle(tile: int, worker_row: int, row: int, end: int, proximity):
+            log.total_proximity[row] = proximity
+            if end == NO_END:
+                self._rows[tile][worker_row] = row
+            else:
+                closes[(end, index[int(log.a[row])])].append(row)
+
+        # (start, index of a, index of b, a, b, other status, tile, worker row,
+        # end, proximity) of the contacts opened since
+        opened = []
+        for tile, ((rows, unsettled, columns), _, _) in enumerate(states):
+            a, b, start, end, proximity, status = (
+                columns[name].tolist() for name in CONTACT_COLUMNS
+            )
+            for k, worker_row in enumerate(rows.tolist()):
+                if k < unsettled:
+                    row = self._rows[tile].pop(worker_row)
+                elif start[k] < collected:
+                    row = log.open_contacts.row(a[k], b[k])
+                else:
+                    opened.append(
+                        (
+                            start[k],
+                            index[a[k]],
+                            index[b[k]],
+                            a[k],
+                            b[k],
+                            status[k],
+                            tile,
+                            worker_row,
+                            end[k],
+                            proximity[k],
+                        )
+                    )
+                    continue
+                if end[k] != MOVED:
+                    settle(tile, worker_row, row, end[k], proximity[k])
+
+        for start, _, _, a, b, status, tile, worker_row, end, proximity in sorted(
+            opened
+        ):
+            row = log.open(a, b, start, 0.0, HumanStatus(status))
+            settle(tile, worker_row, row, end, proximity)
+        for rows in closes.values():
+            rows.sort(key=lambda row: index[int(log.b[row])])
+
+        onsets = {}
+        for _, worker_onsets, _ in states:
+            onsets.update(worker_onsets)
+        self._rebuild_sickness(collected, closes, onsets)
+
+        for _, _, humans in states:
+            for id, (location, infection_model) in humans.items():
+                self.human_agents[id].location = location
+                self.human_agents[id].infection_model = infection_model
+
+    # Replays the ticks from start up to the workers' as far as sickness records
+    # go: each human closes its contacts and updates its sickness in the loop
+    # engine's order
+    def _rebuild_sickness(
+        self,
+        start: int,
+        closes: Dict[Tuple[int, int], List[int]],
+        onsets: Dict[Tuple[int, int], user.InfectionModel],
+    ):
+        humans = list(self.human_agents.values())
+        closing: Dict[int, Set[int]] = defaultdict(set)  # tick -> humans
+        for t, n in closes:
+            closing[t].add(n)
+
+        sick = self._sick
+        for t in range(start, self._simulated):
+            self.time_step = t
+            for n in self._reporting.get(t, ()):
+                h = humans[n]
+                h.status = h.self_reports[t]
+                if h.status == HumanStatus.SICK:
+                    sick.add(n)
+
+            for n in sorted(sick | closing.get(t, set())):
+                h = humans[n]
+                for row in closes.get((t, n), ()):
+                    h.close_contact(self, row)
+                if n in sick:
+                    if (
+                        h.status == HumanStatus.SICK
+                        and h.prev_status == HumanStatus.HEALTHY
+                    ):
+                        h.infection_model = onsets[(h.id, t)]
+                    h.update_sickness(self, False)
+                    if h.status == HumanStatus.HEALTHY:
+                        sick.discard(n)
+        self.time_step = self._simulated
+
+    # The workers hold the simulation's state, which cannot be pickled with it;
+    # only a simulation yet to start can be snapshot
+    def snapshot(self):
+        if self._workers is not None or self._simulated != 0:
+            raise ValueError(
+                "A partitioned simulation cannot be snapshot once it has run, as "
+                "its state is held by its worker processes"
+            )
+        return super().snapshot()
+
+    def close(self):
+        if self._workers is None:
+            return
+        for process, conn in self._workers:
+            conn.send(("close",))
+            conn.close()
+            process.join()
+        self._workers = None
+
+    # stops the workers without waiting for them, e.g. once one has failed
+    def _terminate(self):
+        for process, conn in self._workers:
+            process.terminate()
+            process.join()
+            conn.close()
+        self._workers = None
+
+    def __del__(self):
+        self.close()
@@ -1,22 +1,71 @@
+from typing import Dict, Tuple
 import math
 
-from scipy.stats import poisson
+import numpy as np
 
 PRIOR_PROBABILITY_ZOONOTIC = 0.01  # TODO: find a data-informed estimate for this
 EXPECTED_SECONDARY_CASES_ZOONOTIC = 0.1
 EXPECTED_SECONDARY_CASES_NON_ZOONOTIC = 2.0
 
+# secondary case counts below this are looked up instead of computed
+PMF_TABLE_SIZE = 256
+
+_pmf_tables: Dict[Tuple[float, int], np.ndarray] = {}
+_log_factorial = np.vectorize(lambda k: math.lgamma(k + 1), otypes=[float])
+
+
+# exp(k log(mu) - mu - log(k!)) for whole numbers k, 0 for any other k (nan for
+# nan), as scipy.stats.poisson.pmf, which is slow to import, gives
+def _poisson_pmf(k, mu):
+    k = np.asarray(k, dtype=float)
+    missing = np.isnan(k)
+    valid = np.isfinite(k) & (k >= 0) & (k == np.floor(k))
+    k = np.where(valid, k, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # 0 log(0) is 0: with no expected cases, 0 cases is certain
+        k_log_mu = np.where(k == 0, 0.0, k * np.log(mu))
+    pmf = np.exp(k_log_mu - mu - _log_factorial(k))
+    pmf = np.where(valid, pmf, np.where(missing, np.nan, 0.0))
+    return pmf[()]
+
+
+# pmf of 0..PMF_TABLE_SIZE-1 for an expectation, built on first use
+def poisson_pmf_table(mu: float) -> np.ndarray:
+    key = (mu, PMF_TABLE_SIZE)
+    if key not in _pmf_tables:
+        _pmf_tables[key] = _poisson_pmf(np.arange(PMF_TABLE_SIZE), mu)
+    return _pmf_tables[key]
+
+
+def poisson_pmf(k, mu):
+    table = poisson_pmf_table(mu)
+
+    if isinstance(k, (int, np.integer)):
+        return table[k] if 0 <= k < PMF_TABLE_SIZE else _poisson_pmf(k, mu)
+    if np.ndim(k) == 0:
+        return _poisson_pmf(k, mu)
+
+    k = np.asarray(k)
+    in_table = (k >= 0) & (k < PMF_TABLE_SIZE) & (k == np.floor(k))
+    if in_table.all():
+        return table[k.astype(np.int64)]
+    return np.where(
+        in_table,
+        table[np.where(in_table, k, 0).astype(np.int64)],
+        _poisson_pmf(k, mu),
+    )
+
 
 def p_hazard_given_zoonotic(hazard_experienced):
     return 1 - math.exp(-hazard_experienced)
 
 
 def p_secondary_cases_given_zoonotic(k):
-    return poisson.pmf(k, EXPECTED_SECONDARY_CASES_ZOONOTIC)
+    return poisson_pmf(k, EXPECTED_SECONDARY_CASES_ZOONOTIC)
 
 
 def p_secondary_cases_given_non_zoonotic(k):
-    return poisson.pmf(k, EXPECTED_SECONDARY_CASES_NON_ZOONOTIC)
+    return poisson_pmf(k, EXPECTED_SECONDARY_CASES_NON_ZOONOTIC)
 
 
 def bayesian_p_zoonotic(hazard_experienced, secondary_cases):
@@ -28,3 +77,18 @@ def bayesian_p_zoonotic(hazard_experienced, secondary_cases):
         f_E * g_k * PRIOR_PROBABILITY_ZOONOTIC
         + ((1 - f_E) * h_k) * (1 - PRIOR_PROBABILITY_ZOONOTIC)
     )
+
+
+# bayesian_p_zoonotic over whole arrays of (hazard, secondary cases) pairs
+def bayesian_p_zoonotic_batch(hazard_experienced, secondary_cases) -> np.ndarray:
+    f_E = 1 - np.exp(-np.asarray(hazard_experienced, dtype=float))
+    g_k = p_secondary_cases_given_zoonotic(secondary_cases)
+    h_k = p_secondary_cases_given_non_zoonotic(secondary_cases)
+
+    return zoonotic_posterior(f_E, g_k, h_k, PRIOR_PROBABILITY_ZOONOTIC)
+
+
+# the posterior from its likelihoods and prior, which may be arrays over a grid
+# of parameters (see sweep.py)
+def zoonotic_posterior(f_E, g_k, h_k, prior):
+    return (f_E * g_k * prior) / (f_E * g_k * prior + ((1 - f_E) * h_k) * (1 - prior))
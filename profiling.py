@@ -0,0 +1,278 @@
+from dataclasses import asdict, dataclass, field
+from time import perf_counter
+from typing import Dict, List
+import functools
+import json
+
+# Opt-in instrumentation of the simulation's hot paths. enable() wraps the
+# functions below with timers and counters, and disable() puts the originals
+# back, so a run that does not profile runs exactly the code it always did.
+PROFILER: "Profiler" = None
+
+
+@dataclass
+class PhaseProfile:
+    seconds: float = 0.0
+    calls: int = 0
+
+
+@dataclass
+class TrialProfile:
+    ticks: int
+    seconds: float
+
+    @property
+    def ticks_per_second(self) -> float:
+        return self.ticks / self.seconds if self.seconds > 0 else float("inf")
+
+
+# Wall time and calls per phase, hot-path counters and per-trial tick rates,
+# merged across worker processes
+@dataclass
+class Profiler:
+    phases: Dict[str, PhaseProfile] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+    trials: List[TrialProfile] = field(default_factory=list)
+
+    def record(self, phase: str, seconds: float):
+        profile = self.phases.get(phase)
+        if profile is None:
+            profile = self.phases[phase] = PhaseProfile()
+        profile.seconds += seconds
+        profile.calls += 1
+
+    def count(self, counter: str, n: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def start_trial(self):
+        self._trial_start = perf_counter()
+
+    def end_trial(self, ticks: int):
+        self.trials.append(TrialProfile(ticks, perf_counter() - self._trial_start))
+
+    def merge(self, other: "Profiler"):
+        for phase, profile in other.phases.items():
+            merged = self.phases.setdefault(phase, PhaseProfile())
+            merged.seconds += profile.seconds
+            merged.calls += profile.calls
+        for counter, n in other.counters.items():
+            self.count(counter, n)
+        self.trials.extend(other.trials)
+
+    def to_dict(self) -> Dict:
+        trial_seconds = sum(trial.seconds for trial in self.trials)
+        return {
+            "trial_seconds": trial_seconds,
+            "phases": {phase: asdict(p) for phase, p in self.phases.items()},
+            "counters": dict(self.counters),
+            "trials": [
+                {**asdict(trial), "ticks_per_second": trial.ticks_per_second}
+                for trial in self.trials
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, profile: Dict) -> "Profiler":
+        return cls(
+            phases={phase: PhaseProfile(**p) for phase, p in profile["phases"].items()},
+            counters=dict(profile["counters"]),
+            trials=[
+                TrialProfile(trial["ticks"], trial["seconds"])
+                for trial in profile["trials"]
+            ],
+        )
+
+    # phases by time spent, as a share of the trials' wall time (phases can
+    # nest, e.g. secondary_cases runs within the update of a human)
+    def summary_table(self) -> str:
+        trial_seconds = sum(trial.seconds for trial in self.trials)
+        lines = [
+            f"{'phase':<28} {'seconds':>10} {'share':>7} {'calls':>12} {'us/call':>9}"
+        ]
+        for phase, p in sorted(
+            self.phases.items(), key=lambda item: item[1].seconds, reverse=True
+        ):
+            share = p.seconds / trial_seconds if trial_seconds > 0 else 0.0
+            lines.append(
+                f"{phase:<28} {p.seconds:>10.3f} {share:>7.1%} {p.calls:>12} "
+                f"{1e6 * p.seconds / max(p.calls, 1):>9.2f}"
+            )
+
+        lines.append("")
+        for counter, n in sorted(self.counters.items()):
+            lines.append(f"{counter:<28} {n:>12}")
+
+        if self.trials:
+            rates = [trial.ticks_per_second for trial in self.trials]
+            lines.append("")
+            lines.append(
+                f"{len(self.trials)} trials in {trial_seconds:.3f}s, ticks/second: "
+                f"mean {sum(rates) / len(rates):.1f}, "
+                f"min {min(rates):.1f}, max {max(rates):.1f}"
+            )
+        return "\n".join(lines)
+
+    # writes <prefix>.json and the summary table to <prefix>.txt
+    def save(self, prefix: str):
+        with open(f"{prefix}.json", "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        with open(f"{prefix}.txt", "w") as f:
+            f.write(self.summary_table() + "\n")
+
+
+# EventSimulation._solve solves a human's windows with the other humans, or with
+# the animals, or an animal's with the humans
+def _event_pair_checks(sim, k, others, reach, due):
+    num_humans = len(sim._humans)
+    humans = k < num_humans and (len(others) == 0 or others[0] < num_humans)
+    return {"human_pair_checks" if humans else "animal_pair_checks": len(others)}
+
+
+# (owner, function name, phase or None to only count, counters: call args -> counts)
+# for every engine; phases of the same name are the same work in each
+def _hooks():
+    from agents import AnimalPresence, Human
+    from contacts import ContactLog
+    from engine import GridSimulation, VectorizedSimulation
+    from events import EventSimulation
+    from partition import PartitionedSimulation, _TileWorker
+    import user
+
+    return [
+        (Human, "move", "move", None),
+        (AnimalPresence, "move", "move", None),
+        (
+            Human,
+            "animal_contacts",
+            "animal_radius",
+            lambda human, sim: {"animal_pair_checks": len(sim.animal_agents)},
+        ),
+        (
+            Human,
+            "update_contacts",
+            "human_contacts",
+            lambda human, sim: {"human_pair_checks": len(sim.human_agents) - 1},
+        ),
+        (user, "infection_probability_model", "infection_probability_model", None),
+        (Human, "secondary_cases", "secondary_cases", None),
+        (user, "zoonotic_probability_model", "zoonotic_probability_model", None),
+        (ContactLog, "open", None, lambda *args: {"contacts_opened": 1}),
+        (ContactLog, "close", None, lambda *args: {"contacts_closed": 1}),
+        # vectorized: every pair at once
+        (
+            VectorizedSimulation,
+            "_animal_contacts",
+            "animal_radius",
+            lambda sim: {
+                "animal_pair_checks": len(sim._humans) * len(sim.animal_agents)
+            },
+        ),
+        (
+            VectorizedSimulation,
+            "_human_contacts",
+            "human_contacts",
+            lambda sim: {
+                "human_pair_checks": len(sim._humans) * (len(sim._humans) - 1)
+            },
+        ),
+        (VectorizedSimulation, "_record_contacts", "contact_records", None),
+        (
+            user,
+            "batch_infection_probability_model",
+            "infection_probability_model",
+            None,
+        ),
+        # grid: the pairs in neighbouring cells
+        (GridSimulation, "_index_agents", "spatial_index", None),
+        (
+            GridSimulation,
+            "_human_contacts",
+            "human_contacts",
+            lambda sim, candidates: {"human_pair_checks": len(candidates)},
+        ),
+        (
+            GridSimulation,
+            "_animal_contacts",
+            "animal_radius",
+            lambda sim, h, candidates: {"animal_pair_checks": len(candidates)},
+        ),
+        # event: windows solved when an agent starts a new piece of its motion
+        (EventSimulation, "_next_piece", "move", None),
+        (EventSimulation, "_solve", "pair_windows", _event_pair_checks),
+        (EventSimulation, "_update_human", "update_human", None),
+        (EventSimulation, "_sum_proximity", "proximity_sums", None),
+        (EventSimulation, "_sync", "sync", None),
+        # partitioned: tile workers profile themselves, see partition._serve
+        (
+            _TileWorker,
+            "_human_contacts",
+            "human_contacts",
+            lambda worker, x, y, candidates: {"human_pair_checks": len(candidates)},
+        ),
+        (
+            _TileWorker,
+            "_animal_contacts",
+            "animal_radius",
+            lambda worker, x, y, candidates: {"animal_pair_checks": len(candidates)},
+        ),
+        (_TileWorker, "_emigrate", "migration", lambda *args: {"migrations": 1}),
+        (_TileWorker, "_immigrate", "migration", None),
+        (PartitionedSimulation, "_step", "tile_exchange", None),
+        (PartitionedSimulation, "_collect", "collect", None),
+        (PartitionedSimulation, "_rebuild_sickness", "rebuild_sickness", None),
+    ]
+
+
+_originals = []
+
+
+def _instrument(owner, name, phase, counters):
+    original = getattr(owner, name)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        if counters is not None:
+            for counter, n in counters(*args, **kwargs).items():
+                PROFILER.count(counter, n)
+        if phase is None:
+            return original(*args, **kwargs)
+
+        start = perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            PROFILER.record(phase, perf_counter() - start)
+
+    _originals.append((owner, name, original))
+    setattr(owner, name, wrapper)
+
+
+def enable() -> Profiler:
+    global PROFILER
+
+    if PROFILER is None:
+        PROFILER = Profiler()
+        for owner, name, phase, counters in _hooks():
+            _instrument(owner, name, phase, counters)
+    return PROFILER
+
+
+def disable():
+    global PROFILER
+
+    while _originals:
+        owner, name, original = _originals.pop()
+        setattr(owner, name, original)
+    PROFILER = None
+
+
+# the profile gathered so far as a dict (e.g. to send back from a worker
+# process), starting a new one; None when not profiling
+def take():
+    global PROFILER
+
+    if PROFILER is None:
+        return None
+    profile = PROFILER.to_dict()
+    PROFILER = Profiler()
+    return profile
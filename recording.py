@@ -0,0 +1,76 @@
+from dataclasses import asdict, dataclass, fields
+from typing import List
+import os
+import numpy as np
+
+from sim_time import SIM_TICK_TIME_SECONDS
+
+
+# Where every agent was, and every human's status, on every tick of a trial:
+# (ticks x agents) float32 / int8 arrays, saved as a compressed .npz file that
+# display.py can replay without running the simulation again
+@dataclass
+class Recording:
+    ticks: np.ndarray  # tick each row was recorded after
+    human_ids: np.ndarray
+    human_x: np.ndarray
+    human_y: np.ndarray
+    human_status: np.ndarray  # HumanStatus values
+    animal_ids: np.ndarray
+    animal_x: np.ndarray
+    animal_y: np.ndarray
+    animal_radius: np.ndarray
+    tick_seconds: np.ndarray  # SIM_TICK_TIME_SECONDS when recorded
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, **asdict(self))
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with np.load(path) as arrays:
+            return cls(**{field.name: arrays[field.name] for field in fields(cls)})
+
+
+# Captures a simulation after each update, whatever its engine
+class TrialRecorder:
+    def __init__(self, sim):
+        self.humans = list(sim.human_agents.values())
+        self.animals = list(sim.animal_agents)
+        self.ticks: List[int] = []
+        self.human_rows: List[np.ndarray] = []  # x, y, status
+        self.animal_rows: List[np.ndarray] = []  # x, y, radius
+
+    def capture(self, sim):
+        self.ticks.append(sim.time_step - 1)
+        self.human_rows.append(
+            np.array(
+                [[h.location.x, h.location.y, h.status.value] for h in self.humans],
+                dtype=np.float32,
+            ).reshape(-1, 3)
+        )
+        self.animal_rows.append(
+            np.array(
+                [[a.location.x, a.location.y, a.radius] for a in self.animals],
+                dtype=np.float32,
+            ).reshape(-1, 3)
+        )
+
+    def recording(self) -> Recording:
+        humans = np.stack(self.human_rows).reshape(-1, len(self.humans), 3)
+        animals = np.stack(self.animal_rows).reshape(-1, len(self.animals), 3)
+        return Recording(
+            ticks=np.array(self.ticks, dtype=np.int32),
+            human_ids=np.array([h.id for h in self.humans], dtype=np.int32),
+            human_x=humans[:, :, 0],
+            human_y=humans[:, :, 1],
+            human_status=humans[:, :, 2].astype(np.int8),
+            animal_ids=np.array([a.id for a in self.animals], dtype=np.int32),
+            animal_x=animals[:, :, 0],
+            animal_y=animals[:, :, 1],
+            animal_radius=animals[:, :, 2],
+            tick_seconds=np.array(SIM_TICK_TIME_SECONDS),
+        )
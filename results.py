@@ -0,0 +1,144 @@
+from typing import Dict, List, Sequence
+import json
+import os
+import numpy as np
+
+# result name (BatchResults field, SimulationHumanResult field without the
+# "sickness_" prefix) -> label used in file names and plots
+RESULT_VALUES = {
+    "secondary_cases": "Secondary Cases",
+    "animal_hazard": "Animal Hazard @ Sickness",
+    "human_hazard": "Human Hazard @ Sickness",
+    "p_zoonotic": "P(Sickness from Zoonotic Origin)",
+}
+
+
+# Writes (num_humans x num_trials) result matrices as trials finish, straight
+# into memory-mapped .npy files "<run>_<label>.npy" in directory, next to
+# "<run>_completed.npy" marking the trials written so far, "<run>_run.json"
+# with the settings needed to resume the run and, when trials have seeds of
+# their own, "<run>_seeds.npy" with the seed each trial can be run again from
+# (simulator.trial). Trials are only marked complete once their results are
+# flushed, so a resumed run redoes any trial that was being written when the
+# previous one stopped. Without a directory only the completed trials are
+# tracked and the results themselves are dropped.
+class ResultsWriter:
+    def __init__(
+        self,
+        directory,
+        run,
+        num_humans: int,
+        num_trials: int,
+        settings: Dict,
+        resume: bool = False,
+        seeds: Sequence[int] = None,
+    ):
+        self.num_humans = num_humans
+        self.num_trials = num_trials
+        self.settings = settings
+        self.seeds = seeds
+
+        if directory is None:
+            self.arrays = {}
+            self.completed = np.zeros(num_trials, dtype=bool)
+            return
+
+        prefix = os.path.join(directory, str(run))
+        if resume:
+            self._open(prefix)
+        else:
+            self._create(directory, prefix)
+
+    # the run's files; creating its settings file claims the run, so another
+    # run with the same id cannot overwrite it
+    def _create(self, directory, prefix):
+        os.makedirs(directory, exist_ok=True)
+        try:
+            f = open(f"{prefix}_run.json", "x")
+        except FileExistsError:
+            raise ValueError(f"Run {prefix} already exists, resume it instead")
+        with f:
+            json.dump(
+                {
+                    "num_humans": self.num_humans,
+                    "num_trials": self.num_trials,
+                    **self.settings,
+                },
+                f,
+                indent=1,
+            )
+        if self.seeds is not None:
+            np.save(f"{prefix}_seeds.npy", np.asarray(self.seeds, dtype=np.uint64))
+
+        self.arrays = {
+            name: np.lib.format.open_memmap(
+                f"{prefix}_{label}.npy",
+                mode="w+",
+                dtype=float,
+                shape=(self.num_humans, self.num_trials),
+            )
+            for name, label in RESULT_VALUES.items()
+        }
+        self.completed = np.lib.format.open_memmap(
+            f"{prefix}_completed.npy", mode="w+", dtype=bool, shape=(self.num_trials,)
+        )
+
+    def _open(self, prefix):
+        with open(f"{prefix}_run.json") as f:
+            saved = json.load(f)
+        if (saved["num_humans"], saved["num_trials"]) != (
+            self.num_humans,
+            self.num_trials,
+        ):
+            raise ValueError(
+                f"Cannot resume {prefix}: it has {saved['num_humans']} humans and "
+                f"{saved['num_trials']} trials, not {self.num_humans} and {self.num_trials}"
+            )
+        self.settings = {
+            k: v for k, v in saved.items() if k not in ("num_humans", "num_trials")
+        }
+
+        self.arrays = {
+            name: np.load(f"{prefix}_{label}.npy", mmap_mode="r+")
+            for name, label in RESULT_VALUES.items()
+        }
+        self.completed = np.load(f"{prefix}_completed.npy", mmap_mode="r+")
+
+    # settings recorded when the run was created, e.g. its master seed
+    @staticmethod
+    def saved_settings(directory, run) -> Dict:
+        with open(os.path.join(directory, f"{run}_run.json")) as f:
+            return json.load(f)
+
+    def pending(self) -> List[int]:
+        return np.flatnonzero(~self.completed).tolist()
+
+    # results of the trials written so far, e.g. to summarize a resumed run
+    def completed_matrices(self) -> Dict[str, np.ndarray]:
+        return {
+            name: np.asarray(array[:, self.completed])
+            for name, array in self.arrays.items()
+        }
+
+    # matrices: result name -> (num_humans x len(trial_nums)) values
+    def write(self, trial_nums: Sequence[int], matrices: Dict[str, np.ndarray]):
+        columns = np.asarray(trial_nums, dtype=np.int64)
+        for name, array in self.arrays.items():
+            array[:, columns] = matrices[name]
+            if isinstance(array, np.memmap):
+                array.flush()
+
+        self.completed[columns] = True
+        if isinstance(self.completed, np.memmap):
+            self.completed.flush()
+
+
+# Per-trial SimulationHumanResult dicts (human id -> result) as result matrices;
+# humans that never fell sick have no result and get zeros
+def results_matrices(results: Sequence[Dict], num_humans: int) -> Dict[str, np.ndarray]:
+    matrices = {name: np.zeros((num_humans, len(results))) for name in RESULT_VALUES}
+    for column, trial_result in enumerate(results):
+        for id, human_res in trial_result.items():
+            for name, matrix in matrices.items():
+                matrix[id, column] = getattr(human_res, f"sickness_{name}")
+    return matrices
@@ -0,0 +1,6 @@
+SIM_TICK_TIME_SECONDS = 10
+FRAMES_PER_SECOND = 10  # display refresh rate
+
+
+def seconds_to_sim_ticks(s: float) -> int:
+    return int(s / SIM_TICK_TIME_SECONDS)
@@ -1,30 +1,36 @@
 from itertools import chain
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from collections import defaultdict
-import copy
-import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import os
 import time
-import matplotlib.pyplot as plt
 import numpy as np
+import tqdm
 
-from data import *
+from sim_time import SIM_TICK_TIME_SECONDS, FRAMES_PER_SECOND, seconds_to_sim_ticks
 from agents import *
-from display import *
+from contacts import ContactLog
+from recording import TrialRecorder
+from snapshot import Snapshot, take_snapshot
+from streams import ANIMAL_MOTION, HUMAN_MOTION, INFECTION, TrialStreams
+from results import RESULT_VALUES, ResultsWriter, results_matrices
+from stats import ResultsSummary
+import data
+import profiling
+import user
+
+# pygame (display.py) and matplotlib are only imported when displaying / plotting
 
 
 GRID_WIDTH = 600
 GRID_HEIGHT = 600
 
-SIM_TICK_TIME_SECONDS = 10
 REAL_SECONDS_PER_SIM_SECOND = FRAMES_PER_SECOND * SIM_TICK_TIME_SECONDS
 
 STOP_SIM_AFTER = 600
 
 
-def seconds_to_sim_ticks(s: float) -> int:
-    return int(s / SIM_TICK_TIME_SECONDS)
-
-
 @dataclass
 class SimulationHumanResult:
     sickness_secondary_cases: int = 0
@@ -34,16 +40,26 @@ class SimulationHumanResult:
 
 
 class Simulation:
-    def __init__(self):
+    def __init__(self, seed=None):
         self.human_agents: Dict[Human] = {}  # id -> Human
         self.animal_agents: List[AnimalPresence] = []
+        self.contacts = ContactLog()
         self.time_step = 0
+        self.streams = TrialStreams(seed)
 
     def add_agent(self, agent):
         if isinstance(agent, Human):
             self.human_agents[agent.id] = agent
         else:
             self.animal_agents.append(agent)
+        self._give_streams(agent)
+
+    def _give_streams(self, agent):
+        if isinstance(agent, Human):
+            agent.motion_stream = self.streams.stream(HUMAN_MOTION, agent.id)
+            agent.infection_stream = self.streams.stream(INFECTION, agent.id)
+        else:
+            agent.motion_stream = self.streams.stream(ANIMAL_MOTION, agent.id)
 
     def update(self):
         for agent in chain(self.human_agents.values(), self.animal_agents):
@@ -54,14 +70,43 @@ class Simulation:
 
         self.time_step += 1
 
+    # advances until time_step reaches end_tick; engines that can skip ticks
+    # override this
+    def run_until(self, end_tick: int):
+        while self.time_step < end_tick:
+            self.update()
+
+    # the whole state, to restore or fork continuations from, see snapshot.py
+    def snapshot(self) -> Snapshot:
+        return take_snapshot(self)
+
+    # continues with the random streams of another seed (Snapshot.fork);
+    # engines that draw random numbers ahead draw them again
+    def reseed(self, seed):
+        self.streams = TrialStreams(seed)
+        for agent in chain(self.human_agents.values(), self.animal_agents):
+            self._give_streams(agent)
+
     def print_results(self):
         for h in self.human_agents.values():
             print(f"*** HUMAN {h.id} ***")
             print(f"Final infection model: {h.infection_model}\n")
-            print(f"Contact network: {h.contact_network}\n")
+            print(f"Contact network: {h.contact_network(self)}\n")
             print(f"Sickness records: {h.sickness_records}")
             print(f"*** END HUMAN {h.id} ***\n")
 
+    # the contact graph during ticks [start, end) as a CSR matrix indexed by
+    # human id, weighted by duration or average proximity, see
+    # ContactLog.adjacency
+    def contact_graph(self, weight="duration", start=None, end=None):
+        return self.contacts.adjacency(
+            weight,
+            start,
+            end,
+            now=self.time_step,
+            num_humans=max(self.human_agents, default=-1) + 1,
+        )
+
     def get_results(self):
         res = {}
         for h in self.human_agents.values():
@@ -86,86 +131,591 @@ class Simulation:
 
 USE_DISPLAY = False
 SAVE_DATA = True
+PLOT_DATA = True
+OUTPUT_DIR = "data"
 NUM_TRIALS = 1000
-GLOBAL_DESC = int(time.time())
+GLOBAL_DESC = f"{int(time.time())}-{os.getpid()}"  # run id: start time and process
 MOTION_MODEL_DESC = "h_noisy_interp"
-DATASET_DESC = "RD"
-
-
-def trial():
-
-    sim = Simulation()
+DATASET_DESC = "RD"  # dataset from data.DATASETS, also names the output folder
+DATASET_DIR = (
+    None  # CSV dataset directory (see loader.py) to run instead of DATASET_DESC
+)
+COMPACT_KEYFRAMES = (
+    False  # keyframes as int32 ticks and float32 positions, see KeyframeHistory.compact
+)
+BATCH_TRIALS = False  # advance all trials together as arrays instead of one by one
+SIM_ENGINE = "loop"  # "loop" (per-agent), "vectorized" (NumPy), "grid" (spatial hash), see engine.py, "event" (events.py) or "partitioned" (partition.py)
+PARTITION_TILES = (2, 2)  # (columns, rows) of tiles for the partitioned engine
+NUM_WORKERS = 1  # > 1 runs trials in parallel worker processes
+TRIALS_PER_CHUNK = 25  # trials handed to a worker at a time
+MASTER_SEED = None  # every trial's seed is derived from this; None picks a fresh one
+CI_TARGET_WIDTH = None  # stop once every human's mean of every result has a confidence interval narrower than this
+CI_LEVEL = 0.95
+MIN_TRIALS = 50  # trials run before checking CI_TARGET_WIDTH
+SKETCH_CAPACITY = 256  # values kept per level of each quantile sketch (see stats.py)
+COMPARE_CONFIGS = None  # e.g. ["HUMAN_MOTION_MODEL=noisy_interp", "HUMAN_MOTION_MODEL=random_walk"], see compare.py
+ANTITHETIC = False  # compared trials come in antithetic pairs
+SWEEPS = (
+    None  # e.g. ["HAZARD_DECAY=0.95,0.99", "HUMAN_HAZARD_SICK=0.5,0.7"], see sweep.py
+)
+PROFILE = (
+    False  # time the phases of every update and count hot-path work, see profiling.py
+)
+RECORD_TRIALS = (
+    None  # numbers of the trials to record for display.py to replay, or "all"
+)
+
+
+# a simulation drawing its random numbers from streams of the given seed (see
+# streams.py), or of a fresh one
+def make_simulation(seed=None):
+    match SIM_ENGINE:
+        case "loop":
+            return Simulation(seed)
+        case "vectorized":
+            from engine import VectorizedSimulation
+
+            return VectorizedSimulation(seed)
+        case "grid":
+            from engine import GridSimulation
+
+            return GridSimulation(seed=seed)
+        case "event":
+            from events import EventSimulation
+
+            return EventSimulation(seed)
+        case "partitioned":
+            from partition import PartitionedSimulation
+
+            return PartitionedSimulation(PARTITION_TILES, seed)
+        case _:
+            raise ValueError(f"Unknown simulation engine {SIM_ENGINE}")
+
+
+# Returns the (animals, humans) agents every trial starts from
+def load_dataset():
+    if DATASET_DIR is not None:
+        from loader import load_csv_dataset
+
+        return load_csv_dataset(DATASET_DIR, COMPACT_KEYFRAMES)
+    return data.load_dataset(DATASET_DESC, COMPACT_KEYFRAMES)
+
+
+# Settings the command line can override, handed to worker processes
+def current_settings():
+    return {
+        "DATASET_DESC": DATASET_DESC,
+        "DATASET_DIR": DATASET_DIR,
+        "MOTION_MODEL_DESC": MOTION_MODEL_DESC,
+        "SIM_ENGINE": SIM_ENGINE,
+        "HUMAN_MOTION_MODEL": user.HUMAN_MOTION_MODEL,
+        "COMPACT_KEYFRAMES": COMPACT_KEYFRAMES,
+    }
+
+
+def apply_settings(settings):
+    global DATASET_DESC, DATASET_DIR, MOTION_MODEL_DESC, SIM_ENGINE, COMPACT_KEYFRAMES
+
+    DATASET_DESC = settings["DATASET_DESC"]
+    DATASET_DIR = settings["DATASET_DIR"]
+    MOTION_MODEL_DESC = settings["MOTION_MODEL_DESC"]
+    SIM_ENGINE = settings["SIM_ENGINE"]
+    user.HUMAN_MOTION_MODEL = settings["HUMAN_MOTION_MODEL"]
+    # absent from the settings of runs saved before it existed
+    COMPACT_KEYFRAMES = settings.get("COMPACT_KEYFRAMES", False)
+
+
+def trial(seed=None, record_path=None):
+    profiler = profiling.PROFILER
+    if profiler is not None:
+        profiler.start_trial()
+
+    sim = make_simulation(seed)
 
     if USE_DISPLAY:
+        from display import Display
+
         display = Display(simulation=sim, width=GRID_WIDTH, height=GRID_HEIGHT)
 
-    animals = copy.deepcopy(RD_ANIMALS)
-    humans = copy.deepcopy(RD_HUMANS)
+    # trajectories and reports are shared, only per-trial state is allocated
+    dataset_animals, dataset_humans = load_dataset()
+    animals = [a.trial_copy() for a in dataset_animals]
+    humans = [h.trial_copy() for h in dataset_humans]
 
     for a in chain(animals, humans):
         sim.add_agent(a)
 
-    running = True
-    while running:
-        sim.update()
+    if USE_DISPLAY or record_path is not None:
+        recorder = TrialRecorder(sim) if record_path is not None else None
+        running = True
+        while running:
+            sim.update()
+            if recorder is not None:
+                recorder.capture(sim)
+            if USE_DISPLAY:
+                running = display.render()
+
+            if sim.time_step > seconds_to_sim_ticks(STOP_SIM_AFTER):
+                running = False
 
         if USE_DISPLAY:
-            running = display.render()
+            display.cleanup()
+        if recorder is not None:
+            recorder.recording().save(record_path)
+    else:
+        sim.run_until(seconds_to_sim_ticks(STOP_SIM_AFTER) + 1)
 
-        if sim.time_step > seconds_to_sim_ticks(STOP_SIM_AFTER):
-            running = False
+    # sim.print_results()
+    results = sim.get_results()
+    if profiler is not None:
+        profiler.end_trial(sim.time_step)
+    return results
+
+
+# One independent seed per trial, so a trial's result only depends on the
+# master seed and its own number, not on how trials are split across workers
+def trial_seeds(master_seed, num_trials):
+    seed_sequence = np.random.SeedSequence(master_seed)
+    return [int(s.generate_state(1)[0]) for s in seed_sequence.spawn(num_trials)]
+
+
+# Runs in a worker process; returns the trials' results and, when profiling,
+# the chunk's profile
+def run_trial_chunk(seeds, profile=False, record_paths=None):
+    if profile:
+        profiling.enable()
+    if record_paths is None:
+        record_paths = [None] * len(seeds)
+    results = [trial(seed, path) for seed, path in zip(seeds, record_paths)]
+    return results, profiling.take()
+
+
+# trial number -> where to save its recording, for the trials to record
+def recording_paths(trial_nums):
+    if RECORD_TRIALS is None:
+        return {}
+    return {
+        n: f"{output_path(f'Recording_{n}')}.npz"
+        for n in trial_nums
+        if RECORD_TRIALS == "all" or n in RECORD_TRIALS
+    }
+
+
+# Writes a block of finished trials and adds it to the summary; returns whether
+# the run can stop early
+def record_trials(trial_nums, matrices, writer: ResultsWriter, summary: ResultsSummary):
+    writer.write(trial_nums, matrices)
+    summary.add(matrices)
+    return (
+        CI_TARGET_WIDTH is not None
+        and summary.count >= MIN_TRIALS
+        and summary.converged(CI_TARGET_WIDTH, CI_LEVEL)
+    )
 
-    if USE_DISPLAY:
-        display.cleanup()
 
-    # sim.print_results()
-    return sim.get_results()
+# Runs the trials the writer has not got results for yet, serially or over
+# NUM_WORKERS processes, recording each chunk of TRIALS_PER_CHUNK trials as soon
+# as it is done, until they are all done or the summary has converged
+def run_trials(master_seed, writer: ResultsWriter, summary: ResultsSummary):
+    seeds = trial_seeds(master_seed, NUM_TRIALS)
+    pending = writer.pending()
+    record_paths = recording_paths(pending)
+    chunks = [
+        pending[start : start + TRIALS_PER_CHUNK]
+        for start in range(0, len(pending), TRIALS_PER_CHUNK)
+    ]
+
+    with tqdm.tqdm(total=NUM_TRIALS, initial=NUM_TRIALS - len(pending)) as progress:
+        if NUM_WORKERS <= 1 or USE_DISPLAY:
+            for chunk in chunks:
+                results = []
+                for trial_num in chunk:
+                    results.append(trial(seeds[trial_num], record_paths.get(trial_num)))
+                    progress.update()
+                matrices = results_matrices(results, writer.num_humans)
+                if record_trials(chunk, matrices, writer, summary):
+                    return
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=NUM_WORKERS,
+            initializer=apply_settings,
+            initargs=(current_settings(),),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    run_trial_chunk,
+                    [seeds[n] for n in chunk],
+                    PROFILE,
+                    [record_paths.get(n) for n in chunk],
+                ): chunk
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                chunk = futures[future]
+                results, profile = future.result()
+                if profile is not None:
+                    profiling.PROFILER.merge(profiling.Profiler.from_dict(profile))
+                matrices = results_matrices(results, writer.num_humans)
+                progress.update(len(chunk))
+                if record_trials(chunk, matrices, writer, summary):
+                    # chunks already running finish, but are not recorded
+                    for other in futures:
+                        other.cancel()
+                    return
+
+
+# Advances all pending trials together, see batch.py. They share one random
+# stream, so an interrupted batch is rerun as a whole, and there is no early stop.
+def run_batched_trials(master_seed, writer: ResultsWriter, summary: ResultsSummary):
+    from batch import BatchedTrials
+
+    pending = writer.pending()
+    if not pending:
+        return
+
+    animals, humans = load_dataset()
+    batch = BatchedTrials(
+        humans=humans,
+        animals=animals,
+        num_trials=len(pending),
+        num_ticks=seconds_to_sim_ticks(STOP_SIM_AFTER) + 1,
+        seed=master_seed,
+    )
+    for _ in tqdm.tqdm(range(batch.num_ticks)):
+        batch.update()
+
+    record_trials(pending, asdict(batch.results()), writer, summary)
+
+
+# Runs NUM_TRIALS batched trials of every configuration in COMPARE_CONFIGS with
+# common random numbers, and reports their paired differences from the first
+def run_comparison_trials(master_seed):
+    from compare import (
+        compare,
+        parse_config,
+        print_comparison,
+        run_comparison,
+        save_comparison,
+    )
+
+    animals, humans = load_dataset()
+    results = run_comparison(
+        animals,
+        humans,
+        {config: parse_config(config) for config in COMPARE_CONFIGS},
+        num_trials=NUM_TRIALS,
+        num_ticks=seconds_to_sim_ticks(STOP_SIM_AFTER) + 1,
+        seed=master_seed,
+        antithetic=ANTITHETIC,
+    )
+    differences = compare(results, ANTITHETIC, CI_LEVEL)
+    print_comparison(results, differences, CI_LEVEL)
+
+    if SAVE_DATA:
+        save_comparison(f"{output_path('Comparison')}.npz", results, differences)
+
+
+# Evaluates every combination of the SWEEPS parameter values on NUM_TRIALS
+# trials, each simulated once. Their exposure timelines are cached, so sweeping
+# the same trials (same --seed and --trials, dataset and settings, see
+# sweep.timelines_digest) again does not simulate anything.
+def run_sweep(master_seed):
+    from sweep import (
+        ExposureTimelines,
+        evaluate_sweep,
+        parse_sweep,
+        print_sweep,
+        run_exposure_timelines,
+        save_sweep,
+        sweep_grid,
+        timelines_digest,
+    )
 
+    grid = sweep_grid(dict(parse_sweep(text) for text in SWEEPS))
+    num_ticks = seconds_to_sim_ticks(STOP_SIM_AFTER) + 1
+    digest = timelines_digest(*load_dataset())
+    cache_path = os.path.join(
+        results_dir(),
+        f"Exposure_{master_seed}_{NUM_TRIALS}x{num_ticks}_{digest}.npz",
+    )
+    if os.path.exists(cache_path):
+        print(f"Exposure timelines from {cache_path}")
+        timelines = ExposureTimelines.load(cache_path)
+    else:
+        timelines = run_exposure_timelines(
+            Simulation,
+            load_dataset,
+            num_ticks,
+            trial_seeds(master_seed, NUM_TRIALS),
+            NUM_WORKERS,
+            TRIALS_PER_CHUNK,
+            initializer=apply_settings,
+            initargs=(current_settings(),),
+        )
+        if SAVE_DATA:
+            os.makedirs(results_dir(), exist_ok=True)
+            timelines.save(cache_path)
+
+    cubes = evaluate_sweep(timelines, grid)
+    print_sweep(grid, cubes)
+    if SAVE_DATA:
+        save_sweep(f"{output_path('Sweep')}.npz", grid, cubes)
 
-def save_data(data, value):
-    np.save(f"data/{DATASET_DESC}/{MOTION_MODEL_DESC}/{GLOBAL_DESC}_{value}.npy", data)
 
-    num_rows = data.shape[0]
+def results_dir():
+    return os.path.join(OUTPUT_DIR, DATASET_DESC, MOTION_MODEL_DESC)
+
+
+def output_path(value):
+    os.makedirs(results_dir(), exist_ok=True)
+    return os.path.join(results_dir(), f"{GLOBAL_DESC}_{value}")
+
+
+# boxplot of one result per human, drawn from its quantile sketch
+def plot_data(summary: ResultsSummary, name, value):
+    import matplotlib.pyplot as plt
+
+    num_rows = summary.stats[name].mean.shape[0]
     plt.figure()
-    plt.boxplot(data.T)
+    plt.gca().bxp(summary.sketches[name].boxplot_stats())
     plt.xticks(range(1, num_rows + 1), range(num_rows))
     plt.xlabel("Human Agent ID")
     plt.ylabel(value)
-    plt.title(f"{value} by ID (n={NUM_TRIALS} trials)")
+    plt.title(f"{value} by ID (n={summary.count} trials)")
 
     plt.savefig(
-        f"data/{DATASET_DESC}/{MOTION_MODEL_DESC}/{GLOBAL_DESC}_{value}",
+        output_path(value),
         dpi=300,
         bbox_inches="tight",
     )
+    plt.close()
 
 
-if __name__ == "__main__":
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="ZV-Sim: probabilistic simulation of pre-emergent zoonoses"
+    )
+    parser.add_argument("--dataset", default=DATASET_DESC, choices=data.DATASETS)
+    parser.add_argument(
+        "--dataset-dir",
+        default=DATASET_DIR,
+        help="CSV dataset directory to run instead of --dataset, see loader.py",
+    )
+    parser.add_argument(
+        "--compact-keyframes",
+        action=argparse.BooleanOptionalAction,
+        default=COMPACT_KEYFRAMES,
+        help="keep keyframes as int32 ticks and float32 positions",
+    )
+    parser.add_argument(
+        "--motion-model",
+        default=user.HUMAN_MOTION_MODEL,
+        choices=["none", "random_walk", "noisy_interp", "interp"],
+        help="human motion model between location fixes",
+    )
+    parser.add_argument("--trials", type=int, default=NUM_TRIALS)
+    parser.add_argument(
+        "--output-dir",
+        default=OUTPUT_DIR,
+        help="results go to <output dir>/<dataset>/<motion model>/",
+    )
+    parser.add_argument(
+        "--engine",
+        default=SIM_ENGINE,
+        choices=["loop", "vectorized", "grid", "event", "partitioned"],
+    )
+    parser.add_argument(
+        "--tiles",
+        type=int,
+        nargs=2,
+        metavar=("COLUMNS", "ROWS"),
+        default=PARTITION_TILES,
+        help="tiles (one worker process each) for --engine partitioned",
+    )
+    parser.add_argument(
+        "--batch",
+        action=argparse.BooleanOptionalAction,
+        default=BATCH_TRIALS,
+        help="advance all trials together as arrays",
+    )
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--seed", type=int, default=MASTER_SEED, help="master seed")
+    parser.add_argument(
+        "--ci-width",
+        type=float,
+        default=CI_TARGET_WIDTH,
+        help="stop early once every confidence interval is narrower than this",
+    )
+    parser.add_argument("--min-trials", type=int, default=MIN_TRIALS)
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar="CONFIG",
+        default=COMPARE_CONFIGS,
+        help="compare user.py configurations (NAME=VALUE,...) with common random "
+        "numbers, e.g. HUMAN_MOTION_MODEL=noisy_interp HUMAN_MOTION_MODEL=random_walk",
+    )
+    parser.add_argument(
+        "--antithetic", action=argparse.BooleanOptionalAction, default=ANTITHETIC
+    )
+    parser.add_argument(
+        "--sweep",
+        nargs="+",
+        metavar="NAME=VALUES",
+        default=SWEEPS,
+        help="evaluate every combination of infection and P(zoonotic) model "
+        "parameter values (NAME=VALUE,VALUE,...) on the same trials, e.g. "
+        "HAZARD_DECAY=0.95,0.99 HUMAN_HAZARD_SICK=0.5,0.7",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="RUN",
+        help="finish an interrupted run, given its id and the same --dataset, "
+        "--motion-model and --output-dir",
+    )
+    parser.add_argument(
+        "--profile",
+        action=argparse.BooleanOptionalAction,
+        default=PROFILE,
+        help="time the phases of every update, see profiling.py",
+    )
+    parser.add_argument(
+        "--record",
+        nargs="*",
+        type=int,
+        metavar="TRIAL",
+        help="record the given trials, or every trial, for display.py to replay",
+    )
+    parser.add_argument(
+        "--display", action=argparse.BooleanOptionalAction, default=USE_DISPLAY
+    )
+    parser.add_argument(
+        "--save", action=argparse.BooleanOptionalAction, default=SAVE_DATA
+    )
+    parser.add_argument(
+        "--plot",
+        action=argparse.BooleanOptionalAction,
+        default=PLOT_DATA,
+        help="save a boxplot of every result, drawn from its quantile sketch",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global USE_DISPLAY, SAVE_DATA, PLOT_DATA, OUTPUT_DIR, NUM_TRIALS
+    global BATCH_TRIALS, NUM_WORKERS, MASTER_SEED, GLOBAL_DESC, CI_TARGET_WIDTH
+    global MIN_TRIALS, COMPARE_CONFIGS, ANTITHETIC, PROFILE, RECORD_TRIALS, SWEEPS
+    global PARTITION_TILES
+
+    args = parse_args(argv)
+    if args.resume is not None and not args.save:
+        raise ValueError(
+            "--resume finishes a saved run, it cannot be used with --no-save"
+        )
+    apply_settings(
+        {
+            "DATASET_DESC": (
+                args.dataset
+                if args.dataset_dir is None
+                else os.path.basename(os.path.normpath(args.dataset_dir))
+            ),
+            "DATASET_DIR": args.dataset_dir,
+            "MOTION_MODEL_DESC": f"h_{args.motion_model}",
+            "SIM_ENGINE": args.engine,
+            "HUMAN_MOTION_MODEL": args.motion_model,
+            "COMPACT_KEYFRAMES": args.compact_keyframes,
+        }
+    )
+    USE_DISPLAY = args.display
+    SAVE_DATA = args.save
+    PLOT_DATA = args.plot
+    OUTPUT_DIR = args.output_dir
+    NUM_TRIALS = args.trials
+    BATCH_TRIALS = args.batch
+    NUM_WORKERS = args.workers
+    MASTER_SEED = args.seed
+    CI_TARGET_WIDTH = args.ci_width
+    MIN_TRIALS = args.min_trials
+    COMPARE_CONFIGS = args.compare
+    ANTITHETIC = args.antithetic
+    SWEEPS = args.sweep
+    PARTITION_TILES = tuple(args.tiles)
+    PROFILE = args.profile
+    if args.record is not None:
+        RECORD_TRIALS = args.record or "all"
+
     print("**ZV-Sim**")
     print(f"1 sim second = {REAL_SECONDS_PER_SIM_SECOND} real world seconds")
 
-    all_results = []
-    for _ in tqdm.tqdm(range(NUM_TRIALS)):
-        res = trial()
-        all_results.append(res)
-        time.sleep(0.001)
+    _, humans = load_dataset()
+    num_humans = max(h.id for h in humans) + 1
+
+    if args.resume is not None:
+        GLOBAL_DESC = args.resume
+        saved = ResultsWriter.saved_settings(results_dir(), GLOBAL_DESC)
+        master_seed = saved["master_seed"]
+        NUM_TRIALS = saved["num_trials"]
+        BATCH_TRIALS = saved["batch"]
+        apply_settings({k: saved[k] for k in current_settings() if k in saved})
+    else:
+        master_seed = (
+            MASTER_SEED if MASTER_SEED is not None else np.random.SeedSequence().entropy
+        )
+    print(f"Run: {GLOBAL_DESC}")
+    print(f"Master seed: {master_seed}")
+
+    if COMPARE_CONFIGS:
+        run_comparison_trials(master_seed)
+        return
+    if SWEEPS:
+        run_sweep(master_seed)
+        return
+
+    writer = ResultsWriter(
+        results_dir() if SAVE_DATA else None,
+        GLOBAL_DESC,
+        num_humans=num_humans,
+        num_trials=NUM_TRIALS,
+        settings={
+            "master_seed": master_seed,
+            "batch": BATCH_TRIALS,
+            **current_settings(),
+        },
+        resume=args.resume is not None,
+        # batched trials share one stream of the master seed
+        seeds=None if BATCH_TRIALS else trial_seeds(master_seed, NUM_TRIALS),
+    )
+
+    summary = ResultsSummary(RESULT_VALUES, num_humans, SKETCH_CAPACITY)
+    summary.add(writer.completed_matrices())
 
-    num_humans = len(all_results[0])
+    if PROFILE and BATCH_TRIALS:
+        print("Batched trials are not profiled, run them one by one to profile them")
+        PROFILE = False
+    if PROFILE:
+        profiling.enable()
 
-    secondary_cases = np.empty((num_humans, NUM_TRIALS))
-    animal_hazard = np.empty((num_humans, NUM_TRIALS))
-    human_hazard = np.empty((num_humans, NUM_TRIALS))
-    p_zoonotic = np.empty((num_humans, NUM_TRIALS))
+    if RECORD_TRIALS is not None and BATCH_TRIALS:
+        print("Batched trials are not recorded, run them one by one to record them")
+    if BATCH_TRIALS:
+        run_batched_trials(master_seed, writer, summary)
+    else:
+        run_trials(master_seed, writer, summary)
 
-    for trial_num, run in enumerate(all_results):
-        for id, human_res in run.items():
-            secondary_cases[id][trial_num] = human_res.sickness_secondary_cases
-            animal_hazard[id][trial_num] = human_res.sickness_animal_hazard
-            human_hazard[id][trial_num] = human_res.sickness_human_hazard
-            p_zoonotic[id][trial_num] = human_res.sickness_p_zoonotic
+    if summary.count < NUM_TRIALS:
+        print(f"Confidence intervals converged after {summary.count} trials")
 
     if SAVE_DATA:
-        save_data(secondary_cases, "Secondary Cases")
-        save_data(animal_hazard, "Animal Hazard @ Sickness")
-        save_data(human_hazard, "Human Hazard @ Sickness")
-        save_data(p_zoonotic, "P(Sickness from Zoonotic Origin)")
+        summary.save(f"{output_path('Summary')}.npz", CI_LEVEL)
+    if PROFILE:
+        print(profiling.PROFILER.summary_table())
+        if SAVE_DATA:
+            profiling.PROFILER.save(output_path("Profile"))
+    if PLOT_DATA:
+        for name, label in RESULT_VALUES.items():
+            plot_data(summary, name, label)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List
+import io
+import pickle
+
+from agents import AnimalPresence, Human
+
+# The state of a simulation (any engine) at a tick, its agents' random streams
+# (streams.py) included, pickled. The dataset every trial shares (keyframes, reports,
+# trajectories) is not copied but referenced by agent and attribute, so a
+# snapshot only costs as much as the state trials change, and is restored
+# against the same dataset, in this process or after loading it again.
+SHARED_ATTRIBUTES = {
+    Human: ["location_history", "self_reports", "trajectory"],
+    AnimalPresence: ["migration_pattern", "trajectory"],
+}
+
+
+# key -> dataset object referenced by the simulation's agents; humans are keyed
+# by id, animals by their place in the simulation
+def shared_objects(humans: List[Human], animals: List[AnimalPresence]):
+    shared = {}
+    for kind, agents in [("H", [(h.id, h) for h in humans]), ("A", enumerate(animals))]:
+        for n, agent in agents:
+            for name in SHARED_ATTRIBUTES[type(agent)]:
+                shared[(kind, n, name)] = getattr(agent, name)
+            # motion compiled from the trajectory, see events.py
+            for interpolate, pieces in agent.trajectory._pieces.items():
+                shared[(kind, n, "pieces", interpolate)] = pieces
+    return shared
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, shared: Dict[Hashable, object]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.keys = {id(obj): key for key, obj in shared.items()}
+
+    def persistent_id(self, obj):
+        return self.keys.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, humans: Dict[int, Human], animals: List[AnimalPresence]):
+        super().__init__(file)
+        self.agents = {"H": humans, "A": animals}
+
+    def persistent_load(self, key):
+        kind, n, name, *args = key
+        agent = self.agents[kind][n]
+        if name == "pieces":
+            return agent.trajectory.pieces(*args)
+        return getattr(agent, name)
+
+
+# obj pickled, referencing the dataset of the given agents rather than copying it
+def dump_shared(obj, humans: List[Human], animals: List[AnimalPresence]) -> bytes:
+    buffer = io.BytesIO()
+    _Pickler(buffer, shared_objects(humans, animals)).dump(obj)
+    return buffer.getvalue()
+
+
+# the object dump_shared pickled, with the same dataset objects the given agents
+# (which may be other copies of those agents) reference
+def load_shared(state: bytes, humans: Dict[int, Human], animals: List[AnimalPresence]):
+    return _Unpickler(io.BytesIO(state), humans, animals).load()
+
+
+@dataclass
+class Snapshot:
+    time_step: int
+    state: bytes
+    # agents whose dataset the state refers to
+    humans: Dict[int, Human] = field(repr=False)
+    animals: List[AnimalPresence] = field(repr=False)
+
+    # the simulation as it was, with its random streams where they were, so it
+    # continues exactly as the original did
+    def restore(self):
+        return load_shared(self.state, self.humans, self.animals)
+
+    # the simulation as it was, continuing with the random streams of another
+    # seed; forks with different seeds are independent continuations of the
+    # common prefix
+    def fork(self, seed):
+        sim = self.restore()
+        sim.reseed(seed)
+        return sim
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump((self.time_step, self.state), f, pickle.HIGHEST_PROTOCOL)
+
+    # a saved snapshot, restored against the dataset's agents (e.g.
+    # simulator.load_dataset()), in the order the simulation added them
+    @classmethod
+    def load(cls, path: str, humans: List[Human], animals: List[AnimalPresence]):
+        with open(path, "rb") as f:
+            time_step, state = pickle.load(f)
+        return cls(time_step, state, {h.id: h for h in humans}, list(animals))
+
+
+def take_snapshot(sim) -> Snapshot:
+    state = dump_shared(sim, list(sim.human_agents.values()), sim.animal_agents)
+    return Snapshot(
+        sim.time_step,
+        state,
+        dict(sim.human_agents),
+        list(sim.animal_agents),
+    )
@@ -0,0 +1,110 @@
+from collections import defaultdict
+from typing import Dict, Hashable, Iterator, Set, Tuple
+import math
+
+Cell = Tuple[int, int]
+
+# only half of the 3x3 neighbourhood is visited so each pair of cells is seen once
+FORWARD_NEIGHBOURS = [(1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+# Uniform grid of point agents. With cell_size equal to the query distance,
+# any two points within that distance are in the same or adjacent cells.
+class SpatialHashGrid:
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.cells: Dict[Cell, Set[Hashable]] = defaultdict(set)
+        self.agent_cells: Dict[Hashable, Cell] = {}
+
+    def cell_of(self, x: float, y: float) -> Cell:
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    # inserts the agent, or moves it if its cell changed since the last call
+    def update(self, key: Hashable, x: float, y: float):
+        cell = self.cell_of(x, y)
+        old_cell = self.agent_cells.get(key)
+        if old_cell == cell:
+            return
+
+        if old_cell is not None:
+            self._discard(key, old_cell)
+        self.cells[cell].add(key)
+        self.agent_cells[key] = cell
+
+    def remove(self, key: Hashable):
+        self._discard(key, self.agent_cells.pop(key))
+
+    def _discard(self, key, cell):
+        members = self.cells[cell]
+        members.discard(key)
+        if not members:
+            del self.cells[cell]
+
+    # every unordered pair of agents in the same or adjacent cells, exactly once,
+    # as (a, b) with a < b
+    def candidate_pairs(self) -> Iterator[Tuple[Hashable, Hashable]]:
+        for (cx, cy), members in self.cells.items():
+            ordered = sorted(members)
+            for n, a in enumerate(ordered):
+                for b in ordered[n + 1 :]:
+                    yield a, b
+
+            for dx, dy in FORWARD_NEIGHBOURS:
+                neighbours = self.cells.get((cx + dx, cy + dy))
+                if not neighbours:
+                    continue
+                for a in members:
+                    for b in neighbours:
+                        yield (a, b) if a < b else (b, a)
+
+
+# Grid of circular areas with varying radii, e.g. AnimalPresence. Each area is
+# listed in every cell its bounding box overlaps, so a point query only has to
+# look at the areas registered in the point's own cell.
+class RadiusIndex:
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.cells: Dict[Cell, Set[Hashable]] = defaultdict(set)
+        self.areas: Dict[Hashable, Tuple[int, int, int, int]] = {}
+
+    def _cell_range(self, x, y, radius):
+        return (
+            math.floor((x - radius) / self.cell_size),
+            math.floor((y - radius) / self.cell_size),
+            math.floor((x + radius) / self.cell_size),
+            math.floor((y + radius) / self.cell_size),
+        )
+
+    @staticmethod
+    def _cells_in(cell_range):
+        x0, y0, x1, y1 = cell_range
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                yield cx, cy
+
+    # inserts the area, or re-registers it if it moved or changed radius enough
+    # to cover a different set of cells
+    def update(self, key: Hashable, x: float, y: float, radius: float):
+        cell_range = self._cell_range(x, y, radius)
+        old_range = self.areas.get(key)
+        if old_range == cell_range:
+            return
+
+        if old_range is not None:
+            self.remove(key)
+        for cell in self._cells_in(cell_range):
+            self.cells[cell].add(key)
+        self.areas[key] = cell_range
+
+    def remove(self, key: Hashable):
+        for cell in self._cells_in(self.areas.pop(key)):
+            members = self.cells[cell]
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+
+    # areas whose bounding box covers the point's cell; callers still check distance
+    def candidates(self, x: float, y: float) -> Set[Hashable]:
+        return self.cells.get(
+            (math.floor(x / self.cell_size), math.floor(y / self.cell_size)), set()
+        )
@@ -0,0 +1,171 @@
+from statistics import NormalDist
+from typing import Dict, List
+import numpy as np
+
+# quantiles of every result saved by ResultsSummary.save
+SUMMARY_QUANTILES = [0.0, 0.05, 0.25, 0.5, 0.75, 0.95, 1.0]
+
+
+# Mean and variance of every row of a stream of (rows x n) blocks, merging each
+# block in with Welford's / Chan et al.'s update
+class RunningStats:
+    def __init__(self, num_rows: int):
+        self.count = 0
+        self.mean = np.zeros(num_rows)
+        self.m2 = np.zeros(num_rows)
+
+    def add(self, values: np.ndarray):
+        n = values.shape[1]
+        if n == 0:
+            return
+
+        block_mean = values.mean(axis=1)
+        block_m2 = ((values - block_mean[:, None]) ** 2).sum(axis=1)
+        delta = block_mean - self.mean
+        total = self.count + n
+
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + block_m2 + delta**2 * (self.count * n / total)
+        self.count = total
+
+    def variance(self) -> np.ndarray:
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self.m2 / (self.count - 1)
+
+    # width of the normal confidence interval of each row's mean
+    def ci_width(self, level: float) -> np.ndarray:
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        return 2 * z * np.sqrt(self.variance() / max(self.count, 1))
+
+
+# Streaming quantile sketch of every row of a stream of (rows x n) blocks, in a
+# fixed amount of memory: a KLL-style stack of sorted compactors. Level l holds
+# items standing for 2**l values each, and whenever a level reaches capacity
+# every other item of it (from a random start) moves up a level. Every row
+# receives one value per trial, so all rows share the same level sizes.
+class QuantileSketch:
+    def __init__(self, num_rows: int, capacity: int = 256, seed=0):
+        self.num_rows = num_rows
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.levels: List[np.ndarray] = [np.empty((num_rows, 0))]
+        self.min = np.full(num_rows, np.inf)
+        self.max = np.full(num_rows, -np.inf)
+
+    def add(self, values: np.ndarray):
+        if values.shape[1] == 0:
+            return
+
+        self.min = np.minimum(self.min, values.min(axis=1))
+        self.max = np.maximum(self.max, values.max(axis=1))
+        self.levels[0] = np.concatenate([self.levels[0], values], axis=1)
+
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            level += 1
+            if items.shape[1] < self.capacity:
+                continue
+
+            items = np.sort(items, axis=1)
+            paired = items.shape[1] // 2 * 2
+            promoted = items[:, self.rng.integers(2) : paired : 2]
+            self.levels[level - 1] = items[:, paired:]
+
+            if level == len(self.levels):
+                self.levels.append(np.empty((self.num_rows, 0)))
+            self.levels[level] = np.concatenate([self.levels[level], promoted], axis=1)
+
+    # every row's retained items, sorted, with the number of values each stands for
+    def items(self):
+        values = np.concatenate(self.levels, axis=1)
+        weights = np.concatenate(
+            [
+                np.full(items.shape[1], 2.0**level)
+                for level, items in enumerate(self.levels)
+            ]
+        )
+        order = np.argsort(values, axis=1)
+        return np.take_along_axis(values, order, axis=1), weights[order]
+
+    # (rows x len(qs)) estimated quantiles; 0 and 1 give the exact min / max
+    def quantiles(self, qs) -> np.ndarray:
+        values, weights = self.items()
+        if values.shape[1] == 0:
+            return np.full((self.num_rows, len(qs)), np.nan)
+
+        cumulative = np.cumsum(weights, axis=1)
+        total = cumulative[:, -1:]
+        result = np.empty((self.num_rows, len(qs)))
+        for n, q in enumerate(qs):
+            index = np.minimum(
+                (cumulative < q * total).sum(axis=1), values.shape[1] - 1
+            )
+            result[:, n] = values[np.arange(self.num_rows), index]
+        result[:, np.asarray(qs) == 0] = self.min[:, None]
+        result[:, np.asarray(qs) == 1] = self.max[:, None]
+        return result
+
+    # matplotlib.axes.Axes.bxp statistics of every row, with whiskers at the
+    # furthest values within 1.5 IQR of the box as in Axes.boxplot, and the
+    # retained items beyond them as fliers
+    def boxplot_stats(self) -> List[Dict]:
+        values, _ = self.items()
+        q1, med, q3 = self.quantiles([0.25, 0.5, 0.75]).T
+
+        stats = []
+        for row in range(self.num_rows):
+            row_values = np.concatenate([values[row], [self.min[row], self.max[row]]])
+            iqr = q3[row] - q1[row]
+            inside = (row_values >= q1[row] - 1.5 * iqr) & (
+                row_values <= q3[row] + 1.5 * iqr
+            )
+            stats.append(
+                {
+                    "med": med[row],
+                    "q1": q1[row],
+                    "q3": q3[row],
+                    "whislo": row_values[inside].min(),
+                    "whishi": row_values[inside].max(),
+                    "fliers": np.unique(row_values[~inside]),
+                }
+            )
+        return stats
+
+
+# Running statistics and quantile sketches of every result matrix of a run,
+# fed one block of trials at a time
+class ResultsSummary:
+    def __init__(self, names, num_humans: int, sketch_capacity: int = 256):
+        self.stats = {name: RunningStats(num_humans) for name in names}
+        self.sketches = {
+            name: QuantileSketch(num_humans, sketch_capacity) for name in names
+        }
+
+    @property
+    def count(self) -> int:
+        return next(iter(self.stats.values())).count
+
+    def add(self, matrices: Dict[str, np.ndarray]):
+        for name, values in matrices.items():
+            self.stats[name].add(values)
+            self.sketches[name].add(values)
+
+    # whether every human's mean of every result is known to within target_width
+    def converged(self, target_width: float, level: float) -> bool:
+        return self.count >= 2 and all(
+            (stats.ci_width(level) < target_width).all()
+            for stats in self.stats.values()
+        )
+
+    def save(self, path: str, level: float):
+        arrays = {}
+        for name, stats in self.stats.items():
+            arrays[f"{name}_mean"] = stats.mean
+            arrays[f"{name}_std"] = np.sqrt(stats.variance())
+            arrays[f"{name}_ci_width"] = stats.ci_width(level)
+            arrays[f"{name}_quantiles"] = self.sketches[name].quantiles(
+                SUMMARY_QUANTILES
+            )
+        np.savez(path, count=self.count, quantiles=SUMMARY_QUANTILES, **arrays)
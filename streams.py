@@ -0,0 +1,76 @@
+import math
+import numpy as np
+
+# Random numbers of a trial, from numpy Generators. Every (purpose, agent) pair
+# has its own stream, derived from the trial's seed and the pair alone
+# (SeedSequence spawn keys), so what an agent draws does not depend on which
+# other agents there are, the order they are updated in or the engine, and a
+# trial is regenerated exactly from its seed. Streams draw BLOCK_SIZE uniforms
+# at a time and hand them out one by one; a stream's Generator is only created
+# on its first draw, so deterministic models cost nothing.
+HUMAN_MOTION = 0
+ANIMAL_MOTION = 1
+INFECTION = 2
+BLOCK_SIZE = 256
+
+
+class RandomStream:
+    def __init__(
+        self, seed_sequence: np.random.SeedSequence, block_size: int = BLOCK_SIZE
+    ):
+        self.seed_sequence = seed_sequence
+        self.block_size = block_size
+        self._generator = None
+        self._block_state = None  # Generator state the block was drawn from
+        self._block = []
+        self._position = 0
+
+    def _refill(self):
+        if self._generator is None:
+            self._generator = np.random.default_rng(self.seed_sequence)
+        self._block_state = self._generator.bit_generator.state
+        self._block = self._generator.random(self.block_size).tolist()
+        self._position = 0
+
+    # uniform in [0, 1)
+    def random(self) -> float:
+        try:
+            u = self._block[self._position]
+        except IndexError:
+            self._refill()
+            u = self._block[0]
+        self._position += 1
+        return u
+
+    # uniform integer in [low, high], as random.randint; u * n stays below n
+    # for every u < 1 once rounded
+    def integers(self, low: int, high: int) -> int:
+        return low + int(self.random() * (high - low + 1))
+
+    # exponentially distributed with mean 1
+    def exponential(self) -> float:
+        return -math.log(1.0 - self.random())
+
+    # pickled as the state the block was drawn from and how far into it the
+    # stream is, not as the block itself
+    def __getstate__(self):
+        return self.seed_sequence, self.block_size, self._block_state, self._position
+
+    def __setstate__(self, state):
+        seed_sequence, block_size, block_state, position = state
+        self.__init__(seed_sequence, block_size)
+        if block_state is not None:
+            self._generator = np.random.default_rng(seed_sequence)
+            self._generator.bit_generator.state = block_state
+            self._refill()
+            self._position = position
+
+
+# The streams of one trial; without a seed a fresh one is picked, and kept in
+# seed so the trial can be run again
+class TrialStreams:
+    def __init__(self, seed=None):
+        self.seed: int = np.random.SeedSequence().entropy if seed is None else seed
+
+    def stream(self, purpose: int, id: int) -> RandomStream:
+        return RandomStream(np.random.SeedSequence(self.seed, spawn_key=(purpose, id)))
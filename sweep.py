@@ -0,0 +1,306 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, fields
+from itertools import chain
+from typing import Callable, Dict, List
+import ast
+import hashlib
+import numpy as np
+import tqdm
+
+from agents import (
+    CONTACT_NETWORK_PROXIMITY_THRESHOLD,
+    INCUBATION_SIM_TIME,
+    AnimalPresence,
+    Human,
+    HumanStatus,
+)
+from results import RESULT_VALUES
+import probability
+import user
+
+# Parameter sweeps over the infection and P(zoonotic) models. Without
+# SIMULATE_SPREAD, where everyone is and who is sick on every tick does not
+# depend on these parameters, so each trial is simulated once to get its
+# exposure timelines (ExposureTimelines), and every combination of parameters
+# is then evaluated from those as whole-array passes.
+SWEEP_PARAMETERS = {
+    "HAZARD_DECAY": user,
+    "HUMAN_HAZARD_SICK": user,
+    "HUMAN_HAZARD_HEALTHY": user,
+    "PRIOR_PROBABILITY_ZOONOTIC": probability,
+    "EXPECTED_SECONDARY_CASES_ZOONOTIC": probability,
+    "EXPECTED_SECONDARY_CASES_NON_ZOONOTIC": probability,
+}
+NO_ONSET = -1
+
+
+# "NAME=VALUE,VALUE,..." -> (name, values), e.g. "HAZARD_DECAY=0.95,0.99"
+def parse_sweep(text: str):
+    name, _, values = text.partition("=")
+    name = name.strip()
+    if name not in SWEEP_PARAMETERS:
+        raise ValueError(f"{name} cannot be swept, only {', '.join(SWEEP_PARAMETERS)}")
+    return name, [float(ast.literal_eval(v.strip())) for v in values.split(",")]
+
+
+# every parameter's values: the swept ones', and the current value of the rest
+def sweep_grid(sweeps: Dict[str, List[float]]) -> Dict[str, np.ndarray]:
+    return {
+        name: np.array(sweeps.get(name, [getattr(module, name)]), dtype=float)
+        for name, module in SWEEP_PARAMETERS.items()
+    }
+
+
+# What the hazard and P(zoonotic) models see of (trials x ticks x humans) of
+# simulation, and each human's last sickness record, as of the end of a trial.
+# Humans are indexed by id, as in the results of a run.
+@dataclass
+class ExposureTimelines:
+    # summed output hazard of the animals within reach
+    animal_exposure: np.ndarray
+    # contacts whose output hazard was set while sick / healthy (before their
+    # first update it is 0.0 either way)
+    sick_contacts: np.ndarray
+    healthy_contacts: np.ndarray
+    # (trials x humans) start tick of the last sickness record, or NO_ONSET
+    onset: np.ndarray
+    last_secondary_cases: np.ndarray
+    secondary_cases: np.ndarray  # over every record
+
+    def save(self, path: str):
+        np.savez(path, **asdict(self))
+
+    @classmethod
+    def load(cls, path: str) -> "ExposureTimelines":
+        with np.load(path) as arrays:
+            return cls(**{field.name: arrays[field.name] for field in fields(cls)})
+
+    @classmethod
+    def stack(cls, trials: List["ExposureTimelines"]) -> "ExposureTimelines":
+        return cls(
+            **{
+                field.name: np.stack([getattr(t, field.name) for t in trials])
+                for field in fields(cls)
+            }
+        )
+
+
+# Digest of everything a dataset's timelines depend on besides the seeds and
+# number of ticks: its agents' keyframes, reports, radii and hazard rates, and
+# the settings not swept, to tell cached timelines apart
+def timelines_digest(animals: List[AnimalPresence], humans: List[Human]) -> str:
+    digest = hashlib.sha256()
+    settings = (
+        user.HUMAN_MOTION_MODEL,
+        user.SIMULATE_SPREAD,
+        CONTACT_NETWORK_PROXIMITY_THRESHOLD,
+        INCUBATION_SIM_TIME,
+    )
+    digest.update(repr(settings).encode())
+    for agent in chain(animals, humans):
+        if isinstance(agent, Human):
+            reports = sorted((t, s.value) for t, s in agent.self_reports.items())
+            digest.update(repr(("H", agent.id, reports)).encode())
+        else:
+            digest.update(
+                repr(("A", agent.id, agent.start_radius, agent.hazard_rate)).encode()
+            )
+        trajectory = agent.trajectory
+        for array in (trajectory.times, trajectory.xs, trajectory.ys):
+            array = np.ascontiguousarray(array)
+            digest.update(array.dtype.str.encode())
+            digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+# one trial's timelines, from the per-agent engine (simulator.Simulation; trial()
+# with the same seed simulates the same trial), by watching every call of the
+# infection model
+def exposure_timelines(
+    simulation: type, load_dataset: Callable, num_ticks: int, seed
+) -> ExposureTimelines:
+    if user.SIMULATE_SPREAD:
+        raise ValueError("Sweeps need SIMULATE_SPREAD = False")
+
+    sim = simulation(seed)
+    dataset_animals, dataset_humans = load_dataset()
+    for agent in chain(dataset_animals, dataset_humans):
+        sim.add_agent(agent.trial_copy())
+
+    num_humans = max(sim.human_agents) + 1
+    animal_exposure = np.zeros((num_ticks, num_humans))
+    sick_contacts = np.zeros((num_ticks, num_humans), dtype=np.int32)
+    healthy_contacts = np.zeros((num_ticks, num_humans), dtype=np.int32)
+    output_status: Dict[int, HumanStatus] = {}  # status output hazards follow
+
+    model = user.infection_probability_model
+
+    def watched(human, animal_contacts, human_contacts):
+        i, t = human.id, sim.time_step
+        for animal in animal_contacts:
+            animal_exposure[t, i] += animal.infection_model.output_hazard
+        for other in human_contacts:
+            match output_status.get(other.id):
+                case HumanStatus.SICK:
+                    sick_contacts[t, i] += 1
+                case HumanStatus.HEALTHY:
+                    healthy_contacts[t, i] += 1
+        output_status[human.id] = human.status
+        return model(human, animal_contacts, human_contacts)
+
+    user.infection_probability_model = watched
+    try:
+        sim.run_until(num_ticks)
+    finally:
+        user.infection_probability_model = model
+
+    onset = np.full(num_humans, NO_ONSET)
+    last_secondary_cases = np.zeros(num_humans, dtype=np.int64)
+    secondary_cases = np.zeros(num_humans, dtype=np.int64)
+    for h in sim.human_agents.values():
+        if h.sickness_records:
+            onset[h.id] = h.sickness_records[-1].start_time
+            last_secondary_cases[h.id] = h.sickness_records[-1].secondary_cases
+            secondary_cases[h.id] = sum(s.secondary_cases for s in h.sickness_records)
+
+    return ExposureTimelines(
+        animal_exposure,
+        sick_contacts,
+        healthy_contacts,
+        onset,
+        last_secondary_cases,
+        secondary_cases,
+    )
+
+
+# every trial's timelines, serially or over worker processes set up by
+# initializer(*initargs)
+def run_exposure_timelines(
+    simulation: type,
+    load_dataset: Callable,
+    num_ticks: int,
+    seeds: List[int],
+    num_workers: int = 1,
+    chunk_size: int = 1,
+    initializer: Callable = None,
+    initargs=(),
+) -> ExposureTimelines:
+    if num_workers <= 1:
+        trials = [
+            exposure_timelines(simulation, load_dataset, num_ticks, seed)
+            for seed in tqdm.tqdm(seeds)
+        ]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=num_workers, initializer=initializer, initargs=initargs
+        ) as executor:
+            trials = list(
+                tqdm.tqdm(
+                    executor.map(
+                        exposure_timelines,
+                        [simulation] * len(seeds),
+                        [load_dataset] * len(seeds),
+                        [num_ticks] * len(seeds),
+                        seeds,
+                        chunksize=chunk_size,
+                    ),
+                    total=len(seeds),
+                )
+            )
+    return ExposureTimelines.stack(trials)
+
+
+# sum over ticks up to each onset of decay^(onset - tick) * exposure, for every
+# decay: (decays) x (trials x ticks x humans) -> (decays x trials x humans)
+def decayed_at_onset(decays: np.ndarray, exposure: np.ndarray, onset: np.ndarray):
+    num_trials, num_ticks, num_humans = exposure.shape
+    decay = decays[:, None, None]
+    hazard = np.zeros((len(decays), num_trials, num_humans))
+    at_onset = np.zeros_like(hazard)
+    for t in range(num_ticks):
+        hazard *= decay
+        hazard += exposure[:, t]
+        np.copyto(at_onset, hazard, where=onset == t)
+    return at_onset
+
+
+# Every result for every combination of parameters: one array per result, with
+# an axis per parameter in SWEEP_PARAMETERS order (of length 1 where the result
+# does not depend on it, so the arrays broadcast together) followed by
+# (humans x trials), as the results of a run
+def evaluate_sweep(
+    timelines: ExposureTimelines, grid: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    names = list(SWEEP_PARAMETERS)
+
+    # (parameters x trials x humans), with axes for the given parameters in
+    # SWEEP_PARAMETERS order -> (every parameter x humans x trials)
+    def cube(values: np.ndarray, *parameters) -> np.ndarray:
+        values = np.moveaxis(values, -2, -1)
+        shape = [len(grid[name]) if name in parameters else 1 for name in names]
+        return values.reshape(shape + list(values.shape[-2:]))
+
+    decays = grid["HAZARD_DECAY"]
+    onset = timelines.onset
+    sick = decayed_at_onset(decays, timelines.sick_contacts, onset)
+    healthy = decayed_at_onset(decays, timelines.healthy_contacts, onset)
+    animal_hazard = decayed_at_onset(decays, timelines.animal_exposure, onset)
+
+    # (decay x sick x healthy x trials x humans)
+    human_hazard = (
+        grid["HUMAN_HAZARD_SICK"][None, :, None, None, None] * sick[:, None, None]
+        + grid["HUMAN_HAZARD_HEALTHY"][None, None, :, None, None]
+        * healthy[:, None, None]
+    )
+
+    # (decay x prior x zoonotic mu x non-zoonotic mu x trials x humans)
+    k = timelines.last_secondary_cases
+    f_E = (1 - np.exp(-animal_hazard))[:, None, None, None]
+    g_k = np.stack(
+        [
+            probability.poisson_pmf(k, mu)
+            for mu in grid["EXPECTED_SECONDARY_CASES_ZOONOTIC"]
+        ]
+    )[None, None, :, None]
+    h_k = np.stack(
+        [
+            probability.poisson_pmf(k, mu)
+            for mu in grid["EXPECTED_SECONDARY_CASES_NON_ZOONOTIC"]
+        ]
+    )[None, None, None, :]
+    prior = grid["PRIOR_PROBABILITY_ZOONOTIC"][None, :, None, None, None, None]
+    p_zoonotic = probability.zoonotic_posterior(f_E, g_k, h_k, prior)
+    # humans never sick have no results
+    sick_humans = onset != NO_ONSET
+
+    return {
+        "secondary_cases": cube(timelines.secondary_cases.astype(float)),
+        "animal_hazard": cube(animal_hazard, "HAZARD_DECAY"),
+        "human_hazard": cube(
+            human_hazard, "HAZARD_DECAY", "HUMAN_HAZARD_SICK", "HUMAN_HAZARD_HEALTHY"
+        ),
+        "p_zoonotic": cube(
+            np.where(sick_humans, p_zoonotic, 0.0),
+            "HAZARD_DECAY",
+            "PRIOR_PROBABILITY_ZOONOTIC",
+            "EXPECTED_SECONDARY_CASES_ZOONOTIC",
+            "EXPECTED_SECONDARY_CASES_NON_ZOONOTIC",
+        ),
+    }
+
+
+# the result cubes, with the parameter values along their axes as
+# "axis_<NAME>" arrays
+def save_sweep(path: str, grid: Dict[str, np.ndarray], cubes: Dict[str, np.ndarray]):
+    np.savez(path, **{f"axis_{name}": values for name, values in grid.items()}, **cubes)
+
+
+def print_sweep(grid: Dict[str, np.ndarray], cubes: Dict[str, np.ndarray]):
+    swept = {name: values for name, values in grid.items() if len(values) > 1}
+    print(
+        f"{np.prod([len(v) for v in grid.values()])} parameter combinations: "
+        + ", ".join(f"{name} {values.tolist()}" for name, values in swept.items())
+    )
+    for name, label in RESULT_VALUES.items():
+        means = cubes[name].mean(axis=-1)
+        print(f"{label}: mean over trials from {means.min():.4g} to {means.max():.4g}")
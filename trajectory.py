@@ -0,0 +1,199 @@
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, List
+import numpy as np
+
+
+@dataclass
+class TrajectorySchedule:
+    # per-tick arrays, computed once per trajectory and shared by every trial
+    keyframe: np.ndarray  # tick has location data (no motion model call)
+    snap: np.ndarray  # tick moves the agent onto its keyframe
+    moving: np.ndarray  # tick is left to the motion model with a keyframe ahead
+    next_t: np.ndarray
+    next_x: np.ndarray
+    next_y: np.ndarray
+    # latest keyframe at or before each tick (the first one before it starts)
+    held_x: np.ndarray
+    held_y: np.ndarray
+    # noise-free path of the noisy interpolation model, and the fraction of
+    # a trial's deviation from it that carries over into each tick
+    baseline_x: np.ndarray
+    baseline_y: np.ndarray
+    carry: np.ndarray
+
+
+@dataclass
+class TrajectoryPieces:
+    # deterministic motion as linear pieces: from tick start[n] until
+    # start[n + 1] the agent is at (x[n], y[n]) + (vx[n], vy[n]) * (t - start[n])
+    start: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    vx: np.ndarray
+    vy: np.ndarray
+
+    def positions(self, ticks: np.ndarray):
+        n = np.searchsorted(self.start, ticks, side="right") - 1
+        elapsed = ticks - self.start[n]
+        return self.x[n] + self.vx[n] * elapsed, self.y[n] + self.vy[n] * elapsed
+
+
+# Keyframes of a location history compiled once into sorted time/x/y arrays
+class Trajectory:
+    def __init__(self, keyframes: Dict[int, "LocationRecord"]):
+        time_list = sorted(keyframes)
+        self._set_arrays(
+            np.array(time_list, dtype=np.int64),
+            np.array([keyframes[t].x for t in time_list], dtype=float),
+            np.array([keyframes[t].y for t in time_list], dtype=float),
+        )
+        self.time_list: List[int] = time_list
+
+    # From sorted, unique keyframe ticks and positions, e.g. columns of a
+    # memory-mapped dataset (see loader.py). The arrays are used as they are.
+    @classmethod
+    def from_arrays(cls, times: np.ndarray, xs: np.ndarray, ys: np.ndarray):
+        trajectory = cls.__new__(cls)
+        trajectory._set_arrays(times, xs, ys)
+        # bisect works on the array directly, without one int object per keyframe
+        trajectory.time_list = times
+        return trajectory
+
+    def _set_arrays(self, times, xs, ys):
+        self.times = times
+        self.xs = xs
+        self.ys = ys
+        self._schedules: Dict[int, TrajectorySchedule] = {}
+        self._pieces: Dict[bool, TrajectoryPieces] = {}
+
+    def __len__(self):
+        return len(self.time_list)
+
+    # Adds (or replaces) a keyframe of a trajectory built from keyframes that
+    # keep arriving (see online.py); anything compiled from it is recompiled
+    def add_keyframe(self, t: int, x: float, y: float):
+        if not isinstance(self.time_list, list):
+            # built from arrays (from_arrays), which may be a dataset's: the
+            # keyframes become this trajectory's own, keeping their types
+            self.time_list = self.times.tolist()
+            self.times = self.times.copy()
+            self.xs = self.xs.copy()
+            self.ys = self.ys.copy()
+
+        n = bisect_left(self.time_list, t)
+        if n < len(self.time_list) and self.time_list[n] == t:
+            self.xs[n] = x
+            self.ys[n] = y
+        else:
+            self.time_list.insert(n, t)
+            self.times = np.insert(self.times, n, t)
+            self.xs = np.insert(self.xs, n, x)
+            self.ys = np.insert(self.ys, n, y)
+        self._schedules.clear()
+        self._pieces.clear()
+
+    def start_time(self) -> int:
+        return int(self.time_list[0])
+
+    # first keyframe strictly after t, or None
+    def next_keyframe_time(self, t: int):
+        n = bisect_right(self.time_list, t)
+        return int(self.time_list[n]) if n < len(self.time_list) else None
+
+    def schedule(self, num_ticks: int) -> TrajectorySchedule:
+        if num_ticks not in self._schedules:
+            self._schedules[num_ticks] = self._compile_schedule(num_ticks)
+        return self._schedules[num_ticks]
+
+    def pieces(self, interpolate: bool) -> TrajectoryPieces:
+        if interpolate not in self._pieces:
+            self._pieces[interpolate] = self._compile_pieces(interpolate)
+        return self._pieces[interpolate]
+
+    # Follows Human.move without noise: the agent holds its first keyframe until
+    # then, and snaps to every later one. Without interpolation it holds each
+    # keyframe until the next; with it, it moves evenly from each keyframe to
+    # the next, reaching it one tick early, and holds it for that tick.
+    def _compile_pieces(self, interpolate: bool) -> TrajectoryPieces:
+        times = np.asarray(self.times, dtype=np.int64)
+        xs = np.asarray(self.xs, dtype=float)
+        ys = np.asarray(self.ys, dtype=float)
+        vx = np.zeros(len(times))
+        vy = np.zeros(len(times))
+        start, x, y = times, xs, ys
+
+        if interpolate and len(times) > 1:
+            steps = times[1:] - times[:-1] - 1
+            moving = steps > 0
+            vx[:-1] = np.where(moving, (xs[1:] - xs[:-1]) / np.maximum(steps, 1), 0.0)
+            vy[:-1] = np.where(moving, (ys[1:] - ys[:-1]) / np.maximum(steps, 1), 0.0)
+
+            # held for the tick before each keyframe reached by moving
+            held = np.flatnonzero(moving) + 1
+            order = np.argsort(np.concatenate([times, times[held] - 1]), kind="stable")
+            start = np.concatenate([times, times[held] - 1])[order]
+            x = np.concatenate([xs, xs[held]])[order]
+            y = np.concatenate([ys, ys[held]])[order]
+            vx = np.concatenate([vx, np.zeros(len(held))])[order]
+            vy = np.concatenate([vy, np.zeros(len(held))])[order]
+
+        if start[0] > 0:
+            start = np.concatenate([[0], start])
+            x, y = np.concatenate([x[:1], x]), np.concatenate([y[:1], y])
+            vx, vy = np.concatenate([[0.0], vx]), np.concatenate([[0.0], vy])
+
+        return TrajectoryPieces(start=start, x=x, y=y, vx=vx, vy=vy)
+
+    # One vectorized pass over all ticks. Follows Human.move: an agent starts at
+    # its first keyframe (and keeps whatever motion moved it away from it until
+    # then), snaps to every later keyframe, and between keyframes closes the
+    # remaining distance evenly, reaching the next keyframe one tick early.
+    def _compile_schedule(self, num_ticks: int) -> TrajectorySchedule:
+        ticks = np.arange(num_ticks)
+        times = np.asarray(self.times, dtype=np.int64)
+        xs = np.asarray(self.xs, dtype=float)
+        ys = np.asarray(self.ys, dtype=float)
+
+        keyframe = np.isin(ticks, times)
+        snap = keyframe & (ticks != times[0])
+
+        next_index = np.searchsorted(times, ticks, side="right")
+        has_next = next_index < len(times)
+        moving = has_next & ~keyframe
+
+        next_index = np.minimum(next_index, len(times) - 1)
+        next_t = times[next_index]
+        before_first = ticks < times[0]
+        prev_index = np.maximum(next_index - 1, 0)
+        prev_t = np.where(before_first, ticks, times[prev_index])
+
+        # remaining fraction of the segment at the end of each tick
+        steps = np.maximum(next_t - prev_t - 1, 1)
+        remaining = np.clip((next_t - ticks - 1) / steps, 0.0, 1.0)
+        interpolating = moving & ~before_first
+
+        held_index = np.where(before_first, 0, np.where(has_next, prev_index, -1))
+
+        def baseline(values):
+            held = values[held_index]
+            target = values[next_index]
+            return np.where(interpolating, target - (target - held) * remaining, held)
+
+        dt = np.maximum(next_t - ticks, 1)
+        carry = np.where(interpolating, 1 - 1 / dt, 1.0)
+        carry[snap] = 0.0
+
+        return TrajectorySchedule(
+            keyframe=keyframe,
+            snap=snap,
+            moving=moving,
+            next_t=next_t,
+            next_x=xs[next_index],
+            next_y=ys[next_index],
+            held_x=xs[held_index],
+            held_y=ys[held_index],
+            baseline_x=baseline(xs),
+            baseline_y=baseline(ys),
+            carry=carry,
+        )
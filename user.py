@@ -1,43 +1,59 @@
 from dataclasses import dataclass
 from typing import List
 import math
-import random
+
+import numpy as np
 
 from agents import HumanStatus
 from probability import *
 
+HUMAN_MOTION_MODEL = "noisy_interp"  # "none", "random_walk", "noisy_interp" or "interp"
 
-# Called if there's no location data for this timestep
+
+# Called if there's no location data for this timestep. Noise is drawn from
+# the human's own stream (see streams.py)
 def human_motion(human, current_time):
-    next_time, next_location = next(
-        (
-            (t, loc)
-            for t, loc in sorted(human.location_history.items())
-            if t > current_time
-        ),
-        (None, None),
-    )
+    match HUMAN_MOTION_MODEL:
+        case "none":
+            # DO NOTHING
+            return
 
-    # DO NOTHING
-    # return
+        case "random_walk":
+            # RANDOM WALK
+            human.location.x += human.motion_stream.integers(-5, 5)
+            human.location.y += human.motion_stream.integers(-5, 5)
+            return
 
-    # RANDOM WALK
-    # human.location.x += random.randint(-5, 5)
-    # human.location.y += random.randint(-5, 5)
-    # return
+        case "noisy_interp":
+            # NOISY LINEAR INTERPOLATION
+            next_time = human.trajectory.next_keyframe_time(current_time)
+            if next_time is None:
+                return
+            next_location = human.keyframe(next_time)
+
+            dx = next_location.x - human.location.x
+            dy = next_location.y - human.location.y
+            dt = next_time - current_time
+
+            max_noise = 8
 
-    # NOISY LINEAR INTERPOLATION
-    if next_location is None:
-        return
+            noise = human.motion_stream
+            human.location.x += dx / dt + noise.integers(-max_noise, max_noise)
+            human.location.y += dy / dt + noise.integers(-max_noise, max_noise)
 
-    dx = next_location.x - human.location.x
-    dy = next_location.y - human.location.y
-    dt = next_time - current_time
+        case "interp":
+            # LINEAR INTERPOLATION, without noise
+            next_time = human.trajectory.next_keyframe_time(current_time)
+            if next_time is None:
+                return
+            next_location = human.keyframe(next_time)
 
-    max_noise = 8
+            dt = next_time - current_time
+            human.location.x += (next_location.x - human.location.x) / dt
+            human.location.y += (next_location.y - human.location.y) / dt
 
-    human.location.x += dx / dt + random.randint(-max_noise, max_noise)
-    human.location.y += dy / dt + random.randint(-max_noise, max_noise)
+        case _:
+            raise ValueError(f"Unknown human motion model {HUMAN_MOTION_MODEL}")
 
 
 # Called if there's no location data for this timestep
@@ -46,9 +62,9 @@ def animal_motion(animal):
     return
 
     # RANDOM WALK
-    # animal.location.x += random.randint(-5, 5)
-    # animal.location.y += random.randint(-5, 5)
-    # animal.radius += random.randint(-5, 5)
+    # animal.location.x += animal.motion_stream.integers(-5, 5)
+    # animal.location.y += animal.motion_stream.integers(-5, 5)
+    # animal.radius += animal.motion_stream.integers(-5, 5)
 
 
 # P(zoonotic) model for a sick human
@@ -114,6 +130,125 @@ def infection_probability_model(
         return False
 
     p_got_sick = 1 - math.exp(-human.infection_model.total_experienced_hazard())
-    got_sick = random.random() < p_got_sick
+    got_sick = human.infection_stream.random() < p_got_sick
 
     return got_sick
+
+
+# Vectorized counterparts of the models above, used by the NumPy engines.
+# Arrays are indexed by human (or by trial and human for batched trials);
+# keep these in sync with the per-agent models.
+def batch_output_hazard(sick: np.ndarray) -> np.ndarray:
+    return np.where(sick, HUMAN_HAZARD_SICK, HUMAN_HAZARD_HEALTHY)
+
+
+# animal_exposure / human_exposure are the summed output hazards of each human's
+# current contacts; experienced hazards are updated in place. Draws come from
+# rng, a numpy Generator or a stand-in with its random(size).
+def batch_infection_probability_model(
+    animal_hazard: np.ndarray,
+    human_hazard: np.ndarray,
+    animal_exposure: np.ndarray,
+    human_exposure: np.ndarray,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    animal_hazard *= HAZARD_DECAY
+    animal_hazard += animal_exposure
+    human_hazard *= HAZARD_DECAY
+    human_hazard += human_exposure
+
+    if not SIMULATE_SPREAD:
+        return np.zeros(animal_hazard.shape, dtype=bool)
+
+    p_got_sick = 1 - np.exp(-(animal_hazard + human_hazard))
+    return rng.random(p_got_sick.shape) < p_got_sick
+
+
+# human_motion for (trials x humans) arrays at tick t. Positions are expressed as
+# each trial's offsets ex, ey (updated in place) from a path shared by every
+# trial, which is returned; schedule holds the (humans x ticks) arrays of
+# trajectory.TrajectorySchedule
+def batch_human_motion(ex, ey, schedule, t, rng):
+    match HUMAN_MOTION_MODEL:
+        case "none":
+            # DO NOTHING
+            return schedule.held_x[:, t], schedule.held_y[:, t]
+
+        case "random_walk":
+            # RANDOM WALK, around the latest keyframe
+            moving = ~schedule.keyframe[:, t]
+            ex *= ~schedule.snap[:, t]
+            ey *= ~schedule.snap[:, t]
+            ex += np.where(moving, rng.integers(-5, 5, ex.shape, endpoint=True), 0)
+            ey += np.where(moving, rng.integers(-5, 5, ey.shape, endpoint=True), 0)
+            return schedule.held_x[:, t], schedule.held_y[:, t]
+
+        case "noisy_interp":
+            # NOISY LINEAR INTERPOLATION, as a deviation from the noise-free path
+            # that shrinks by the share carry[t] of it not yet walked each tick
+            max_noise = 8
+            moving = schedule.moving[:, t]
+            noise_x = rng.integers(-max_noise, max_noise, ex.shape, endpoint=True)
+            noise_y = rng.integers(-max_noise, max_noise, ey.shape, endpoint=True)
+
+            ex *= schedule.carry[:, t]
+            ey *= schedule.carry[:, t]
+            ex += np.where(moving, noise_x, 0)
+            ey += np.where(moving, noise_y, 0)
+            return schedule.baseline_x[:, t], schedule.baseline_y[:, t]
+
+        case "interp":
+            # LINEAR INTERPOLATION, the noise-free path itself
+            return schedule.baseline_x[:, t], schedule.baseline_y[:, t]
+
+        case _:
+            raise ValueError(f"Unknown human motion model {HUMAN_MOTION_MODEL}")
+
+
+def batch_animal_motion(x, y, radius, moving, rng):
+    # DO NOTHING
+    return
+
+
+def batch_zoonotic_probability_model(
+    animal_hazard: np.ndarray, secondary_cases: np.ndarray
+) -> np.ndarray:
+    return bayesian_p_zoonotic_batch(
+        hazard_experienced=animal_hazard, secondary_cases=secondary_cases
+    )
+
+
+# Closed-form counterparts of the motion and hazard models above, used by the
+# event-driven engine (events.py); keep these in sync with them too. Motion is
+# only deterministic without noise, and animals hold their keyframes.
+def human_motion_pieces(trajectory):
+    match HUMAN_MOTION_MODEL:
+        case "none":
+            return trajectory.pieces(interpolate=False)
+        case "interp":
+            return trajectory.pieces(interpolate=True)
+        case _:
+            raise ValueError(
+                f"Human motion model {HUMAN_MOTION_MODEL} is not deterministic"
+            )
+
+
+def animal_motion_pieces(trajectory):
+    return trajectory.pieces(interpolate=False)
+
+
+# experienced hazard after num_ticks ticks of the same exposure each tick
+def decayed_hazard(hazard, exposure, num_ticks):
+    if HAZARD_DECAY == 1:
+        return hazard + exposure * num_ticks
+    decay = HAZARD_DECAY**num_ticks
+    return hazard * decay + exposure * (1 - decay) / (1 - HAZARD_DECAY)
+
+
+# sum of the experienced hazard over those ticks, the -log of the probability of
+# not falling sick during them
+def summed_hazard(hazard, exposure, num_ticks):
+    if HAZARD_DECAY == 1:
+        return hazard * num_ticks + exposure * num_ticks * (num_ticks + 1) / 2
+    decays = HAZARD_DECAY * (1 - HAZARD_DECAY**num_ticks) / (1 - HAZARD_DECAY)
+    return hazard * decays + exposure * (num_ticks - decays) / (1 - HAZARD_DECAY)